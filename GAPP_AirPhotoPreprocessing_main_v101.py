@@ -54,6 +54,7 @@ from GAPP_Script_01_AirPhoto_CanvasSizing_v201 import main_script_01
 from GAPP_Script_02_AutomaticFiducialDetection_v201 import main_script_02
 from GAPP_Script_03_AirPhoto_Reprojection_v201 import main_script_03
 from GAPP_Script_04_AirPhotos_Resize_v201 import main_script_04
+from GAPP_FusedPipeline_v101 import main_script_fused
 
 # from Script_3_AirPhoto_CreateSingleMask_v101 import script3
 
@@ -235,20 +236,35 @@ if __name__ == "__main__":
         print('-> will run the following steps:')
         print(Steps)
 
+        Incremental = check_incremental.get() == 1 # only process new or modified images (or changed parameters)
+
+        # fused execution: each image is read once and all the selected steps are applied in memory
+        if check_fused.get() == 1:
+            main_script_fused(input_0, output_folder[0], template_0, dataset_0, chosen_p_0, stripes_0, camera,
+                              scale_percent_0, chosen_HistoCal_0, chosen_SharpIntensity_0, Steps,
+                              SaveIntermediates=check_intermediates.get() == 1, Incremental=Incremental,
+                              ComposedResampling=check_composed.get() == 1)
+            return
 
         # scripts
         # 01_CanvasSizing
         if Steps['Script_01'] == 1:
-            main_script_01(input_0,output_canvas_sized)
+            main_script_01(input_0,output_canvas_sized, VirtualCanvas=check_virtual.get() == 1, Incremental=Incremental)
         # 02_AutomaticFiducialDetection
         if Steps['Script_02'] == 1:
-            main_script_02(output_canvas_sized, template_0, dataset_0, chosen_p_0, stripes_0)
+            main_script_02(output_canvas_sized, template_0, dataset_0, chosen_p_0, stripes_0, Incremental=Incremental)
+        # 03_Reprojection + 04_Resize in one resampling step (the reprojected images are not written)
+        if Steps['Script_03'] == 1 and Steps['Script_04'] == 1 and check_composed.get() == 1:
+            main_script_03(output_canvas_sized, output_resized, fiducialmarks_file, camera, Incremental=Incremental,
+                           scale_percent=scale_percent_0, HistoCal=chosen_HistoCal_0,
+                           SharpeningIntensity=chosen_SharpIntensity_0)
+            return
         # 03_Reprojection
         if Steps['Script_03'] == 1:
-            main_script_03(output_canvas_sized, output_reprojected, fiducialmarks_file, camera)
+            main_script_03(output_canvas_sized, output_reprojected, fiducialmarks_file, camera, Incremental=Incremental)
         # 04_Resize
         if Steps['Script_04'] == 1:
-            main_script_04(output_reprojected, output_resized, scale_percent_0, chosen_HistoCal_0, chosen_SharpIntensity_0)
+            main_script_04(output_reprojected, output_resized, scale_percent_0, chosen_HistoCal_0, chosen_SharpIntensity_0, Incremental=Incremental)
 
 
     #Initialize Buttons:
@@ -259,6 +275,11 @@ if __name__ == "__main__":
     check_02 = tk.IntVar()
     check_03 = tk.IntVar()
     check_04 = tk.IntVar()
+    check_fused = tk.IntVar()
+    check_intermediates = tk.IntVar()
+    check_virtual = tk.IntVar()
+    check_incremental = tk.IntVar(value=1)
+    check_composed = tk.IntVar()
     Steps = {'Script_01': 0, 'Script_02': 0, 'Script_03': 0,
              'Script_04': 0} # by defaulft nothing is runned
 
@@ -277,6 +298,11 @@ if __name__ == "__main__":
     c = ttk.Checkbutton(root, text="Script_02: Fiducial Detection", variable=check_02).grid(row=31,column=2, sticky="w")
     c = ttk.Checkbutton(root, text="Script_03: Reproject", variable=check_03).grid(row=32,column=1, sticky="w")
     c = ttk.Checkbutton(root, text="Script_04: Downsampling", variable=check_04).grid(row=32,column=2, sticky="w")
+    c = ttk.Checkbutton(root, text="Fused execution (read each image once)", variable=check_fused).grid(row=31,column=3,columnspan=4, sticky="w")
+    c = ttk.Checkbutton(root, text="Save intermediate images", variable=check_intermediates).grid(row=32,column=3,columnspan=4, sticky="w")
+    c = ttk.Checkbutton(root, text="Virtual canvas (no padded copies)", variable=check_virtual).grid(row=33,column=1,columnspan=2, sticky="w")
+    c = ttk.Checkbutton(root, text="Only process new or modified images", variable=check_incremental).grid(row=33,column=3,columnspan=4, sticky="w")
+    c = ttk.Checkbutton(root, text="Reproject and downsample in one step", variable=check_composed).grid(row=34,column=1,columnspan=4, sticky="w")
 
     # buttonUpdate = ttk.Button(root, text=" update ", style='Accent.TButton', command=click_me).grid(row=31,column=3,columnspan = 2, sticky="w")
 
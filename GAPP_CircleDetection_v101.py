@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON MODULE FOR THE CIRCLE DETECTION OF THE FIDUCIAL MARKS (FALLBACK OF THE TEMPLATE MATCHING)
+------------------------------------------------------------------------------
+When the template matching of a corner fails twice (SCRIPT 02), the fiducial is searched as a circle whose radius is
+given by the template (centre of the template +/- 50 pixels). Instead of running cv2.HoughCircles again and again on
+the full resolution corner with a lower and lower accumulator threshold (up to 50 transforms per corner), the circle
+is searched here once, on a downsampled corner: the edge pixels (Canny, thin edges) vote for the centres along their
+gradient direction, only for the radii of the band, in a single accumulator. The best peaks of the accumulator are
+then scored by the part of their circumference supported by edge pixels, and the centre of the best one is refined at
+full resolution: least squares fit of the pixels of a ring around the circle whose gradient is radial, weighted by the
+gradient magnitude (the threshold is taken from the ring itself: in a large corner, the edges of the fiducial are a
+small part of all the edges). The work is bounded (downsampling, number of edge pixels and of candidates) and stops at
+CircleTimeBudget.
+
+Version: 1.0.1
+
+Notes:
+
+    - Specific Python modules needed for this script:
+        > Numpy
+        > OpenCV
+
+    - The fiducial can be darker or brighter than its background: the edge pixels vote in both directions.
+
+    - Run this module (python GAPP_CircleDetection_v101.py) to check the detection on synthetic noisy disks of known
+      centre (see check_synthetic).
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import time
+import numpy as np
+import cv2
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+CircleScale = 24 # radius (in pixels) of the smallest circle of the band in the downsampled corner
+CircleCandidates = 5 # number of accumulator peaks scored
+CircleMinSupport = 0.3 # minimum part of the circumference supported by edge pixels to accept a circle
+MaxEdgePoints = 20000 # maximum number of edge pixels voting (the strongest gradients are kept)
+MinFitPoints = 20 # minimum number of full resolution edge pixels to refine the centre
+RadialCosine = 0.9 # minimum cosine between the gradient and the radius for a pixel to be used by the refinement
+RingEdgeFraction = 0.5 # pixels of the ring used by the refinement: gradient above this fraction of the strongest
+                       # gradients of the ring (99th percentile)
+CircleTimeBudget = 2.0 # (seconds) maximum time spent per corner
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+
+def to_8bit(image):
+    if image.dtype == np.uint16:
+        return (image >> 8).astype(np.uint8)
+    if image.dtype != np.uint8:
+        return cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    return image
+
+
+def edge_points(image, max_points=None):
+    """
+    Edge pixels of an image (Canny) and their gradient direction
+
+    :param image: 8-bit image
+    :param max_points: (optional) maximum number of edge pixels (the strongest gradients are kept)
+    :return: u, v (coordinates), du, dv (unit gradient) arrays
+    """
+    blurred = cv2.GaussianBlur(image, (5, 5), 0)
+    gx = cv2.Sobel(blurred, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(blurred, cv2.CV_32F, 0, 1, ksize=3)
+    magnitude = np.abs(gx) + np.abs(gy) # as in cv2.Canny
+    high = float(np.percentile(magnitude, 95))
+    if high <= 0: # flat image
+        empty = np.zeros(0, dtype=np.float32)
+        return empty, empty, empty, empty
+    v, u = np.nonzero(cv2.Canny(blurred, high / 2, high))
+    if max_points is not None and len(u) > max_points:
+        keep = np.argpartition(magnitude[v, u], -max_points)[-max_points:]
+        u, v = u[keep], v[keep]
+    du, dv = gx[v, u], gy[v, u]
+    norm = np.hypot(du, dv)
+    norm[norm == 0] = 1
+    return u.astype(np.float32), v.astype(np.float32), du / norm, dv / norm
+
+
+def circle_accumulator(shape, u, v, du, dv, min_radius, max_radius):
+    """
+    Hough accumulator of the circle centres: each edge pixel votes, along its gradient direction (both ways), for the
+    centres at min_radius to max_radius from it
+
+    :return: accumulator (float32, shape of the image)
+    """
+    height, width = shape[:2]
+    radii = np.arange(min_radius, max_radius + 1, dtype=np.float32)
+    votes = np.zeros(height * width)
+    for sign in [1, -1]:
+        cu = np.rint(u[:, None] + sign * radii[None, :] * du[:, None]).astype(np.int64)
+        cv = np.rint(v[:, None] + sign * radii[None, :] * dv[:, None]).astype(np.int64)
+        inside = (cu >= 0) & (cu < width) & (cv >= 0) & (cv < height)
+        votes += np.bincount(cv[inside] * width + cu[inside], minlength=height * width)
+    return cv2.GaussianBlur(votes.reshape(height, width).astype(np.float32), (0, 0), 1)
+
+
+def accumulator_peaks(acc, number, min_distance):
+    """
+    Local maxima of the accumulator, best first
+
+    :return: list of (u, v)
+    """
+    size = 2 * max(1, int(min_distance)) + 1
+    peaks = (acc == cv2.dilate(acc, np.ones((size, size), np.uint8))) & (acc > 0)
+    v, u = np.nonzero(peaks)
+    order = np.argsort(acc[v, u])[::-1][:number]
+    return list(zip(u[order], v[order]))
+
+
+def circle_support(u, v, cu, cv, min_radius, max_radius):
+    """
+    Radius of the circle centred on (cu, cv) with the most edge pixels, and part of its circumference supported by
+    edge pixels (ring of 3 pixels)
+
+    :return: radius, support (0 to ~1)
+    """
+    d = np.rint(np.hypot(u - cu, v - cv)).astype(np.int64)
+    d = d[(d >= min_radius) & (d <= max_radius)]
+    if len(d) == 0:
+        return min_radius, 0
+    counts = np.convolve(np.bincount(d - min_radius, minlength=max_radius - min_radius + 1), np.ones(3), 'same')
+    radius = int(np.argmax(counts)) + min_radius
+    return radius, counts.max() / (2 * np.pi * max(1, radius))
+
+
+def radial_edges(image, cu, cv, radius, tolerance):
+    """
+    Edge pixels of the ring of the circle (at less than tolerance from it) whose gradient is radial, with a gradient
+    threshold taken from the ring itself (see RingEdgeFraction)
+
+    :return: x, y (coordinates relative to the centre), weights (gradient magnitude) arrays
+    """
+    r0 = int(radius + tolerance) + 3
+    u0, v0 = max(0, int(cu) - r0), max(0, int(cv) - r0)
+    u1, v1 = min(image.shape[1], int(cu) + r0 + 1), min(image.shape[0], int(cv) + r0 + 1)
+    empty = np.zeros(0)
+    if u1 - u0 < 8 or v1 - v0 < 8:
+        return empty, empty, empty
+    blurred = cv2.GaussianBlur(image[v0:v1, u0:u1].astype(np.float32), (5, 5), 0)
+    gx = cv2.Sobel(blurred, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(blurred, cv2.CV_32F, 0, 1, ksize=3)
+    y, x = np.mgrid[v0:v1, u0:u1]
+    x, y = x - cu, y - cv # relative to the centre, for the conditioning
+    d = np.hypot(x, y)
+    magnitude = np.hypot(gx, gy)
+    ring = (np.abs(d - radius) <= tolerance) & (magnitude > 0)
+    if not ring.any():
+        return empty, empty, empty
+    radial = np.abs(gx * x + gy * y) >= RadialCosine * magnitude * np.maximum(d, 1e-6)
+    strong = magnitude >= RingEdgeFraction * np.percentile(magnitude[ring], 99)
+    keep = ring & radial & strong
+    return x[keep].astype(np.float64), y[keep].astype(np.float64), magnitude[keep].astype(np.float64)
+
+
+def refine_circle(image, cu, cv, radius, tolerance):
+    """
+    Refine a circle on the full resolution image: least squares fit (algebraic, weighted by the gradient magnitude)
+    of the radial edge pixels at less than tolerance from the circle (see radial_edges), done again in a narrower
+    ring around the first fit
+
+    :return: cu, cv, radius (the input circle if the fit is not possible)
+    """
+    for ring_tolerance in [tolerance, min(tolerance, 3)]:
+        x, y, weights = radial_edges(image, cu, cv, radius, ring_tolerance)
+        if len(x) < MinFitPoints:
+            break
+        # x^2 + y^2 + a x + b y + c = 0
+        w = np.sqrt(weights)
+        A = np.column_stack([x, y, np.ones(len(x))]) * w[:, None]
+        (a, b, c), _, _, _ = np.linalg.lstsq(A, -(x ** 2 + y ** 2) * w, rcond=None)
+        du, dv = -a / 2, -b / 2
+        r2 = du ** 2 + dv ** 2 - c
+        if r2 <= 0 or np.hypot(du, dv) > ring_tolerance: # the fit left the ring
+            break
+        cu, cv, radius = cu + du, cv + dv, float(np.sqrt(r2))
+    return cu, cv, radius
+
+
+def find_circle(corner_image, MinRadius, MaxRadius, time_budget=None):
+    """
+    Find the fiducial circle of a corner (radius between MinRadius and MaxRadius), see the module description
+
+    :param corner_image: corner image (any depth)
+    :param time_budget: (seconds) maximum time (None: CircleTimeBudget). The best circle found is returned when the
+                        budget is reached (not refined), None if none yet
+    :return: u, v, radius of the circle in the corner image, or None if no circle is found
+    """
+    deadline = time.perf_counter() + (CircleTimeBudget if time_budget is None else time_budget)
+    MinRadius = max(1, int(MinRadius))
+    MaxRadius = max(MinRadius, int(np.ceil(MaxRadius)))
+    image = to_8bit(corner_image)
+
+    # downsampled corner: the smallest radius of the band becomes ~CircleScale pixels
+    factor = max(1, MinRadius // CircleScale)
+    small = image
+    if factor > 1:
+        small = cv2.resize(image, (max(1, image.shape[1] // factor), max(1, image.shape[0] // factor)),
+                           interpolation=cv2.INTER_AREA)
+    min_radius, max_radius = max(1, MinRadius // factor), -(-MaxRadius // factor)
+
+    u, v, du, dv = edge_points(small, MaxEdgePoints)
+    if len(u) == 0 or time.perf_counter() > deadline:
+        return None
+    acc = circle_accumulator(small.shape, u, v, du, dv, min_radius, max_radius)
+
+    best = None
+    for cu, cv in accumulator_peaks(acc, CircleCandidates, min_radius):
+        if time.perf_counter() > deadline:
+            break
+        radius, support = circle_support(u, v, cu, cv, min_radius, max_radius)
+        if support >= CircleMinSupport and (best is None or support > best[3]):
+            best = (cu, cv, radius, support)
+    if best is None:
+        return None
+
+    # centre of the pixels of the downsampled corner, in the full resolution corner
+    cu, cv, radius = (best[0] + 0.5) * factor - 0.5, (best[1] + 0.5) * factor - 0.5, best[2] * factor
+    if time.perf_counter() > deadline:
+        return cu, cv, radius
+    return refine_circle(image, cu, cv, radius, 2 * factor)
+
+
+def check_synthetic(radii=(50, 100, 200, 300, 400), noise=10, size=2500, seed=0):
+    """
+    Check of find_circle on synthetic disks (dark on a bright noisy background) of known centre and radius: the
+    error of the centre found is printed for each radius
+
+    :return: list of (radius, centre error in pixels), nan if not found
+    """
+    rng = np.random.default_rng(seed)
+    errors = []
+    for radius in radii:
+        cu, cv = size / 2 + rng.uniform(-200, 200), size / 2 + rng.uniform(-200, 200)
+        image = np.full((size, size), 200, dtype=np.uint8)
+        cv2.circle(image, (int(round(cu * 16)), int(round(cv * 16))), int(round(radius * 16)), 60, -1,
+                   lineType=cv2.LINE_AA, shift=4)
+        image = np.clip(image + rng.normal(0, noise, image.shape), 0, 255).astype(np.uint8)
+        circle = find_circle(image, MinRadius=radius - 50, MaxRadius=radius + 50, time_budget=60)
+        error = np.nan if circle is None else float(np.hypot(circle[0] - cu, circle[1] - cv))
+        errors.append((radius, error))
+        print('  radius ' + str(radius) + ': centre error ' + str(round(error, 3)) + ' pixels')
+    return errors
+
+
+if __name__ == "__main__":
+    check_synthetic()
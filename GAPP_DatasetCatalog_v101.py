@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON MODULE FOR THE CATALOG (MANIFEST) OF AN AERIAL PHOTO DATASET
+------------------------------------------------------------------------------
+This module lists the images of a dataset folder (and its sub directories) and reads, in parallel and from the file
+headers only (no pixel is decoded), the information needed by the GAPP scripts: size, data type, bit depth,
+compression, tiling, file size and modification time (integer nanoseconds). The result is saved as a manifest (_dataset_manifest.csv) in
+the dataset folder, so that the next runs (and the other scripts) only read the headers of new or modified files
+instead of opening every image again.
+
+Version: 1.0.1
+
+Notes:
+
+    - Specific Python modules needed for this script:
+        > Joblib
+        > Pandas
+        > Pillow
+
+    - If the dataset folder is read-only (e.g., archive on a NAS), the manifest is simply not saved and the headers
+      are read again at each run.
+
+    - The scripts do not all list the same images (e.g., SCRIPT 01: .tif and .tiff files of the sub directories too,
+      SCRIPT 05: one extension, folder only): the lines of the images listed by the other scripts are kept in the
+      manifest, so that they do not read all the headers again after each other.
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import os
+from PIL import Image
+Image.MAX_IMAGE_PIXELS = None # scans are larger than the default PIL limit (header only is read here)
+import pandas as pd
+from joblib import Parallel, delayed
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+manifest_name = '_dataset_manifest.csv'
+image_extensions = ['.tif', '.tiff'] # (case insensitive)
+
+#### PARALLEL READING OF THE HEADERS #####
+# reading headers is limited by the disk (or network) latency, not by the CPU: threads are used
+num_threads = 16
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+catalog_columns = ['name', 'path', 'width', 'height', 'dtype', 'bits', 'samples', 'compression', 'tiled',
+                   'tile_width', 'tile_height', 'file_size', 'mtime_ns']
+
+# numpy data type of the PIL image modes
+mode_dtypes = {'1': 'bool', 'L': 'uint8', 'P': 'uint8', 'RGB': 'uint8', 'RGBA': 'uint8', 'CMYK': 'uint8',
+               'I;16': 'uint16', 'I;16B': 'uint16', 'I;16L': 'uint16', 'I;16N': 'uint16', 'I': 'int32',
+               'F': 'float32'}
+
+
+def list_image_files(folder, recursive=True, extensions=None):
+    """
+    List the image files of a folder (and its sub directories if recursive is True)
+
+    :return: list of image paths (sorted)
+    """
+    if extensions is None:
+        extensions = image_extensions
+    extensions = [extension.lower() for extension in extensions]
+
+    images_list_path = []
+    for root, dirs, files in os.walk(folder):
+        images_list_path += [os.path.join(root, file) for file in files
+                             if os.path.splitext(file)[1].lower() in extensions]
+        if recursive is False:
+            break
+    return sorted(images_list_path)
+
+
+def read_header(image_path):
+    """
+    Read the information of an image from its header only (PIL opens the files lazily)
+
+    :param image_path: path of the image
+    :return: dic with the catalog columns
+    """
+    stat = os.stat(image_path)
+    with Image.open(image_path) as img:
+        width, height = img.size
+        tags = getattr(img, 'tag_v2', {})
+        bits = tags.get(258, None) # BitsPerSample
+        if isinstance(bits, tuple):
+            bits = bits[0]
+        if bits is None:
+            bits = 16 if mode_dtypes.get(img.mode) == 'uint16' else 8
+        record = {'name': os.path.basename(image_path),
+                  'path': image_path,
+                  'width': width,
+                  'height': height,
+                  'dtype': mode_dtypes.get(img.mode, img.mode),
+                  'bits': int(bits),
+                  'samples': len(img.getbands()),
+                  'compression': img.info.get('compression', img.format),
+                  'tiled': 322 in tags, # TileWidth
+                  'tile_width': int(tags.get(322, 0)),
+                  'tile_height': int(tags.get(323, 0)),
+                  'file_size': stat.st_size,
+                  'mtime_ns': stat.st_mtime_ns} # integer: compared exactly after the csv round trip
+    return record
+
+
+def manifest_path(folder):
+    return os.path.join(folder, manifest_name)
+
+
+def scan_dataset(folder, recursive=True, extensions=None, previous=None):
+    """
+    Build the catalog of a dataset: one line per image, the headers being read in parallel. Images already present
+    in a previous catalog, with the same file size and modification time, are not opened again.
+
+    :param folder: dataset folder
+    :param previous: (optional) previous catalog (dataframe)
+    :return: catalog (dataframe, sorted by path)
+    """
+    images_list_path = list_image_files(folder, recursive, extensions)
+
+    known = {}
+    if previous is not None and len(previous) > 0:
+        known = {record['path']: record for record in previous.to_dict('records')}
+
+    records = []
+    to_read = []
+    for image_path in images_list_path:
+        record = known.get(image_path)
+        if record is not None:
+            stat = os.stat(image_path)
+            if record['file_size'] == stat.st_size and record.get('mtime_ns') == stat.st_mtime_ns:
+                records.append(record)
+                continue
+        to_read.append(image_path)
+
+    if len(to_read) > 0:
+        print('   reading the header of ' + str(len(to_read)) + ' image(s) (' + str(len(records)) +
+              ' already in the catalog)')
+        records += Parallel(n_jobs=num_threads, prefer="threads")(delayed(read_header)(image_path)
+                                                                  for image_path in to_read)
+
+    catalog = pd.DataFrame(records, columns=catalog_columns)
+    return catalog.sort_values('path').reset_index(drop=True)
+
+
+def load_catalog(folder, recursive=True, extensions=None, save=True):
+    """
+    Load the catalog of a dataset, updated for the new, modified or removed images, and save it in the dataset folder
+
+    :param folder: dataset folder
+    :param recursive: also look into the sub directories
+    :param extensions: image file extensions (by default, see image_extensions)
+    :param save: save the (updated) manifest in the dataset folder
+    :return: catalog (dataframe, see catalog_columns)
+    """
+    previous = None
+    if os.path.isfile(manifest_path(folder)):
+        previous = pd.read_csv(manifest_path(folder))
+
+    catalog = scan_dataset(folder, recursive, extensions, previous)
+
+    if save is True:
+        manifest = catalog
+        if previous is not None and len(previous) > 0: # images out of this listing, still on disk: kept
+            others = previous[~previous['path'].isin(catalog['path']) & previous['path'].map(os.path.isfile)]
+            if len(others) > 0:
+                manifest = pd.concat([catalog, others.reindex(columns=catalog_columns)]).sort_values('path')
+        try:
+            manifest.to_csv(manifest_path(folder), index=False)
+        except OSError as e:
+            print('   ! could not save the dataset manifest (' + str(e) + ')')
+    return catalog
+
+
+def max_dimensions(catalog):
+    """
+    :return: maximum width and height of the images of a catalog
+    """
+    return int(catalog['width'].max()), int(catalog['height'].max())
+
+
+def min_dimensions(catalog):
+    """
+    :return: minimum width and height of the images of a catalog
+    """
+    return int(catalog['width'].min()), int(catalog['height'].min())
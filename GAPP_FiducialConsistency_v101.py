@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON MODULE FOR THE GEOMETRIC CONSISTENCY CHECK OF THE FIDUCIAL MARKS OF A DATASET
+------------------------------------------------------------------------------
+The four fiducial marks of the images taken by one camera always form nearly the same quadrilateral (only shifted,
+rotated and slightly scaled by the scanning). SCRIPT 02 checks each corner on its own, by the value of its template
+matching (maxVal): a wrong mark with a good maxVal is not detected, and ends up in a wrong homography in SCRIPT 03.
+
+Here, the quadrilaterals of all the images are checked at once against the median quadrilateral of the dataset: for
+each image and each corner, a similarity (shift, rotation, scale) is fitted on the three other corners, and the
+distance between the corner and its position predicted by the fit is computed (leave-one-out residual). A corner is
+an outlier if its residual is large while the three other corners agree with the fit. Only these corners are then
+searched again by SCRIPT 02, in a small window around their predicted position. The computations are vectorized on
+all the images (complex numbers: u + i v).
+
+Version: 1.0.1
+
+Notes:
+
+    - Specific Python modules needed for this script:
+        > Numpy
+
+    - An image with two wrong corners or more can not be corrected (no three corners agree): it is reported.
+
+    - Corner order: top_left, top_right, bot_right, bot_left (as the csv of SCRIPT 02).
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import numpy as np
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+ConsistencyMinTolerance = 10 # (pixels) minimum residual for a corner to be an outlier
+ConsistencySigma = 5 # otherwise, outlier if the residual is larger than ConsistencySigma x the robust spread of the
+                     # residuals of the dataset (1.4826 x median)
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+
+def as_complex(quads):
+    """
+    :param quads: (..., 4, 2) coordinates (u, v)
+    :return: (..., 4) complex coordinates u + i v
+    """
+    quads = np.asarray(quads, dtype=np.float64)
+    return quads[..., 0] + 1j * quads[..., 1]
+
+
+def reference_quad(quads):
+    """
+    Median quadrilateral of the complete quadrilaterals of a dataset
+
+    :param quads: (N, 4, 2) coordinates (nan for the corners not found)
+    :return: (4, 2) coordinates, or None if no complete quadrilateral
+    """
+    quads = np.asarray(quads, dtype=np.float64)
+    complete = np.isfinite(quads).all(axis=(1, 2))
+    if not complete.any():
+        return None
+    return np.median(quads[complete], axis=0)
+
+
+def leave_one_out(quads, reference):
+    """
+    For each image and each corner, fit a similarity from the reference to the three other corners (least squares),
+    and compute the distance between the corner and its predicted position
+
+    :param quads: (N, 4, 2) coordinates (nan for the corners not found)
+    :param reference: (4, 2) reference quadrilateral (see reference_quad)
+    :return: residuals (N, 4) of the corners (nan if not found), spreads (N, 4) (largest residual of the three other
+             corners in their own fit, nan if one of them is missing), predicted positions (N, 4, 2)
+    """
+    Z = as_complex(quads)
+    R = as_complex(reference)
+    residuals = np.full(Z.shape, np.nan)
+    spreads = np.full(Z.shape, np.nan)
+    predicted = np.full(Z.shape, np.nan + 0j)
+    for k in range(4):
+        others = [j for j in range(4) if j != k]
+        Zo, Ro = Z[:, others], R[others]
+        mz, mr = Zo.mean(axis=1), Ro.mean()
+        # z = a r + b, a complex (rotation and scale)
+        a = (np.conj(Ro - mr)[None, :] * (Zo - mz[:, None])).sum(axis=1) / (np.abs(Ro - mr) ** 2).sum()
+        b = mz - a * mr
+        predicted[:, k] = a * R[k] + b
+        residuals[:, k] = np.abs(Z[:, k] - predicted[:, k])
+        spreads[:, k] = np.abs(Zo - (a[:, None] * Ro[None, :] + b[:, None])).max(axis=1)
+    return residuals, spreads, np.stack([predicted.real, predicted.imag], axis=-1)
+
+
+def consistency_tolerance(residuals):
+    """
+    Residual above which a corner is an outlier (see ConsistencyMinTolerance and ConsistencySigma)
+
+    :param residuals: (N, 4) leave-one-out residuals (see leave_one_out)
+    """
+    values = residuals[np.isfinite(residuals)]
+    if len(values) == 0:
+        return ConsistencyMinTolerance
+    return max(ConsistencyMinTolerance, ConsistencySigma * 1.4826 * float(np.median(values)))
+
+
+def consistency_outliers(quads, tolerance=None):
+    """
+    Find the corners to search again: outliers (large residual, the three other corners agreeing with each other) and
+    missing corners of images whose three other corners agree
+
+    :param quads: (N, 4, 2) coordinates (nan for the corners not found)
+    :param tolerance: (pixels) residual above which a corner is an outlier (None: see consistency_tolerance)
+    :return: corners (N array: index of the corner to search again for each image, -1 if none), predicted positions
+             (N, 4, 2), inconsistent (N boolean array: images with no three corners agreeing), tolerance
+    """
+    quads = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 2)
+    corners = np.full(len(quads), -1)
+    inconsistent = np.zeros(len(quads), dtype=bool)
+    reference = reference_quad(quads)
+    if reference is None:
+        return corners, np.full(quads.shape, np.nan), inconsistent, tolerance
+    residuals, spreads, predicted = leave_one_out(quads, reference)
+    if tolerance is None:
+        tolerance = consistency_tolerance(residuals)
+
+    agree = spreads <= tolerance # the three other corners agree (nan: False)
+    missing = ~np.isfinite(quads).all(axis=2)
+    candidates = agree & (missing | (residuals > tolerance))
+    # a single wrong corner is the only one whose three other corners agree
+    scores = np.where(candidates, np.where(missing, np.inf, residuals), -np.inf)
+    best = np.argmax(scores, axis=1)
+    found = candidates.any(axis=1)
+    corners[found] = best[found]
+
+    complete = ~missing.any(axis=1)
+    inconsistent = complete & ~found & (np.nan_to_num(residuals, nan=np.inf) > tolerance).any(axis=1) & \
+                   ~agree.any(axis=1)
+    return corners, predicted, inconsistent, tolerance
@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON MODULE FOR THE COARSE-TO-FINE TEMPLATE MATCHING OF THE FIDUCIAL MARKS
+------------------------------------------------------------------------------
+Instead of correlating the full resolution template (~600 px) over the full resolution corner (2500 px or more), the
+template and the corner are first downsampled (image pyramid, cv2.pyrDown) and matched at low resolution. The best
+peaks found at low resolution are then refined at full resolution, in a small neighbourhood only. The result (location
+and maxVal of cv2.matchTemplate with TM_CCOEFF_NORMED) is the one of the full search, as long as the true peak is among
+the low resolution candidates.
+
+To check that it is the case on a dataset, one match out of PyramidVerifyEvery is also computed with the full search:
+the number of times the low resolution step missed the true peak is reported at the end of SCRIPT 02 (and the full
+search result is used for these matches).
+
+When several templates are used for a corner (OneTemplateMax = False in SCRIPT 02), the templates are prepared once
+per run in a TemplateBank (zero-mean templates and norms for each pyramid level, Fourier spectra cached for each corner
+size). All the templates of a corner are then scored in one pass: the spectrum and the local statistics (integral
+images) of the corner are computed once and shared by all the templates. For the parallel processing, the bank is
+saved once per run (see share_bank) and loaded only once by each worker process (see shared_bank), instead of being
+sent with each image.
+
+When a match is weak, SCRIPT 02 tries again with a larger corner crop. The positions of the template that were already
+in the first crop are not matched again: only the border band of new positions is correlated (match_template_band),
+and its best match is compared with the one of the first crop.
+
+The centre of the fiducial can also be estimated at sub-pixel precision (type_fidu = 'subpixel' in SCRIPT 02): the
+correlation peak is fitted with a parabola along each axis (subpixel_match), and the centre of a point-symmetric mark
+(e.g., target) can be refined by matching the mark with its 180 degree rotation (symmetry_centre).
+
+The best peaks of the correlation of each template (and, optionally, its low resolution correlation map) can also be
+returned with the ranking (rank_peaks), so that SCRIPT 02 can save them and decide again with other thresholds
+without matching the templates again.
+
+Version: 1.0.1
+
+Notes:
+
+    - Specific Python modules needed for this script:
+        > Numpy
+        > OpenCV
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import os
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+import cv2
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+PyramidLevels = 2 # maximum number of pyramid levels (each level divides the size of the images by 2)
+MinTemplateSize = 48 # minimum size (in pixels) of the downsampled template (fewer levels are used if needed)
+PyramidCandidates = 3 # number of low resolution peaks refined at full resolution
+RefineRadius = 2 # radius (in low resolution pixels) of the neighbourhood refined at full resolution
+PyramidVerifyEvery = 10 # one match out of PyramidVerifyEvery is checked with a full search (0: never)
+LocationTolerance = 1 # (pixels) and
+ValueTolerance = 1e-3 # (maxVal) tolerances to consider that the coarse step found the true peak
+SymmetryRadius = 40 # half size (in pixels) of the patch matched with its rotation (see symmetry_centre)
+SymmetrySearch = 8 # (pixels) maximum shift searched between the patch and its rotation (centre moved by half of it)
+SymmetryMinScore = 0.5 # minimum correlation between the patch and its rotation to use the symmetry
+SymmetryMinContrast = 0.2 # minimum difference between the peak and the median of the correlation (clear peak)
+SymmetryMaxShift = 1.0 # (pixels) larger corrections of the centre are rejected (the match is already sub-pixel)
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+# matching statistics of the current process, and their values at the last pop_pyramid_stats
+pyramid_stats = {'matches': 0, 'verified': 0, 'missed': 0}
+popped_stats = dict(pyramid_stats)
+
+# Fourier spectra of the templates computed in the current process ({(template key, level, dft size): spectrum})
+spectra_cache = {}
+
+# template banks loaded by the current process ({file path: TemplateBank}, see shared_bank)
+loaded_banks = {}
+
+
+def as_matching_images(*images):
+    """
+    Images in a data type accepted by cv2.matchTemplate and cv2.goodFeaturesToTrack: 8-bit images are kept as they
+    are, the others (16-bit, see NativeDepth in SCRIPT 02) are converted to float32.
+    """
+    if all(image.dtype == np.uint8 for image in images):
+        return images
+    return tuple(image.astype(np.float32) for image in images)
+
+
+def full_search(image, template):
+    """
+    Full resolution template matching (cv2.matchTemplate, TM_CCOEFF_NORMED)
+
+    :return: maxVal, maxLoc (u, v) of the top-left corner of the template
+    """
+    res = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+    (_, maxVal, _, maxLoc) = cv2.minMaxLoc(res)
+    return maxVal, maxLoc
+
+
+def pyramid_levels(image, template):
+    """
+    Number of pyramid levels that can be used for a template and an image (see PyramidLevels and MinTemplateSize)
+    """
+    levels = 0
+    while levels < PyramidLevels and min(template.shape[:2]) >> (levels + 1) >= MinTemplateSize:
+        levels = levels + 1
+    return levels
+
+
+def coarse_peaks(res, number, template_shape):
+    """
+    Locations of the highest peaks of a correlation map, at least half a template away from each other
+
+    :return: list of (u, v)
+    """
+    res = np.array(res, copy=True)
+    peaks = []
+    half_height, half_width = max(1, template_shape[0] // 2), max(1, template_shape[1] // 2)
+    for i in range(number):
+        (_, maxVal, _, maxLoc) = cv2.minMaxLoc(res)
+        if not np.isfinite(maxVal) or maxVal <= -1:
+            break
+        peaks.append(maxLoc)
+        res[max(0, maxLoc[1] - half_height):maxLoc[1] + half_height + 1,
+            max(0, maxLoc[0] - half_width):maxLoc[0] + half_width + 1] = -1
+    return peaks
+
+
+def pyramid_search(image, template):
+    """
+    Coarse-to-fine template matching: match at low resolution, then refine the best peaks at full resolution
+
+    :return: maxVal, maxLoc (u, v) of the top-left corner of the template (as full_search)
+    """
+    levels = pyramid_levels(image, template)
+    if levels == 0:
+        return full_search(image, template)
+
+    image_low, template_low = image, template
+    for level in range(levels):
+        image_low, template_low = cv2.pyrDown(image_low), cv2.pyrDown(template_low)
+    if image_low.shape[0] < template_low.shape[0] or image_low.shape[1] < template_low.shape[1]:
+        return full_search(image, template)
+    res_low = cv2.matchTemplate(image_low, template_low, cv2.TM_CCOEFF_NORMED)
+    return refine_peaks(image, template, res_low, levels, template_low.shape)
+
+
+def refine_peaks(image, template, res_low, levels, template_low_shape, number=None):
+    """
+    Refine at full resolution the best peaks of a low resolution correlation map (see pyramid_search)
+
+    :param number: (optional) number of peaks refined and returned (at least PyramidCandidates are refined)
+    :return: maxVal, maxLoc (u, v) of the top-left corner of the template; or, if number is given, list of the
+             refined peaks (maxVal, maxLoc), best first
+    """
+    scale = 2 ** levels
+    radius = RefineRadius * scale
+    height, width = template.shape[:2]
+    peaks = []
+    for u_low, v_low in coarse_peaks(res_low, max(PyramidCandidates, number or 0), template_low_shape):
+        # neighbourhood of the peak at full resolution
+        u0 = max(0, u_low * scale - radius)
+        v0 = max(0, v_low * scale - radius)
+        u1 = min(image.shape[1], u_low * scale + radius + width)
+        v1 = min(image.shape[0], v_low * scale + radius + height)
+        if u1 - u0 < width or v1 - v0 < height:
+            continue
+        maxVal, maxLoc = full_search(image[v0:v1, u0:u1], template)
+        peaks.append((maxVal, (maxLoc[0] + u0, maxLoc[1] + v0)))
+
+    if len(peaks) == 0:
+        peaks = [full_search(image, template)]
+    peaks = sorted(peaks, key=lambda peak: -peak[0])
+    if number is not None:
+        return peaks[:number]
+    return peaks[0]
+
+
+def match_template(image, template, pyramid=True):
+    """
+    Find the best location of a template in an image (TM_CCOEFF_NORMED), with the coarse-to-fine search if pyramid is
+    True (see pyramid_search), and check it with a full search from time to time (see PyramidVerifyEvery)
+
+    :param image: corner image (single-band, 8-bit or float32)
+    :param template: template image (same type)
+    :return: maxVal, maxLoc (u, v) of the top-left corner of the template
+    """
+    if pyramid is False:
+        return full_search(image, template)
+
+    maxVal, maxLoc = pyramid_search(image, template)
+    return verify_match(image, template, maxVal, maxLoc)
+
+
+def band_rectangles(positions, inner=None):
+    """
+    Split the template positions of an image that are not in an inner rectangle into (up to 4) rectangles
+
+    :param positions: (rows, cols) number of template positions in the image
+    :param inner: (v0, u0, v1, u1) inner rectangle of positions (v1 and u1 excluded), or None
+    :return: list of (v0, u0, v1, u1)
+    """
+    rows, cols = positions
+    if rows <= 0 or cols <= 0:
+        return []
+    if inner is None:
+        return [(0, 0, rows, cols)]
+    v0, u0 = max(0, inner[0]), max(0, inner[1])
+    v1, u1 = min(rows, inner[2]), min(cols, inner[3])
+    if v1 <= v0 or u1 <= u0: # no position in common
+        return [(0, 0, rows, cols)]
+    rectangles = [(0, 0, v0, cols), (v1, 0, rows, cols), (v0, 0, v1, u0), (v0, u1, v1, cols)]
+    return [rectangle for rectangle in rectangles if rectangle[2] > rectangle[0] and rectangle[3] > rectangle[1]]
+
+
+def match_template_band(image, template, inner=None, pyramid=True):
+    """
+    Find the best location of a template in an image, among the positions that are not in the inner rectangle (e.g.,
+    the positions already matched in a smaller crop): only the border band of the image is correlated
+
+    :param image: corner image (single-band, 8-bit or float32)
+    :param template: template image (same type)
+    :param inner: (v0, u0, v1, u1) template positions already matched (v1 and u1 excluded), see band_rectangles
+    :return: maxVal, maxLoc (u, v) of the top-left corner of the template in image; (-inf, None) if no new position
+    """
+    height, width = template.shape[:2]
+    positions = (image.shape[0] - height + 1, image.shape[1] - width + 1)
+    best = (-np.inf, None)
+    for v0, u0, v1, u1 in band_rectangles(positions, inner):
+        maxVal, maxLoc = match_template(image[v0:v1 + height - 1, u0:u1 + width - 1], template, pyramid)
+        if maxVal > best[0]:
+            best = (maxVal, (maxLoc[0] + u0, maxLoc[1] + v0))
+    return best
+
+
+def verify_match(image, template, maxVal, maxLoc):
+    """
+    Count a coarse-to-fine match and, one time out of PyramidVerifyEvery, check it with a full search
+
+    :return: maxVal, maxLoc (those of the full search if the coarse step missed the true peak)
+    """
+    pyramid_stats['matches'] = pyramid_stats['matches'] + 1
+    if PyramidVerifyEvery > 0 and pyramid_stats['matches'] % PyramidVerifyEvery == 1 % PyramidVerifyEvery:
+        full_maxVal, full_maxLoc = full_search(image, template)
+        pyramid_stats['verified'] = pyramid_stats['verified'] + 1
+        if full_maxVal - maxVal > ValueTolerance or \
+                max(abs(full_maxLoc[0] - maxLoc[0]), abs(full_maxLoc[1] - maxLoc[1])) > LocationTolerance:
+            pyramid_stats['missed'] = pyramid_stats['missed'] + 1
+            maxVal, maxLoc = full_maxVal, full_maxLoc
+    return maxVal, maxLoc
+
+
+def subpixel_offsets(left, centre, right):
+    """
+    Sub-pixel offset of a peak from three neighbouring values (vertex of the parabola through them). Vectorized: the
+    values can be arrays (e.g., several peaks at once).
+
+    :return: offset(s) of the peak from the centre sample, between -0.5 and 0.5 (0 if not a maximum)
+    """
+    left, centre, right = np.asarray(left, np.float64), np.asarray(centre, np.float64), np.asarray(right, np.float64)
+    curvature = left - 2 * centre + right
+    concave = curvature < 0
+    offsets = np.zeros(np.broadcast(left, centre, right).shape)
+    np.divide(0.5 * (left - right), curvature, out=offsets, where=concave)
+    return np.clip(offsets, -0.5, 0.5)
+
+
+def subpixel_peak(res, loc):
+    """
+    Sub-pixel location of a peak of a correlation map (parabola fit along each axis)
+
+    :param loc: (u, v) integer location of the peak
+    :return: (u, v) float location
+    """
+    u, v = loc
+    height, width = res.shape[:2]
+    du = subpixel_offsets(res[v, u - 1], res[v, u], res[v, u + 1]) if 0 < u < width - 1 else 0
+    dv = subpixel_offsets(res[v - 1, u], res[v, u], res[v + 1, u]) if 0 < v < height - 1 else 0
+    return u + float(du), v + float(dv)
+
+
+def subpixel_match(image, template, maxLoc):
+    """
+    Location of a template match at sub-pixel precision: the correlation (TM_CCOEFF_NORMED) is only computed for the
+    3 x 3 positions around maxLoc, and its peak is fitted (see subpixel_peak)
+
+    :param maxLoc: (u, v) integer location of the match (see match_template)
+    :return: (u, v) float location of the top-left corner of the template
+    """
+    u, v = maxLoc
+    height, width = template.shape[:2]
+    u0, v0 = max(0, u - 1), max(0, v - 1)
+    u1, v1 = min(image.shape[1], u + width + 1), min(image.shape[0], v + height + 1)
+    res = cv2.matchTemplate(*as_matching_images(image[v0:v1, u0:u1], template), cv2.TM_CCOEFF_NORMED)
+    su, sv = subpixel_peak(res, (min(u - u0, res.shape[1] - 1), min(v - v0, res.shape[0] - 1)))
+    return su + u0, sv + v0
+
+
+def symmetry_centre(image, u, v, radius=None, search=None):
+    """
+    Refine the centre of a point-symmetric mark: the patch around (u, v) is matched with its 180 degree rotation. If
+    the mark is centred at (u + d, v + e), the rotated patch matches the patch at a shift of (2 d, 2 e).
+
+    :param radius: half size of the patch (None: SymmetryRadius)
+    :param search: maximum shift searched (None: SymmetrySearch)
+    :return: u, v of the centre (unchanged if the patch is not entirely in the image, has no clear symmetry (e.g.,
+             flat inside of a large mark: the peak is then noise), or if the correction is larger than
+             SymmetryMaxShift)
+    """
+    radius = SymmetryRadius if radius is None else radius
+    search = SymmetrySearch if search is None else search
+    cu, cv = int(round(u)), int(round(v))
+    if cu - radius < 0 or cv - radius < 0 or cu + radius >= image.shape[1] or cv + radius >= image.shape[0] \
+            or radius <= search:
+        return u, v
+    patch = image[cv - radius:cv + radius + 1, cu - radius:cu + radius + 1]
+    rotated = np.ascontiguousarray(patch[::-1, ::-1][search:-search, search:-search])
+    res = cv2.matchTemplate(*as_matching_images(patch, rotated), cv2.TM_CCOEFF_NORMED)
+    (_, maxVal, _, maxLoc) = cv2.minMaxLoc(res)
+    if maxVal < SymmetryMinScore or maxVal - float(np.median(res)) < SymmetryMinContrast:
+        return u, v
+    su, sv = subpixel_peak(res, maxLoc)
+    x, y = cu + (su - search) / 2, cv + (sv - search) / 2
+    if np.hypot(x - u, y - v) > SymmetryMaxShift:
+        return u, v
+    return x, y
+
+
+def window_variances(sums, sqsums, height, width):
+    """
+    Sum of the squared deviations from the mean of the image, for all the windows of height x width pixels
+
+    :param sums: integral image of the image (cv2.integral2)
+    :param sqsums: integral image of the squared image
+    :return: array (one value per template position)
+    """
+    window_sums = sums[height:, width:] - sums[:-height, width:] - sums[height:, :-width] + sums[:-height, :-width]
+    window_sqsums = sqsums[height:, width:] - sqsums[:-height, width:] - sqsums[height:, :-width] + \
+                    sqsums[:-height, :-width]
+    return np.maximum(window_sqsums - window_sums * window_sums / (height * width), 0)
+
+
+def prepare_template(name, template):
+    """
+    Prepare a template for the matching: zero-mean template and squared norm at each pyramid level
+
+    :param template: template image (single-band, see as_detection_image in SCRIPT 02)
+    :return: dic
+    """
+    levels = []
+    template_low = template
+    for level in range(PyramidLevels + 1):
+        zero_mean = template_low.astype(np.float64)
+        zero_mean = zero_mean - zero_mean.mean()
+        levels.append((zero_mean.astype(np.float32), float((zero_mean * zero_mean).sum())))
+        template_low = cv2.pyrDown(template_low)
+    return {'name': name, 'image': template, 'levels': levels,
+            'key': hashlib.sha1(np.ascontiguousarray(template).tobytes()).hexdigest()}
+
+
+class TemplateBank:
+    """
+    Templates of the fiducial marks of a dataset, prepared once per run, and scored all together against a corner
+    image (see rank)
+    """
+
+    def __init__(self, templates, pyramid=True, centers=None):
+        """
+        :param templates: dic {corner: {template name: template image}}
+        :param pyramid: coarse-to-fine matching (see pyramid_search)
+        :param centers: (optional) dic {template name: (xc, yc)} with the centre of the fiducial in each template
+        """
+        self.pyramid = pyramid
+        self.centers = centers if centers is not None else {}
+        self.templates = {corner: [prepare_template(name, template) for name, template in corner_templates.items()]
+                          for corner, corner_templates in templates.items()}
+
+    def key(self):
+        """
+        Fingerprint of the bank (templates, centres and matching mode)
+        """
+        keys = sorted(prepared['key'] for corner_templates in self.templates.values() for prepared in corner_templates)
+        text = str(keys) + str(sorted(self.centers.items())) + str(self.pyramid)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def template_images(self, corner):
+        """
+        :return: dic {template name: template image} of a corner
+        """
+        return {prepared['name']: prepared['image'] for prepared in self.templates.get(corner, [])}
+
+    def spectrum(self, prepared, level, dft_size):
+        """
+        Fourier spectrum (CCS packed, see cv2.dft) of a zero-mean template, padded to dft_size (cached)
+        """
+        key = (prepared['key'], level, dft_size)
+        if key not in spectra_cache:
+            zero_mean = prepared['levels'][level][0]
+            padded = np.zeros(dft_size, dtype=np.float32)
+            padded[:zero_mean.shape[0], :zero_mean.shape[1]] = zero_mean
+            spectra_cache[key] = cv2.dft(padded)
+        return spectra_cache[key]
+
+    def correlation_maps(self, image, corner, level):
+        """
+        TM_CCOEFF_NORMED correlation maps of all the templates of a corner, at a pyramid level, computed in the
+        frequency domain: the spectrum and the integral images of the image are computed once for all the templates
+
+        :param image: corner image, at the pyramid level
+        :return: list of correlation maps (None if the template is larger than the image)
+        """
+        image = image.astype(np.float32)
+        height, width = image.shape[:2]
+        dft_size = (cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width))
+        padded = np.zeros(dft_size, dtype=np.float32)
+        padded[:height, :width] = image
+        image_spectrum = cv2.dft(padded)
+        sums, sqsums = cv2.integral2(image, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+        variances = {}
+        maps = []
+        for prepared in self.templates[corner]:
+            zero_mean, norm = prepared['levels'][level]
+            h, w = zero_mean.shape[:2]
+            if h > height or w > width:
+                maps.append(None)
+                continue
+            if (h, w) not in variances:
+                variances[(h, w)] = window_variances(sums, sqsums, h, w)
+            correlation = cv2.idft(cv2.mulSpectrums(image_spectrum, self.spectrum(prepared, level, dft_size), 0,
+                                                    conjB=True), flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)
+            correlation = correlation[:height - h + 1, :width - w + 1].astype(np.float64)
+
+            # normalisation (as cv2.matchTemplate: values of flat windows are set to 0, or +/-1 if close to the limit)
+            denominator = np.sqrt(variances[(h, w)] * norm)
+            res = np.divide(correlation, denominator, out=np.zeros_like(correlation),
+                            where=np.abs(correlation) < denominator)
+            limit = (np.abs(correlation) >= denominator) & (np.abs(correlation) < 1.125 * denominator)
+            res[limit] = np.sign(correlation[limit])
+            maps.append(res.astype(np.float32))
+        return maps
+
+    def rank(self, image, corner):
+        """
+        Score all the templates of a corner against a corner image (TM_CCOEFF_NORMED), in one pass
+
+        :param image: corner image (single-band)
+        :param corner: corner name (e.g., 'top_left')
+        :return: list of (template name, maxVal, maxLoc), the best template first
+        """
+        return self.rank_peaks(image, corner)[0]
+
+    def rank_peaks(self, image, corner, number=None, map_size=None):
+        """
+        Same as rank, also returning the best peaks of each template (and its correlation map, if map_size is given)
+
+        :param number: number of peaks returned per template (None: only the best one)
+        :param map_size: (optional) maximum size (in pixels) of the correlation maps returned (downsampled, float16)
+        :return: ranking (see rank), dic {template name: list of (maxVal, maxLoc), best first}, dic {template name:
+                 correlation map or None}
+        """
+        prepared_list = self.templates.get(corner, [])
+        if len(prepared_list) == 0:
+            return [], {}, {}
+
+        levels = 0
+        if self.pyramid is True:
+            levels = min(pyramid_levels(image, prepared['image']) for prepared in prepared_list)
+        image_low = image
+        for level in range(levels):
+            image_low = cv2.pyrDown(image_low)
+
+        ranking = []
+        peaks = {}
+        maps = {}
+        for prepared, res in zip(prepared_list, self.correlation_maps(image_low, corner, levels)):
+            others = []
+            if res is None: # template larger than the (low resolution) image
+                maxVal, maxLoc = full_search(*as_matching_images(image, prepared['image']))
+            elif levels == 0:
+                (_, maxVal, _, maxLoc) = cv2.minMaxLoc(res)
+                if number is not None:
+                    others = [(float(res[v, u]), (u, v)) for u, v in
+                              coarse_peaks(res, number, prepared['levels'][0][0].shape)[1:]]
+            else:
+                image_match, template_match = as_matching_images(image, prepared['image'])
+                refined = refine_peaks(image_match, template_match, res, levels,
+                                       prepared['levels'][levels][0].shape, number)
+                if number is None:
+                    refined = [refined]
+                maxVal, maxLoc = verify_match(image_match, template_match, *refined[0])
+                others = refined[1:]
+            ranking.append((prepared['name'], maxVal, maxLoc))
+            peaks[prepared['name']] = ([(maxVal, maxLoc)] + others)[:max(1, number or 1)]
+            maps[prepared['name']] = None
+            if map_size is not None and res is not None:
+                scale = min(1.0, map_size / max(res.shape[:2]))
+                maps[prepared['name']] = cv2.resize(res, (max(1, int(res.shape[1] * scale)),
+                                                          max(1, int(res.shape[0] * scale))),
+                                                    interpolation=cv2.INTER_AREA).astype(np.float16)
+        return sorted(ranking, key=lambda match: -match[1]), peaks, maps
+
+
+def share_bank(bank):
+    """
+    Save a template bank to a temporary file, to be loaded once by each worker process (see shared_bank)
+
+    :return: path of the file
+    """
+    path = os.path.join(tempfile.gettempdir(), '_gapp_templates_' + bank.key() + '.pkl')
+    if not os.path.isfile(path):
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(bank, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def shared_bank(bank):
+    """
+    Template bank of the current process
+
+    :param bank: TemplateBank, or path of a bank saved with share_bank (loaded only at the first call in each process)
+    :return: TemplateBank
+    """
+    if isinstance(bank, TemplateBank):
+        return bank
+    if bank not in loaded_banks:
+        with open(bank, 'rb') as f:
+            loaded_banks[bank] = pickle.load(f)
+    return loaded_banks[bank]
+
+
+def pop_pyramid_stats():
+    """
+    Return the matching statistics of the current process since the last call (e.g., for each image)
+    """
+    stats = {key: pyramid_stats[key] - popped_stats[key] for key in pyramid_stats}
+    popped_stats.update(pyramid_stats)
+    return stats
+
+
+def report_pyramid_stats(stats_list):
+    """
+    Print how often the coarse step missed the true peak, for the matches checked with a full search
+
+    :param stats_list: list of statistics (see pop_pyramid_stats), e.g., one per image
+    """
+    stats_list = [stats for stats in stats_list if stats is not None]
+    matches = sum(stats['matches'] for stats in stats_list)
+    verified = sum(stats['verified'] for stats in stats_list)
+    missed = sum(stats['missed'] for stats in stats_list)
+    if matches == 0:
+        return
+    print("\n-------------------------------------------------------------------------\n"
+          "coarse-to-fine matching: " + str(matches) + " matches, " + str(verified) +
+          " checked with a full search, " + str(missed) + " missed the true peak" +
+          (" (" + str(round(100 * missed / verified, 1)) + " %)" if verified > 0 else ""))
+    if missed > 0:
+        print("  ! consider increasing PyramidCandidates or RefineRadius, or decreasing PyramidLevels "
+              "(GAPP_FiducialMatching)")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON MODULE FOR THE INDEXED STORE OF THE FIDUCIAL COORDINATES
+------------------------------------------------------------------------------
+The reprojection (SCRIPT 03) needs, for each image, the coordinates of its four fiducial marks (csv written by SCRIPT
+02) and the homography to the standard fiducial positions of the camera. This module reads the csv once and indexes its
+rows by image name (without folder and extension, so that the names with or without '.tif' are found), so that each
+image is found directly instead of searching the whole table. The homographies of all the images are computed by
+the main process before the jobs start (see batch_homographies), and the parallel jobs only receive the matrix of their
+image.
+
+Version: 1.0.1
+
+Notes:
+
+    - Specific Python modules needed for this script:
+        > Numpy
+        > OpenCV
+        > Pandas
+
+    - csv columns: name, X1, Y1, X2, Y2, X3, Y3, X4, Y4 (see SCRIPT 03)
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import cv2
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+image_extensions = ['.tif', '.tiff', '.png', '.jpg', '.jpeg'] # removed from the names (case insensitive)
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+point_columns = ['X1', 'Y1', 'X2', 'Y2', 'X3', 'Y3', 'X4', 'Y4']
+
+
+def image_stem(name):
+    """
+    Normalized image name (key of the store): without folder and image extension
+    """
+    name = os.path.basename(str(name).strip())
+    stem, extension = os.path.splitext(name)
+    return stem if extension.lower() in image_extensions else name
+
+
+def batch_homographies(pts1, pts2):
+    """
+    Compute the homographies from pts1 to pts2 of many images, one cv2.getPerspectiveTransform per image (float32
+    points, as in SCRIPT 03 reproject_image). Not a vectorized solve: the matrices must be exactly the ones of the
+    fused chain (see GAPP_FusedPipeline), and ~20 microseconds per image are negligible next to the warping.
+
+    :param pts1: (N, 4, 2) fiducial coordinates of the images
+    :param pts2: (4, 2) standard fiducial coordinates
+    :return: (N, 3, 3) homographies (nan for the images whose points are missing or degenerate)
+    """
+    pts1 = np.asarray(pts1, dtype=np.float32).reshape(-1, 4, 2)
+    pts2 = np.asarray(pts2, dtype=np.float32).reshape(4, 2)
+    H = np.full((len(pts1), 3, 3), np.nan)
+    for i, points in enumerate(pts1):
+        if not np.isfinite(points).all():
+            continue
+        M = cv2.getPerspectiveTransform(points, pts2)
+        if np.isfinite(M).all() and abs(np.linalg.det(M)) > 1e-12:
+            H[i] = M
+    return H
+
+
+class FiducialStore:
+    """
+    Fiducial coordinates of a dataset (csv of SCRIPT 02), indexed by image name (see image_stem)
+    """
+
+    def __init__(self, fiducialmarks_file, sep=';'):
+        FM = pd.read_csv(fiducialmarks_file, sep=sep, header=[0])
+        self.names = [str(name) for name in FM['name']]
+        self.pts = FM[point_columns].to_numpy(dtype=np.float32).reshape(-1, 4, 2)
+        self.index = {image_stem(name): i for i, name in enumerate(self.names)}
+        self.H = {} # homographies of all the images, for each set of standard coordinates
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, image):
+        return image_stem(image) in self.index
+
+    def points(self, image):
+        """
+        :return: (4, 2) float32 fiducial coordinates of an image (KeyError if not in the csv)
+        """
+        return self.pts[self.index[image_stem(image)]]
+
+    def homography(self, image, pts2):
+        """
+        :param pts2: standard fiducial coordinates (see SCRIPT 03, camera_fiducial_points)
+        :return: 3 x 3 homography of an image (KeyError if not in the csv, ValueError if its points are degenerate)
+        """
+        key = np.asarray(pts2, dtype=np.float64).tobytes()
+        if key not in self.H: # computed for all the images at once
+            self.H[key] = batch_homographies(self.pts, pts2)
+        M = self.H[key][self.index[image_stem(image)]]
+        if not np.isfinite(M).all():
+            raise ValueError('invalid fiducial coordinates for ' + str(image))
+        return M
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON SCRIPT FOR THE FUSED (SINGLE DECODE) EXECUTION OF THE GAPP CHAIN
+------------------------------------------------------------------------------
+This script runs the selected steps of the GAPP chain (01_CanvasSizing, 02_AutomaticFiducialDetection,
+03_Reprojection and 04_Resize) image by image and in memory: each scan is read only once, all the selected steps are
+applied on the image array and only the final product is written to disk (the intermediate images can also be saved
+if needed). It uses the same functions as the scripts 01 to 04, so that the final images are identical to those
+obtained when running the chain step by step, while avoiding three full reads and writes of each (large) image.
+
+Version: 1.0.1 (see GAPP_AirPhotoPreprocessing_main_v101)
+
+Notes:
+
+    - Specific Python modules needed for this script:
+        > Joblib
+        > Numpy
+        > OpenCV
+        > Pandas
+
+    - The selected steps must follow each other (e.g., 01+02+03 or 02+03+04, but not 01+04).
+      Otherwise, run the chain step by step.
+
+    - The fiducial coordinates (csv) and the list of corners to check are written to the same place as with
+      SCRIPT 02, so that the steps 03 and 04 can still be (re)run separately afterwards.
+
+    - As in SCRIPT 02, the fiducials of all the images are checked together once detected (ConsistencyCheck, see
+      check_consistency_fused): the images whose coordinates are corrected are read and processed again.
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import os
+import multiprocessing
+from time import sleep
+from pathlib import Path
+
+import cv2
+import numpy as np
+from joblib import Parallel, delayed
+
+from GAPP_DatasetCatalog_v101 import load_catalog, max_dimensions, read_header
+from GAPP_Script_01_AirPhoto_CanvasSizing_v201 import list_images, canvas_sized_name, pad_canvas, read_canvas_manifest
+from GAPP_Script_02_AutomaticFiducialDetection_v201 import detect_fiducials, as_detection_image, parameters_02, \
+    readCSV, keepCSVLines, addLine, write_to_be_checked, load_template_bank, pop_peak_records, save_peak_records, \
+    check_consistency, toCSV, writeCSVLines, corner_names, NativeDepth, PyramidMatching, PeakRecords, ConsistencyCheck
+from GAPP_Script_03_AirPhoto_Reprojection_v201 import camera_fiducial_points, reproject_image, warp_image, \
+    standardized_name, CSV_Separator, dimX, dimY
+from GAPP_FiducialStore_v101 import FiducialStore
+from GAPP_Script_04_AirPhotos_Resize_v201 import downscale_image, enhance_image, downscaled_name
+from GAPP_FiducialMatching_v101 import share_bank, pop_pyramid_stats, report_pyramid_stats
+from GAPP_QAFigures_v101 import pop_figures, FigureRenderer
+from GAPP_ImageIO_v101 import windowed_format, write_windowed
+from GAPP_RunLedger_v101 import file_fingerprint, folder_fingerprint, params_fingerprint, load_ledger, save_ledger, \
+    is_up_to_date, update_ledger
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+input_image_folder = r"D:\PROCESSING\SCANS\Test_SCANS_GAPPS\raw"  # where are located the raw scans
+output_folder = r"D:\PROCESSING\SCANS\Test_SCANS_GAPPS\output"  # the sub folders 01_CanvasSized, 02_Reprojected and 03_Resized are created here
+fiducial_template_folder = r"D:\PROCESSING\SCANS\Test_SCANS_GAPPS\Fiducial_templates_01"
+dataset = 'Dataset_01'
+p = 0.04  # percentage of black stripe width (see SCRIPT 02)
+black_stripe_location = 'right, bottom'
+camera = 'Wild RC5a'
+scale_percent = 100 / 1600 * 900  # input and output scan resolution (see SCRIPT 04)
+HistoCal = True
+SharpeningIntensity = 2
+Steps = {'Script_01': 1, 'Script_02': 1, 'Script_03': 1, 'Script_04': 1}
+SaveIntermediates = False  # if True, also save the canvas-sized and reprojected images (as the step by step chain does)
+Incremental = True  # if True, only the images that are new, modified, or whose parameters changed are processed
+ComposedResampling = False  # if True (and SaveIntermediates is False), the reprojection and the downscaling are done in
+                            # one resampling step (see SCRIPT 03, resampling_homography)
+
+#### PARALLEL PROCESSING #####
+# (Choose the number of CPU cores you want to use)
+# (minimum = 1; suggested value = (number of cores) - 1)
+num_cores = max(1, multiprocessing.cpu_count() - 1)
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+step_names = ['Script_01', 'Script_02', 'Script_03', 'Script_04']
+
+
+def selected_steps(Steps):
+    """
+    List the selected steps and check that they follow each other
+
+    :param Steps: dic with the steps to run (e.g., {'Script_01': 1, 'Script_02': 0, ...})
+    :return: list of selected steps (None if the steps can not be fused)
+    """
+    selected = [step for step in step_names if Steps[step] == 1]
+    if len(selected) == 0:
+        return None
+    first = step_names.index(selected[0])
+    if selected != step_names[first:first + len(selected)]:
+        return None
+    return selected
+
+
+def list_step_inputs(first_step, folders):
+    """
+    List the images to process, found where the first selected step reads its input in the step by step chain
+
+    :return: list of (image path, image name, canvas size), the canvas size being None except for the images of a
+             virtual canvas (see SCRIPT 01, VirtualCanvas)
+    """
+    if first_step == 'Script_01':
+        images_list, images_list_path = list_images(folders['input'])
+        return [(image_path, os.path.basename(image_path), None) for image_path in images_list_path]
+
+    if first_step in ['Script_02', 'Script_03']:
+        canvas_manifest = read_canvas_manifest(folders['canvas_sized'])
+        if canvas_manifest is not None:
+            return [(canvas['path'], name, (canvas['canvas_width'], canvas['canvas_height']))
+                    for name, canvas in canvas_manifest.items()]
+
+    if first_step == 'Script_02':
+        folder = folders['canvas_sized']
+        extensions = [".tif", ".TIF", ".jpg", ".JPG", ".tiff", ".TIFF"]
+    elif first_step == 'Script_03':
+        folder = folders['canvas_sized']
+        extensions = [".tif", ".TIF", ".tiff", ".TIFF"]
+    else:
+        folder = folders['reprojected']
+        extensions = [".tif", ".TIF", ".png", ".jpg", ".JPG", ".tiff", ".TIFF"]
+
+    allfiles = os.listdir(folder)
+    return [(os.path.join(folder, filename), filename, None) for filename in allfiles
+            if os.path.splitext(filename)[1] in extensions]
+
+
+def output_names(image_path, name, steps):
+    """
+    Names of an image in the step by step chain, without processing it
+
+    :return: name used in the fiducial csv (step 02), name of the final product
+    """
+    if 'Script_01' in steps:
+        name = canvas_sized_name(image_path)
+    detection_name = name
+    if 'Script_03' in steps:
+        name = standardized_name(name)
+    if 'Script_04' in steps:
+        name = downscaled_name(name)
+    return detection_name, name
+
+
+def output_exists(final_name, detection_name, steps, folders, rows):
+    """
+    Check that the products of an image are still there (final image, and line of the fiducial csv if detected here)
+    """
+    if 'Script_02' in steps and os.path.splitext(detection_name)[0] not in rows:
+        return False
+    if steps[-1] == 'Script_02':
+        return True
+    folder = {'Script_01': folders['canvas_sized'], 'Script_03': folders['reprojected'],
+              'Script_04': folders['resized']}[steps[-1]]
+    return os.path.isfile(os.path.join(folder, final_name))
+
+
+def save_image(folder, name, img, windowed=False):
+    Path(folder).mkdir(parents=True, exist_ok=True)  # create folder if does no exist
+    if windowed: # read by window by the next scripts (see GAPP_ImageIO, write_windowed)
+        write_windowed(os.path.join(folder, name), img)
+    else:
+        cv2.imwrite(os.path.join(folder, name), img)
+
+
+def process_image(image_path, name, canvas_size, steps, settings, M=None):
+    """
+    Run the selected steps on one image, read only once from disk
+
+    :param image_path: path of the image to process
+    :param name: name of the image in the step by step chain
+    :param canvas_size: (width, height) of the virtual canvas of the image, if any (see list_step_inputs)
+    :param steps: list of selected steps (see selected_steps)
+    :param settings: dic with the parameters of the steps
+    :param M: homography of the reprojection, when the fiducial coordinates are read from the csv (see
+              GAPP_FiducialStore)
+    :return: image name as written in the fiducial csv (i.e., name of the image detected by SCRIPT 02 in the step by
+             step chain, see output_names), Coord (None if not detected here), ToBeChecked, matching statistics (see
+             GAPP_FiducialMatching), QA figures (see GAPP_QAFigures), matching records (see SCRIPT 02, PeakRecords)
+    """
+    img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if canvas_size is not None:
+        img = pad_canvas(img, canvas_size[0], canvas_size[1])
+    Coord = None
+    ToBeChecked = None
+    last_step = steps[-1]
+
+    # 01_CanvasSizing
+    if 'Script_01' in steps:
+        img = pad_canvas(img, settings['width_max'], settings['height_max'])
+        name = canvas_sized_name(image_path)
+        if last_step == 'Script_01' or settings['SaveIntermediates']:
+            save_image(settings['folders']['canvas_sized'], name, img, windowed=True) # as SCRIPT 01
+    detection_name = name # name in the fiducial csv (the next steps only change the name of the products)
+
+    # 02_AutomaticFiducialDetection
+    if 'Script_02' in steps:
+        d = settings['detection']
+        Coord, ToBeChecked = detect_fiducials(as_detection_image(img), name, d['S'], d['p'], d['Fiducial_type'],
+                                              d['black_stripe_location'], d['type_fidu'], d['dataset'],
+                                              d['fiducial_template_folder'], d['corner_folder'],
+                                              d['center_fidu_tempate_CSV'], bank=d['bank'])
+        if len(Coord) != 4:
+            print(' ! fiducial marks not found for ' + name + ' > next steps skipped for this image')
+            return detection_name, Coord, ToBeChecked, pop_pyramid_stats(), pop_figures(), pop_peak_records()
+
+    # 03_Reprojection
+    if 'Script_03' in steps:
+        # reprojected and downscaled at once if composed (see SCRIPT 03, resampling_homography)
+        scale = settings['scale_percent'] if settings['composed'] else 100
+        if Coord is not None:
+            # same order as the columns X1..Y4 of the fiducial csv
+            pts1 = np.float32([Coord['top_left'], Coord['top_right'], Coord['bot_right'], Coord['bot_left']])
+            img = reproject_image(img, pts1, settings['pts2'], dimX, dimY, scale)
+        else:
+            img = warp_image(img, M, dimX, dimY, scale)
+        name = standardized_name(name)
+        if last_step == 'Script_03' or settings['SaveIntermediates']:
+            save_image(settings['folders']['reprojected'], name, img)
+
+    # 04_Resize
+    if 'Script_04' in steps:
+        if settings['composed']: # already downscaled
+            img = enhance_image(img, settings['HistoCal'], settings['SharpeningIntensity'])
+        else:
+            img = downscale_image(img, settings['scale_percent'], settings['HistoCal'], settings['SharpeningIntensity'])
+        name = downscaled_name(name)
+        save_image(settings['folders']['resized'], name, img)
+
+    print('  >> done: ' + name)
+    return detection_name, Coord, ToBeChecked, pop_pyramid_stats(), pop_figures(), pop_peak_records()
+
+
+def check_consistency_fused(results, images_todo, images_done, steps, settings, fiducialmarks_file, records=None):
+    """
+    Geometric consistency check of the fiducials of the dataset, as in SCRIPT 02 (see check_consistency): the corners
+    are searched again on the scans (read again, by window when possible), the csv is written again and the steps
+    after the detection are run again for the images whose coordinates changed, with their corrected homography, so
+    that the fused and the step by step chains give the same results
+
+    :param results: results of process_image
+    :param images_todo: list of (image path, image name, canvas size) of the images processed (see list_step_inputs)
+    :param images_done: names (in the fiducial csv) of the images kept from a previous run
+    :return: names (in the fiducial csv) of the images processed again
+    """
+    d = settings['detection']
+    detected = {name: Coord for name, Coord, _, _, _, _ in results} # by name in the fiducial csv (see process_image)
+    inputs = {}
+    # the scans are opened again with the canvas of the detection (see SCRIPT 01, VirtualCanvas): the canvas-sized
+    # images are not saved by the fused chain (see SaveIntermediates)
+    canvas_manifest = {}
+    for image_path, name, canvas_size in images_todo:
+        detection_name = output_names(image_path, name, steps)[0]
+        inputs[detection_name] = (image_path, name, canvas_size)
+        if 'Script_01' in steps:
+            canvas_size = (settings['width_max'], settings['height_max'])
+        elif canvas_size is None: # canvas-sized image
+            header = read_header(image_path)
+            canvas_size = (header['width'], header['height'])
+        canvas_manifest[detection_name] = {'path': image_path, 'canvas_width': canvas_size[0],
+                                           'canvas_height': canvas_size[1]}
+
+    rows = readCSV(fiducialmarks_file)
+    changed = check_consistency(detected, rows, settings['folders']['canvas_sized'], d['S'], d['p'],
+                                d['Fiducial_type'], d['black_stripe_location'], d['type_fidu'], d['corner_folder'],
+                                fiducialmarks_file, canvas_manifest, d['bank'], records)
+    changed = [image for image in sorted(set(changed)) if len(detected[image]) == 4]
+    if len(changed) == 0:
+        return []
+    for image in changed: # csv written again, with the corrected coordinates
+        rows[os.path.splitext(image)[0]] = toCSV(image, detected[image])
+    writeCSVLines(fiducialmarks_file, rows, [image for image in sorted(images_done + list(detected))
+                                             if os.path.splitext(image)[0] in rows])
+
+    steps_after = [step for step in steps if step != 'Script_02']
+    if steps[-1] == 'Script_02': # no step after the detection
+        return changed
+    print(' > ' + str(len(changed)) + ' image(s) processed again with the corrected fiducial coordinates')
+    Parallel(n_jobs=num_cores, verbose=30)(
+        delayed(process_image)(*inputs[image], steps_after, settings,
+                               cv2.getPerspectiveTransform(np.float32([detected[image][corner]
+                                                                       for corner in corner_names]),
+                                                           settings['pts2']))
+        for image in changed)
+    return changed
+
+
+def main_script_fused(input_image_folder, output_folder, fiducial_template_folder, dataset, p, black_stripe_location,
+                      camera, scale_percent, HistoCal, SharpeningIntensity, Steps, SaveIntermediates=False,
+                      Incremental=False, ComposedResampling=False):
+
+    print(' ')
+    print('=====================================================================')
+    print('=        GAPP CHAIN - FUSED EXECUTION (SINGLE IMAGE DECODE)         =')
+    print('=====================================================================')
+    print(' ')
+
+    steps = selected_steps(Steps)
+    if steps is None:
+        print('! The selected steps do not follow each other and can not be fused: run the chain step by step')
+        return
+
+    folders = {'input': input_image_folder,
+               'canvas_sized': output_folder + '/' + '01_CanvasSized',
+               'reprojected': output_folder + '/' + '02_Reprojected',
+               'resized': output_folder + '/' + '03_Resized'}
+    fiducialmarks_file = folders['canvas_sized'] + '/' + '_fiducial_marks_coordinates_' + dataset + '.csv'
+
+    images = list_step_inputs(steps[0], folders)
+    print('-> fused steps: ' + ' + '.join(steps))
+    print('Number of images to process: ' + str(len(images)))
+    print(' ')
+
+    # the reprojection and the downscaling are composed only if the full resolution reprojected images are not saved
+    composed = ComposedResampling and 'Script_03' in steps and 'Script_04' in steps and not SaveIntermediates
+    settings = {'folders': folders, 'SaveIntermediates': SaveIntermediates, 'composed': composed}
+    params = {'steps': steps, 'SaveIntermediates': SaveIntermediates, # parameters of the selected steps (see Incremental)
+              'composed': composed}
+
+    if 'Script_01' in steps:
+        catalog = load_catalog(input_image_folder, recursive=True, extensions=[".tif", ".tiff"])
+        width_max, height_max = max_dimensions(catalog)
+        settings['width_max'] = width_max
+        settings['height_max'] = height_max
+        params.update({'width_max': width_max, 'height_max': height_max, 'write_format': windowed_format})
+        print('maximum width found = ' + str(width_max) + ' pixels')
+        print('maximum height found = ' + str(height_max) + ' pixels')
+
+    if 'Script_02' in steps:
+        center_fidu_tempate_CSV, corner_folder, type_fidu, Out_fiducialmarks_CSV, RunParallel, DebugMode, \
+        OneTemplateMax, S, MatchingValueThreshold, DPI, Fiducial_type, _ = \
+            parameters_02(folders['canvas_sized'], fiducial_template_folder, dataset)
+        settings['detection'] = {'S': S, 'p': p, 'Fiducial_type': Fiducial_type,
+                                 'black_stripe_location': black_stripe_location, 'type_fidu': type_fidu,
+                                 'dataset': dataset, 'fiducial_template_folder': fiducial_template_folder,
+                                 'corner_folder': corner_folder, 'center_fidu_tempate_CSV': center_fidu_tempate_CSV,
+                                 'bank': share_bank(load_template_bank(fiducial_template_folder,
+                                                                       center_fidu_tempate_CSV))}
+        Path(folders['canvas_sized']).mkdir(parents=True, exist_ok=True)
+        params.update({key: settings['detection'][key] for key in ['S', 'p', 'Fiducial_type', 'black_stripe_location',
+                                                                    'type_fidu']})
+        params.update({'OneTemplateMax': OneTemplateMax, 'MatchingValueThreshold': MatchingValueThreshold,
+                       'NativeDepth': NativeDepth, 'PyramidMatching': PyramidMatching,
+                       'ConsistencyCheck': ConsistencyCheck,
+                       'templates': folder_fingerprint(fiducial_template_folder, ['.tif', '.txt'])})
+    elif 'Script_03' in steps:
+        FM = FiducialStore(fiducialmarks_file, CSV_Separator) # indexed by image name (see GAPP_FiducialStore)
+
+    if 'Script_03' in steps:
+        settings['pts2'] = camera_fiducial_points(camera)
+        params.update({'camera': camera, 'dimX': dimX, 'dimY': dimY})
+
+    if 'Script_04' in steps:
+        settings['scale_percent'] = scale_percent
+        settings['HistoCal'] = HistoCal
+        settings['SharpeningIntensity'] = SharpeningIntensity
+        params.update({'scale_percent': scale_percent, 'HistoCal': HistoCal,
+                       'SharpeningIntensity': SharpeningIntensity})
+
+    ##### SKIP THE IMAGES ALREADY PROCESSED WITH THE SAME INPUT AND PARAMETERS #####
+
+    ledger = load_ledger(output_folder, 'fused') if Incremental is True else {}
+    rows = readCSV(fiducialmarks_file) if Incremental is True and 'Script_02' in steps else {}
+    params_fp = params_fingerprint(params)
+    images_todo = []
+    images_done = []
+    fingerprints = {}
+    for image_path, name, canvas_size in images:
+        detection_name, final_name = output_names(image_path, name, steps)
+        image_params_fp = params_fp
+        if 'Script_03' in steps and 'Script_02' not in steps: # fiducial coordinates read from the csv
+            pts1 = FM.points(name).tolist() if name in FM else None
+            image_params_fp = params_fingerprint({'params': params_fp, 'pts1': pts1})
+        fingerprints[final_name] = (file_fingerprint(image_path), image_params_fp)
+        if is_up_to_date(ledger, final_name, fingerprints[final_name][0], image_params_fp,
+                         output_exists(final_name, detection_name, steps, folders, rows)):
+            images_done.append(detection_name)
+        else:
+            images_todo.append((image_path, name, canvas_size))
+    if Incremental is True:
+        print('Number of images already up to date (skipped): ' + str(len(images_done)))
+    if 'Script_02' in steps:
+        keepCSVLines(fiducialmarks_file, rows, images_done)
+
+    ##### PARALLEL PROCESSING #####
+
+    # homographies of the fiducial coordinates read from the csv, computed here (see GAPP_FiducialStore): each job
+    # only receives its matrix
+    homographies = {}
+    if 'Script_03' in steps and 'Script_02' not in steps:
+        for image_path, name, canvas_size in images_todo:
+            try:
+                homographies[name] = FM.homography(name, settings['pts2'])
+            except (KeyError, ValueError):
+                print('! no valid fiducial coordinates for ' + name + ' in ' + fiducialmarks_file + ' (skipped)')
+        images_todo = [image for image in images_todo if image[1] in homographies]
+
+    results = Parallel(n_jobs=num_cores, verbose=30)(
+        delayed(process_image)(image_path, name, canvas_size, steps, settings, homographies.get(name))
+        for image_path, name, canvas_size in images_todo)
+
+    # fiducial coordinates are written by this process only, in the order of the image list
+    if 'Script_02' in steps:
+        renderer = FigureRenderer() # QA figures of the detection (see GAPP_QAFigures)
+        records = {}
+        try:
+            for name, Coord, ToBeChecked, _, figure_list, image_records in results:
+                if len(Coord) == 4:
+                    addLine(name, Coord, fiducialmarks_file)
+                write_to_be_checked(ToBeChecked, fiducialmarks_file)
+                renderer.submit(figure_list)
+                records.update(image_records)
+            report_pyramid_stats([stats for _, _, _, stats, _, _ in results])
+            if ConsistencyCheck is True and len(results) > 0: # dataset-wide check of the fiducial quadrilaterals
+                check_consistency_fused(results, images_todo, images_done, steps, settings, fiducialmarks_file,
+                                        records)
+                renderer.submit(pop_figures())
+        finally: # template bank shared with the workers (see share_bank), not left behind if the check fails
+            os.remove(settings['detection']['bank'])
+            renderer.close()
+        if PeakRecords is True:
+            save_peak_records(records, fiducialmarks_file, images_done)
+        print('>>>>> fiducial coordinates saved to: ' + fiducialmarks_file)
+
+    # saved last: an interrupted run is done again (see Incremental)
+    for image_path, name, canvas_size in images_todo:
+        final_name = output_names(image_path, name, steps)[1]
+        update_ledger(ledger, final_name, fingerprints[final_name][0], fingerprints[final_name][1])
+    save_ledger(ledger, output_folder, 'fused')
+
+    ##### END PROCESSING #####
+
+    sleep(3)
+
+    print(' ')
+    print('======================')
+    print(' PROCESSING COMPLETED ')
+    print('======================')
+
+
+if __name__ == "__main__":
+    main_script_fused(input_image_folder, output_folder, fiducial_template_folder, dataset, p, black_stripe_location,
+                      camera, scale_percent, HistoCal, SharpeningIntensity, Steps, SaveIntermediates, Incremental,
+                      ComposedResampling)
@@ -0,0 +1,534 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON MODULE FOR THE WINDOWED READING (AND TILED WRITING) OF LARGE TIFF SCANS
+------------------------------------------------------------------------------
+The fiducial detection (SCRIPT 02) only needs four corner windows of S x S pixels (+ larger windows for the second
+tries), i.e., a small part of the scan. This module reads these windows directly from the TIFF file, using the strip
+(or tile) offsets written in the header, without decoding the full image: uncompressed files are memory-mapped (only
+the pages of the windows are read from disk) and, for Deflate compressed files, only the strips/tiles overlapping the
+windows are decompressed. Other files (LZW, JPEG, PNG, ...) are read entirely with OpenCV, as before: the
+canvas-sized images are therefore written as Deflate compressed tiled TIFF files (write_windowed, SCRIPT 01), instead
+of the LZW compression used by default by cv2.imwrite. They are tiled because the strips written by OpenCV are one row
+high: each strip is decompressed over the full width of the image, whereas the tiles only cover the windows.
+
+The tiled reprojection (SCRIPT 03, see GAPP_TiledWarp) also writes its output tile by tile (TiledTiffWriter), so that
+the full output image is never held in memory.
+
+When an image is downscaled (SCRIPT 04), it does not always have to be decoded at full resolution: JPEG files can be
+decoded directly at 1/2, 1/4 or 1/8 of their size (decode_reduced), and TIFF files with internal overviews (reduced
+resolution images, e.g., written by gdaladdo) can be read from an overview (read_overview). The smallest resolution
+that is still larger than the output image is used, the final resize being done from it.
+
+Version: 1.0.1
+
+Notes:
+
+    - Specific Python modules needed for this script:
+        > Numpy
+        > OpenCV
+
+    - The windows are returned as cv2.imread(path, cv2.IMREAD_UNCHANGED) would return them (BGR band order, original
+      pixel depth), so that the results are identical with and without windowed reading.
+
+    - Only the first image of the file is read (as with cv2.imread).
+
+    - The tiled TIFF files written are uncompressed, or Deflate compressed with horizontal differencing (BigTIFF if
+      larger than 4 GB uncompressed).
+
+    - The overviews are read by window (see windowed_compressions), other overviews are not used. The JPEG files
+      decoded at reduced size must be 8-bit grayscale or color (not CMYK).
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import struct
+import zlib
+import threading
+import numpy as np
+import cv2
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+# TIFF compressions that can be read by window (1: none, 8 and 32946: Deflate). Others are read with OpenCV
+windowed_compressions = [1, 8, 32946]
+
+# size (in pixels, multiple of 16) of the tiles of the intermediate TIFF files read by window by the next scripts
+# (canvas-sized images, see write_windowed). Small tiles are compressed faster: with 128 pixels, about as fast as the
+# strips of cv2.imwrite
+WindowedTileSize = 128
+
+# cv2.imwrite parameters of the intermediate TIFF files that can not be tiled (see write_windowed): Deflate, as the
+# default compression of OpenCV (LZW) can not be read by window
+windowed_write_params = [cv2.IMWRITE_TIFF_COMPRESSION, 8]
+
+TileSize = 1024 # size (in pixels, multiple of 16) of the tiles of the tiled TIFF files written (see TiledTiffWriter)
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+# numpy data types of the TIFF tag types used in the image header (BYTE, SHORT, LONG, LONG8, IFD, IFD8)
+tag_dtypes = {1: 'u1', 3: 'u2', 4: 'u4', 16: 'u8', 13: 'u4', 18: 'u8'}
+
+# JPEG scales that can be decoded directly (IMREAD_REDUCED flags: grayscale, color)
+reduced_flags = {2: (cv2.IMREAD_REDUCED_GRAYSCALE_2, cv2.IMREAD_REDUCED_COLOR_2),
+                 4: (cv2.IMREAD_REDUCED_GRAYSCALE_4, cv2.IMREAD_REDUCED_COLOR_4),
+                 8: (cv2.IMREAD_REDUCED_GRAYSCALE_8, cv2.IMREAD_REDUCED_COLOR_8)}
+
+max_ifds = 64 # maximum number of images (IFD) read in a TIFF file (see read_tiff_tags)
+
+# format of the intermediate TIFF files (see write_windowed), part of the parameters of the scripts writing them: the
+# files written in another format by an older version are written again (see GAPP_RunLedger)
+windowed_format = {'tiled': WindowedTileSize, 'compression': 8, 'predictor': 2}
+
+
+def read_tiff_tags(image_path, all_images=False):
+    """
+    Read the tags of the first image (IFD) of a TIFF file (classic TIFF and BigTIFF)
+
+    :param image_path: path of the image
+    :param all_images: if True, the tags of all the images of the file are read (next IFDs and SubIFDs, e.g., the
+                       overviews, see read_overview)
+    :return: byte order ('<' or '>'), dic {tag: numpy array of values} (list of dics if all_images); or None if not
+             a TIFF file
+    """
+    with open(image_path, 'rb') as f:
+        header = f.read(16)
+        byteorder = {b'II': '<', b'MM': '>'}.get(header[:2])
+        if byteorder is None:
+            return None
+        version = struct.unpack(byteorder + 'H', header[2:4])[0]
+        if version == 42: # classic TIFF
+            ifd_offset = struct.unpack(byteorder + 'I', header[4:8])[0]
+            count_format, entry_format, offset_format, entry_size = 'H', 'HHI', 'I', 12
+        elif version == 43: # BigTIFF
+            ifd_offset = struct.unpack(byteorder + 'Q', header[8:16])[0]
+            count_format, entry_format, offset_format, entry_size = 'Q', 'HHQ', 'Q', 20
+        else:
+            return None
+
+        count_size = struct.calcsize(byteorder + count_format)
+        head = struct.calcsize(byteorder + entry_format)
+        value_size = entry_size - head # the value is written in the entry if it fits, otherwise its offset
+
+        images = []
+        to_read = [ifd_offset]
+        seen = set()
+        while to_read and len(images) < max_ifds:
+            ifd_offset = to_read.pop(0)
+            if ifd_offset == 0 or ifd_offset in seen:
+                continue
+            seen.add(ifd_offset)
+            f.seek(ifd_offset)
+            number_entries = struct.unpack(byteorder + count_format, f.read(count_size))[0]
+            entries = f.read(number_entries * entry_size)
+            next_offset = f.read(value_size)
+
+            tags = {}
+            for i in range(number_entries):
+                entry = entries[i * entry_size:(i + 1) * entry_size]
+                tag, tag_type, count = struct.unpack(byteorder + entry_format, entry[:head])
+                if tag_type not in tag_dtypes:
+                    continue
+                dtype = np.dtype(byteorder + tag_dtypes[tag_type])
+                size = dtype.itemsize * count
+                if size <= value_size:
+                    data = entry[head:head + size]
+                else:
+                    f.seek(struct.unpack(byteorder + offset_format, entry[head:])[0])
+                    data = f.read(size)
+                tags[tag] = np.frombuffer(data, dtype=dtype).astype(np.int64)
+            images.append(tags)
+            if not all_images:
+                break
+            to_read += [int(offset) for offset in tags.get(330, [])] # SubIFDs
+            if len(next_offset) == value_size:
+                to_read.append(struct.unpack(byteorder + offset_format, next_offset)[0])
+    if all_images:
+        return byteorder, images
+    return byteorder, images[0]
+
+
+class WindowedTiff:
+    """
+    TIFF image of which only the requested windows are read from disk. It can be sliced as a numpy array
+    (img[v0:v1, u0:u1]) and has a shape and a dtype, so that it can replace an image read with cv2.imread in the
+    functions cropping the fiducial corners (see SCRIPT 02, select_fiducial_corners).
+    """
+
+    def __init__(self, image_path, byteorder, tags, convert=None):
+        """
+        :param convert: (optional) function applied to each window read (e.g., conversion to 8-bit, see SCRIPT 02)
+        """
+        self.path = image_path
+        self.convert = convert
+        self.width = int(tags[256][0])
+        self.height = int(tags[257][0])
+        self.samples = int(tags.get(277, [1])[0])
+        self.compression = int(tags.get(259, [1])[0])
+        self.predictor = int(tags.get(317, [1])[0])
+        self.file_dtype = np.dtype(byteorder + {8: 'u1', 16: 'u2'}[int(tags[258][0])])
+
+        if 322 in tags: # tiled
+            self.chunk_width = int(tags[322][0])
+            self.chunk_height = int(tags[323][0])
+            self.offsets = tags[324]
+            self.byte_counts = tags[325]
+        else: # striped
+            self.chunk_width = self.width
+            self.chunk_height = min(int(tags.get(278, [self.height])[0]), self.height)
+            self.offsets = tags[273]
+            self.byte_counts = tags[279]
+        self.chunks_across = -(-self.width // self.chunk_width)
+
+        self.mm = None
+        self.f = None
+        if self.compression == 1:
+            self.mm = np.memmap(image_path, dtype=np.uint8, mode='r')
+        else: # opened once, read by several threads (see GAPP_TiledWarp)
+            self.f = open(image_path, 'rb')
+            self.lock = threading.Lock()
+        self.cache = {} # decompressed chunks of the last window read (e.g., strips shared by two corner windows)
+
+        window = self.read_window(0, 1, 0, 1)
+        if convert is not None:
+            window = convert(window)
+        self.shape = (self.height, self.width) + window.shape[2:]
+        self.dtype = window.dtype
+
+    def chunk(self, index):
+        """
+        Read (and decompress) a strip or tile of the image
+
+        :return: array (chunk_height, chunk_width, samples), native byte order
+        """
+        if self.compression == 1:
+            offset = int(self.offsets[index])
+            data = self.mm[offset:offset + int(self.byte_counts[index])]
+        else:
+            with self.lock:
+                self.f.seek(int(self.offsets[index]))
+                data = self.f.read(int(self.byte_counts[index]))
+            data = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+
+        # the last strip can be shorter than the others
+        row_size = self.chunk_width * self.samples * self.file_dtype.itemsize
+        rows = min(self.chunk_height, data.size // row_size)
+        chunk = data[:rows * row_size].view(self.file_dtype).reshape(rows, self.chunk_width, self.samples)
+        chunk = chunk.astype(self.file_dtype.newbyteorder('='), copy=False)
+        if self.predictor == 2: # horizontal differencing
+            chunk = np.cumsum(chunk, axis=1, dtype=chunk.dtype)
+        return chunk
+
+    def read_window(self, v0, v1, u0, u1):
+        """
+        Read the rows v0 to v1 and columns u0 to u1 of the image (original pixel depth, BGR band order)
+        """
+        window = np.zeros((v1 - v0, u1 - u0, self.samples), dtype=self.file_dtype.newbyteorder('='))
+        cache = {}
+        for row in range(v0 // self.chunk_height, -(-v1 // self.chunk_height)):
+            for col in range(u0 // self.chunk_width, -(-u1 // self.chunk_width)):
+                index = row * self.chunks_across + col
+                chunk = self.cache.get(index)
+                if chunk is None:
+                    chunk = self.chunk(index)
+                cache[index] = chunk
+                cv0, cu0 = row * self.chunk_height, col * self.chunk_width
+                r0, r1 = max(v0, cv0), min(v1, cv0 + chunk.shape[0])
+                c0, c1 = max(u0, cu0), min(u1, cu0 + chunk.shape[1])
+                if r1 > r0 and c1 > c0:
+                    window[r0 - v0:r1 - v0, c0 - u0:c1 - u0] = chunk[r0 - cv0:r1 - cv0, c0 - cu0:c1 - cu0]
+        self.cache = cache
+
+        if self.samples == 1:
+            return window[:, :, 0]
+        if self.samples == 3:
+            return window[:, :, [2, 1, 0]] # RGB -> BGR (as cv2.imread)
+        return window[:, :, [2, 1, 0, 3]] # RGBA -> BGRA
+
+    def __getitem__(self, key):
+        rows, cols = key[0], key[1]
+        v0, v1, _ = rows.indices(self.height)
+        u0, u1, _ = cols.indices(self.width)
+        window = self.read_window(v0, max(v0, v1), u0, max(u0, u1))
+        if self.convert is not None:
+            window = self.convert(window)
+        return window
+
+
+def windowed_readable(tags):
+    """
+    Check if the image described by the TIFF tags can be read by window (see WindowedTiff)
+    """
+    samples = int(tags.get(277, [1])[0])
+    photometric = int(tags.get(262, [-1])[0])
+    return (256 in tags and 257 in tags and 258 in tags
+            and (273 in tags and 279 in tags or 324 in tags and 325 in tags)
+            and int(tags.get(259, [1])[0]) in windowed_compressions
+            and int(tags.get(317, [1])[0]) in [1, 2]
+            and len(set(tags[258].tolist())) == 1 and int(tags[258][0]) in [8, 16]
+            and int(tags.get(339, [1])[0]) == 1 # unsigned integer
+            and (samples == 1 or int(tags.get(284, [1])[0]) == 1) # interleaved bands
+            and (photometric == 1 and samples == 1 or photometric == 2 and samples in [3, 4]))
+
+
+def open_windowed(image_path, convert=None):
+    """
+    Open an image to read windows of it: by window if possible (see WindowedTiff), otherwise the full image is read
+    with cv2.imread (original pixel depth) and converted.
+
+    :param convert: (optional) function applied to the image (or to each window read)
+    :return: WindowedTiff or image array
+    """
+    header = None
+    try:
+        header = read_tiff_tags(image_path)
+    except (OSError, struct.error, ValueError):
+        pass
+    if header is not None and windowed_readable(header[1]):
+        return WindowedTiff(image_path, header[0], header[1], convert)
+
+    img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if convert is not None:
+        img = convert(img)
+    return img
+
+
+def output_size(width, height, scale_percent):
+    """
+    Size of an image downscaled to scale_percent of its size (as in SCRIPT 04)
+
+    :return: (width, height)
+    """
+    return int(width * scale_percent / 100), int(height * scale_percent / 100)
+
+
+def read_overview(image_path, scale_percent):
+    """
+    Read the smallest overview (reduced resolution image) of a TIFF file that is still at least as large as the image
+    downscaled to scale_percent (see output_size)
+
+    :return: overview (as cv2.imread(path, cv2.IMREAD_UNCHANGED) would return it), (width, height) of the full
+             resolution image; or None if the file has no such overview
+    """
+    try:
+        header = read_tiff_tags(image_path, all_images=True)
+    except (OSError, struct.error, ValueError):
+        return None
+    if header is None:
+        return None
+    byteorder, images = header
+    full = images[0]
+    if 256 not in full or 257 not in full:
+        return None
+    width, height = int(full[256][0]), int(full[257][0])
+    min_width, min_height = output_size(width, height, scale_percent)
+
+    overviews = [tags for tags in images[1:]
+                 if int(tags.get(254, [0])[0]) & 1 # NewSubfileType: reduced resolution image
+                 and windowed_readable(tags)
+                 and int(tags[256][0]) >= min_width and int(tags[257][0]) >= min_height
+                 and int(tags.get(277, [1])[0]) == int(full.get(277, [1])[0])
+                 and int(tags[258][0]) == int(full[258][0])]
+    if not overviews:
+        return None
+    tags = min(overviews, key=lambda tags: int(tags[256][0]) * int(tags[257][0]))
+    overview = WindowedTiff(image_path, byteorder, tags)
+    return overview.read_window(0, overview.height, 0, overview.width), (width, height)
+
+
+def jpeg_header(data):
+    """
+    Read the size and the number of bands of a JPEG image (SOF segment)
+
+    :param data: content of the file (numpy uint8 array or bytes)
+    :return: width, height, number of bands; or None if not a JPEG file
+    """
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = int(data[i + 1])
+        if marker == 0xFF: # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8: # markers without segment
+            i += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in [0xC4, 0xC8, 0xCC]: # start of frame
+            height = (int(data[i + 5]) << 8) + int(data[i + 6])
+            width = (int(data[i + 7]) << 8) + int(data[i + 8])
+            return width, height, int(data[i + 9])
+        if marker == 0xDA: # start of scan: no frame header found
+            return None
+        i += 2 + (int(data[i + 2]) << 8) + int(data[i + 3])
+    return None
+
+
+def decode_reduced(data, scale_percent):
+    """
+    Decode a JPEG image directly at 1/2, 1/4 or 1/8 of its size: the smallest one that is still at least as large as
+    the image downscaled to scale_percent (see output_size)
+
+    :param data: content of the file (numpy uint8 array)
+    :return: reduced image (8-bit, as cv2.imdecode(data, cv2.IMREAD_UNCHANGED) would return it, EXIF orientation
+             ignored), (width, height) of the full resolution image; or None if not possible (not a JPEG file, CMYK,
+             or scale_percent larger than 50)
+    """
+    header = jpeg_header(data)
+    if header is None or header[2] not in [1, 3]:
+        return None
+    width, height, bands = header
+    min_width, min_height = output_size(width, height, scale_percent)
+    factors = [factor for factor in sorted(reduced_flags, reverse=True)
+               if -(-width // factor) >= min_width and -(-height // factor) >= min_height]
+    if not factors:
+        return None
+    flag = reduced_flags[factors[0]][0 if bands == 1 else 1]
+    img = cv2.imdecode(data, flag | cv2.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        return None
+    return img, (width, height)
+
+
+class TiledTiffWriter:
+    """
+    Tiled TIFF file written tile by tile, in any order (e.g., by several threads), so that the full image is never
+    held in memory. The header (IFD) is written when the file is closed.
+
+    with TiledTiffWriter(path, width, height, np.uint16) as writer:
+        writer.write_tile(row, col, tile)
+    """
+
+    def __init__(self, image_path, width, height, dtype, samples=1, tile_size=None, compression=1):
+        """
+        :param compression: 1 (none) or 8 (Deflate, with horizontal differencing)
+        """
+        if compression not in [1, 8]:
+            raise ValueError('the tiled TIFF files are written uncompressed (1) or Deflate-compressed (8)')
+        self.path = image_path
+        self.compression = compression
+        self.width = int(width)
+        self.height = int(height)
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        self.samples = int(samples)
+        self.tile_size = TileSize if tile_size is None else int(tile_size)
+        if self.tile_size % 16 != 0:
+            raise ValueError('the tile size of a TIFF file must be a multiple of 16')
+        self.tiles_across = -(-self.width // self.tile_size)
+        self.tiles_down = -(-self.height // self.tile_size)
+        self.tile_bytes = self.tile_size * self.tile_size * self.samples * self.dtype.itemsize
+        self.offsets = [0] * (self.tiles_across * self.tiles_down)
+        self.byte_counts = [self.tile_bytes] * len(self.offsets)
+        self.bigtiff = len(self.offsets) * self.tile_bytes > 2 ** 32 - 2 ** 20
+        self.lock = threading.Lock()
+        self.f = open(image_path, 'wb')
+        self.f.write(b'\0' * (16 if self.bigtiff else 8)) # header, written at the end
+
+    def write_tile(self, row, col, tile):
+        """
+        Write one tile (tile_size x tile_size pixels or less at the right and bottom of the image, BGR band order as
+        returned by OpenCV)
+        """
+        data = np.zeros((self.tile_size, self.tile_size, self.samples), dtype=self.dtype)
+        tile = tile.reshape(tile.shape[0], tile.shape[1], -1)
+        if self.samples == 3:
+            tile = tile[:, :, [2, 1, 0]] # BGR -> RGB
+        elif self.samples == 4:
+            tile = tile[:, :, [2, 1, 0, 3]] # BGRA -> RGBA
+        data[:tile.shape[0], :tile.shape[1]] = tile
+        data = data.tobytes()
+        if self.compression == 8: # zlib releases the GIL: the tiles of several threads are compressed at once
+            data = np.frombuffer(data, dtype=self.dtype).reshape(self.tile_size, self.tile_size, self.samples)
+            data = zlib.compress(np.diff(data, axis=1, prepend=np.zeros_like(data[:, :1])).tobytes())
+        with self.lock:
+            self.f.seek(0, 2)
+            self.offsets[row * self.tiles_across + col] = self.f.tell()
+            self.byte_counts[row * self.tiles_across + col] = len(data)
+            self.f.write(data)
+
+    def close(self):
+        if self.f.closed:
+            return
+        for index, offset in enumerate(self.offsets): # tiles not written are black
+            if offset == 0:
+                self.write_tile(index // self.tiles_across, index % self.tiles_across,
+                                np.zeros((1, 1, self.samples), dtype=self.dtype))
+
+        if self.bigtiff:
+            count_format, entry_format, offset_format, value_size, offset_type = 'Q', 'HHQ', 'Q', 8, 16
+        else:
+            count_format, entry_format, offset_format, value_size, offset_type = 'H', 'HHI', 'I', 4, 4
+        entries = [(256, 4, [self.width]), (257, 4, [self.height]),
+                   (258, 3, [self.dtype.itemsize * 8] * self.samples), # BitsPerSample
+                   (259, 3, [self.compression]),
+                   (262, 3, [1 if self.samples < 3 else 2]), # BlackIsZero or RGB
+                   (277, 3, [self.samples]), (284, 3, [1]), # interleaved bands
+                   (322, 3, [self.tile_size]), (323, 3, [self.tile_size]),
+                   (324, offset_type, self.offsets), (325, offset_type, self.byte_counts),
+                   (339, 3, [1] * self.samples)] # unsigned integer
+        if self.compression == 8:
+            entries.append((317, 3, [2])) # horizontal differencing
+        if self.samples == 4:
+            entries.append((338, 3, [2])) # unassociated alpha
+        entries.sort()
+
+        # values that do not fit in the entries, then the IFD
+        self.f.seek(0, 2)
+        values = {}
+        for tag, tag_type, tag_values in entries:
+            data = np.asarray(tag_values, dtype='<' + tag_dtypes[tag_type]).tobytes()
+            if len(data) > value_size:
+                if self.f.tell() % 2:
+                    self.f.write(b'\0')
+                values[tag] = struct.pack('<' + offset_format, self.f.tell())
+                self.f.write(data)
+            else:
+                values[tag] = data.ljust(value_size, b'\0')
+        if self.f.tell() % 2:
+            self.f.write(b'\0')
+        ifd_offset = self.f.tell()
+        self.f.write(struct.pack('<' + count_format, len(entries)))
+        for tag, tag_type, tag_values in entries:
+            self.f.write(struct.pack('<' + entry_format, tag, tag_type, len(tag_values)) + values[tag])
+        self.f.write(struct.pack('<' + offset_format, 0)) # no other image
+
+        self.f.seek(0)
+        if self.bigtiff:
+            self.f.write(b'II' + struct.pack('<HHHQ', 43, 8, 0, ifd_offset))
+        else:
+            self.f.write(b'II' + struct.pack('<HI', 42, ifd_offset))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_windowed(image_path, img):
+    """
+    Write an intermediate image that the next scripts read by window (see WindowedTiff): Deflate compressed tiled TIFF
+    file (tiles of WindowedTileSize pixels), or Deflate compressed TIFF file written by OpenCV if the image can not
+    be tiled here (pixel type other than 8 or 16-bit unsigned integer)
+
+    :param img: image (as returned by OpenCV, BGR band order)
+    """
+    samples = 1 if img.ndim == 2 else img.shape[2]
+    if img.dtype not in [np.uint8, np.uint16] or samples not in [1, 3, 4]:
+        cv2.imwrite(image_path, img, windowed_write_params)
+        return
+    size = WindowedTileSize
+    with TiledTiffWriter(image_path, img.shape[1], img.shape[0], img.dtype, samples, size, 8) as writer:
+        for row in range(writer.tiles_down):
+            for col in range(writer.tiles_across):
+                writer.write_tile(row, col, img[row * size:(row + 1) * size, col * size:(col + 1) * size])
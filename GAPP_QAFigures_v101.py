@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON MODULE FOR THE RENDERING OF THE QUALITY CHECK FIGURES
+------------------------------------------------------------------------------
+The fiducial detection (SCRIPT 02) saves figures to check its results visually: the four corners of each image with
+the fiducial found (_all_fiducials), the corners to check (_To_Be_Checked) and the crops with the barycentre of the
+fiducial (barycentre or fixedCopie folders). This module draws them with OpenCV on thumbnails of the corners, instead
+of matplotlib figures, and out of the detection: the detection only prepares the thumbnails and the shapes to draw
+(add_figure), the figures are returned with the results of each image (pop_figures) and drawn and saved by a separate
+low priority process (FigureRenderer), so that the detection never waits for them.
+
+Version: 1.0.1
+
+Notes:
+
+    - Specific Python modules needed for this script:
+        > Numpy
+        > OpenCV
+
+    - The memory is bounded: with 'background' and 'sampled', the detection waits for the oldest figures when more
+      than QAMaxPending are not drawn yet (the renderer is slower than the detection).
+
+    - QAFigures modes:
+        > 'off': no figure
+        > 'background': figures drawn while the detection runs
+        > 'deferred': figures kept until QADeferredBatch of them are waiting (or the detection is done), then drawn
+          all at once (the detection waits meanwhile)
+        > 'sampled': as 'background', but the figures of the fiducials found are only drawn for one image out of
+          QASampleEvery (the corners to check are always drawn)
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import os
+import zlib
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait
+import numpy as np
+import cv2
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+QAFigures = 'background' # 'off', 'background', 'deferred' or 'sampled' (see Notes)
+QASampleEvery = 10 # with 'sampled', the fiducials found are drawn for one image out of QASampleEvery
+QAWorkers = 1 # number of (low priority) processes drawing the figures
+QAMaxPending = 64 # maximum number of figures (with their thumbnails) waiting to be drawn
+QADeferredBatch = 256 # with 'deferred', number of figures kept before drawing them
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+# figures prepared by the current process since the last pop_figures
+figures = []
+
+red = (0, 0, 255) # BGR
+
+
+def wanted(image_name, kind='found'):
+    """
+    Check if a figure of an image has to be drawn (see QAFigures)
+
+    :param kind: 'found' (fiducials found) or 'check' (corners to check)
+    """
+    if QAFigures == 'off':
+        return False
+    if QAFigures == 'sampled' and kind == 'found':
+        # same images whatever the process and the order in which they are processed
+        return zlib.crc32(image_name.encode()) % max(1, QASampleEvery) == 0
+    return True
+
+
+def to_display(image):
+    """
+    Convert a (corner) image to a 8-bit BGR image to draw on
+    """
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    elif image.dtype != np.uint8:
+        image = cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
+
+def make_panel(image, size=None, title='', rectangles=(), points=(), circles=()):
+    """
+    Prepare one panel of a figure: thumbnail of the image and shapes to draw on it (image coordinates)
+
+    :param size: maximum size (in pixels) of the thumbnail (None: image kept at its size)
+    :param rectangles: list of (u, v, width, height)
+    :param points: list of (u, v)
+    :param circles: list of (u, v, radius)
+    :return: dic (see render_figure)
+    """
+    scale = 1.0
+    if size is not None and max(image.shape[:2]) > size:
+        scale = size / max(image.shape[:2])
+        image = cv2.resize(image, (max(1, int(image.shape[1] * scale)), max(1, int(image.shape[0] * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return {'image': to_display(image), 'title': title,
+            'rectangles': [tuple(int(round(value * scale)) for value in rectangle) for rectangle in rectangles],
+            'points': [tuple(int(round(value * scale)) for value in point) for point in points],
+            'circles': [tuple(int(round(value * scale)) for value in circle) for circle in circles]}
+
+
+def add_figure(path, panels, columns=2, title=''):
+    """
+    Add a figure to draw to the figures of the current process (see pop_figures)
+
+    :param path: path of the png file
+    :param panels: list of panels (see make_panel)
+    """
+    figures.append((path, panels, columns, title))
+
+
+def pop_figures():
+    """
+    Return the figures prepared by the current process since the last call (e.g., for each image)
+    """
+    popped = list(figures)
+    del figures[:]
+    return popped
+
+
+def render_figure(path, panels, columns=2, title=''):
+    """
+    Draw the panels of a figure side by side (columns panels per row) and save it
+    """
+    tiles = []
+    for panel in panels:
+        tile = panel['image'].copy()
+        for u, v, width, height in panel['rectangles']:
+            cv2.rectangle(tile, (u, v), (u + width, v + height), red, 2)
+        for u, v, radius in panel['circles']:
+            cv2.circle(tile, (u, v), max(1, radius), red, 2)
+        for u, v in panel['points']:
+            cv2.circle(tile, (u, v), 3, red, -1)
+        if panel['title']:
+            cv2.putText(tile, panel['title'], (5, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.6, red, 2)
+        tiles.append(tile)
+
+    height = max(tile.shape[0] for tile in tiles)
+    width = max(tile.shape[1] for tile in tiles)
+    rows = -(-len(tiles) // columns)
+    header = 30 if title else 0
+    sheet = np.full((header + rows * height, columns * width, 3), 255, dtype=np.uint8)
+    for i, tile in enumerate(tiles):
+        v0 = header + (i // columns) * height
+        u0 = (i % columns) * width
+        sheet[v0:v0 + tile.shape[0], u0:u0 + tile.shape[1]] = tile
+    if title:
+        cv2.putText(sheet, title, (5, 22), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+
+    Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True) # create folder if does no exist
+    cv2.imwrite(path, sheet)
+
+
+def lower_priority():
+    """
+    Lower the priority of the current process (figure rendering), so that it does not slow down the detection
+    """
+    try:
+        if hasattr(os, 'nice'):
+            os.nice(10)
+        else: # Windows
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), 0x00004000) # BELOW_NORMAL_PRIORITY_CLASS
+    except (OSError, AttributeError):
+        pass
+
+
+class FigureRenderer:
+    """
+    Draw and save the figures returned by the detection (see pop_figures) in separate low priority processes
+    """
+
+    def __init__(self, mode=None, workers=None):
+        self.mode = QAFigures if mode is None else mode
+        self.workers = QAWorkers if workers is None else workers
+        self.pool = None
+        self.pending = [] # futures of the figures being drawn
+        self.deferred = [] # figures kept with 'deferred' (see flush)
+        self.failed = 0
+
+    def start(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=max(1, self.workers), initializer=lower_priority)
+
+    def collect(self):
+        # forget the figures already saved (and their thumbnails)
+        for future in [future for future in self.pending if future.done()]:
+            if future.exception() is not None:
+                self.failed += 1
+                print('! QA figure not saved: ' + str(future.exception()))
+        self.pending = [future for future in self.pending if not future.done()]
+
+    def wait_pending(self, limit):
+        """
+        Wait until at most limit figures are not drawn yet (the oldest first)
+        """
+        self.collect()
+        if len(self.pending) > limit:
+            wait(self.pending[:len(self.pending) - limit])
+            self.collect()
+
+    def draw(self, figure_list):
+        self.start()
+        for figure in figure_list:
+            self.pending.append(self.pool.submit(render_figure, *figure))
+            self.wait_pending(QAMaxPending)
+
+    def submit(self, figure_list):
+        """
+        :param figure_list: figures of an image (see pop_figures)
+        """
+        if self.mode == 'off' or not figure_list:
+            return
+        if self.mode == 'deferred':
+            self.deferred += figure_list
+            if len(self.deferred) >= QADeferredBatch:
+                self.flush()
+            return
+        self.draw(figure_list)
+
+    def flush(self):
+        """
+        Draw the figures kept with 'deferred', and wait until they are saved
+        """
+        if self.deferred:
+            print(' > drawing ' + str(len(self.deferred)) + ' QA figures')
+            figure_list, self.deferred = self.deferred, []
+            self.draw(figure_list)
+            self.wait_pending(0)
+
+    def close(self):
+        """
+        Wait until all the figures are saved
+        """
+        self.flush()
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.collect()
+            self.pool = None
+        if self.failed > 0:
+            print('! ' + str(self.failed) + ' QA figure(s) could not be saved')
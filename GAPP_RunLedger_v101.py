@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON MODULE FOR THE INCREMENTAL RE-RUNS OF THE GAPP SCRIPTS
+------------------------------------------------------------------------------
+Each step of the chain keeps a small ledger (_gapp_ledger_<step>.json) in its output folder. For each output, the
+ledger records a fingerprint of the input file(s) (file size + modification time, or a fast hash of the file content)
+and a fingerprint of the parameters of the step (p, stripes, S, camera, scale_percent, CLAHE, sharpening, ...). When
+a step is run again, only the images whose input, parameters or output changed (or are missing) are processed.
+
+Version: 1.0.1
+
+Notes:
+
+    - The ledger is saved at the end of each step: if a run is interrupted, the images processed during this run
+      will simply be processed again at the next run.
+
+    - To force the processing of all images, uncheck the incremental option (or delete the ledger file).
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import os
+import json
+import hashlib
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+UseContentHash = False # if True, a hash of the beginning and end of each file is used in addition to its size
+                       # and modification time (e.g., for files copied with a new date)
+hash_bytes = 1024 * 1024 # number of bytes hashed at the beginning and at the end of each file
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+
+def file_fingerprint(path):
+    """
+    Fingerprint of a file: size and modification time (+ a fast hash of its content, see UseContentHash)
+
+    :return: string
+    """
+    stat = os.stat(path)
+    fingerprint = str(stat.st_size) + '_' + str(stat.st_mtime_ns)
+    if UseContentHash is True:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            h.update(f.read(hash_bytes))
+            if stat.st_size > 2 * hash_bytes:
+                f.seek(-hash_bytes, os.SEEK_END)
+                h.update(f.read(hash_bytes))
+        fingerprint = str(stat.st_size) + '_' + h.hexdigest()
+    return fingerprint
+
+
+def folder_fingerprint(folder, extensions):
+    """
+    Fingerprint of the files of a folder with the given extensions (e.g., fiducial templates)
+    """
+    files = sorted([file for file in os.listdir(folder) if os.path.splitext(file)[1] in extensions])
+    return params_fingerprint({file: file_fingerprint(os.path.join(folder, file)) for file in files})
+
+
+def params_fingerprint(params):
+    """
+    Fingerprint of the parameters of a step
+
+    :param params: dic of parameters (values must be convertible to string)
+    :return: string
+    """
+    text = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def ledger_path(folder, step):
+    return os.path.join(folder, '_gapp_ledger_' + step + '.json')
+
+
+def load_ledger(folder, step):
+    """
+    Load the ledger of a step ({output name: {'input': fingerprint, 'params': fingerprint}})
+    """
+    if not os.path.isfile(ledger_path(folder, step)):
+        return {}
+    with open(ledger_path(folder, step)) as f:
+        return json.load(f)
+
+
+def save_ledger(ledger, folder, step):
+    os.makedirs(folder, exist_ok=True)
+    with open(ledger_path(folder, step), 'w') as f:
+        json.dump(ledger, f, indent=0, sort_keys=True)
+
+
+def is_up_to_date(ledger, output_name, input_fingerprint, params_fingerprint, output_exists=True):
+    """
+    Check if an output was computed from the same input and with the same parameters, and still exists
+
+    :return: True if the output does not need to be computed again
+    """
+    entry = ledger.get(output_name)
+    if entry is None or output_exists is False:
+        return False
+    return entry['input'] == input_fingerprint and entry['params'] == params_fingerprint
+
+
+def update_ledger(ledger, output_name, input_fingerprint, params_fingerprint):
+    ledger[output_name] = {'input': input_fingerprint, 'params': params_fingerprint}
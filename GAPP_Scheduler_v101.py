@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON MODULE FOR THE MEMORY-AWARE SCHEDULING OF THE PARALLEL STEPS
+------------------------------------------------------------------------------
+The canvas sizing (SCRIPT 01) and the reprojection (SCRIPT 03) hold, in each worker, a full scan (e.g., 16-bit,
+13395 x 13395 pixels, ~360 MB) and an output image of the same size. With one worker per core, a computer with many
+cores and not enough memory ends up swapping. This module estimates the peak memory of each image from its header
+(size, data type and number of bands, no pixel is read) and admits only as many parallel jobs as fit in the memory
+budget. The images are also processed from the largest to the smallest, so that the last jobs of a run are the short
+ones.
+
+Version: 1.0.1
+
+Notes:
+
+    - Specific Python modules needed for this script:
+        > Joblib
+        > Numpy
+        > Pillow (see GAPP_DatasetCatalog)
+
+    - The number of jobs is computed for the largest image, so that the budget is respected whatever the images
+      processed at the same time.
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import os
+import ctypes
+import numpy as np
+from joblib import Parallel, delayed
+from GAPP_DatasetCatalog_v101 import read_header, num_threads
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+MemoryBudget = None # memory (in GB) that the parallel jobs can use. None: MemoryFraction of the physical memory
+MemoryFraction = 0.7 # part of the physical memory used when MemoryBudget is None
+MemoryOverhead = 1.25 # margin on the input + output image sizes (encoding buffers, temporary arrays, ...)
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+
+def physical_memory():
+    """
+    :return: physical memory of the computer (bytes), or None if it can not be read
+    """
+    try:
+        if hasattr(os, 'sysconf'):
+            return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+        class MEMORYSTATUSEX(ctypes.Structure): # Windows
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+        return status.ullTotalPhys
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def memory_budget():
+    """
+    :return: memory budget of the parallel jobs (bytes, see MemoryBudget), or None if unknown
+    """
+    if MemoryBudget is not None:
+        return MemoryBudget * 1024 ** 3
+    total = physical_memory()
+    return None if total is None else total * MemoryFraction
+
+
+def image_bytes(width, height, dtype, samples=1):
+    """
+    :return: size in memory (bytes) of an image array
+    """
+    try:
+        itemsize = np.dtype(dtype).itemsize
+    except TypeError: # unknown image mode (see GAPP_DatasetCatalog): 16-bit assumed
+        itemsize = 2
+    return int(width) * int(height) * int(samples) * itemsize
+
+
+def image_headers(images_list_path):
+    """
+    Read the size, data type and number of bands of images from their headers (see GAPP_DatasetCatalog)
+
+    :return: dic {image path: (width, height, dtype, samples)}
+    """
+    records = Parallel(n_jobs=num_threads, prefer="threads")(delayed(read_header)(image_path)
+                                                             for image_path in images_list_path)
+    return {record['path']: (record['width'], record['height'], record['dtype'], record['samples'])
+            for record in records}
+
+
+def peak_memory(header, output_size=None):
+    """
+    Estimate the peak memory of a job: input image + output image (same data type and bands), plus MemoryOverhead
+
+    :param header: (width, height, dtype, samples) of the input image (see image_headers)
+    :param output_size: (width, height) of the output image (None: same size as the input)
+    :return: bytes
+    """
+    width, height, dtype, samples = header
+    if output_size is None:
+        output_size = (width, height)
+    return int(MemoryOverhead * (image_bytes(width, height, dtype, samples) +
+                                 image_bytes(output_size[0], output_size[1], dtype, samples)))
+
+
+def schedule(items, estimates, num_cores):
+    """
+    Order the jobs from the largest to the smallest and compute the number of jobs that fit in the memory budget
+
+    :param items: jobs (e.g., image paths)
+    :param estimates: dic {item: peak memory in bytes} (see peak_memory)
+    :param num_cores: maximum number of parallel jobs
+    :return: ordered items, number of parallel jobs
+    """
+    items = sorted(items, key=lambda item: estimates[item], reverse=True)
+    n_jobs = max(1, num_cores)
+    budget = memory_budget()
+    if len(items) > 0 and budget is not None:
+        largest = estimates[items[0]]
+        n_jobs = max(1, min(n_jobs, int(budget // max(1, largest))))
+        print('memory budget: ' + str(round(budget / 1024 ** 3, 1)) + ' GB, largest job: ' +
+              str(round(largest / 1024 ** 3, 2)) + ' GB --> ' + str(n_jobs) + ' parallel job(s) (' +
+              str(num_cores) + ' cores asked)')
+        if n_jobs < num_cores:
+            print(' ! fewer parallel jobs than cores to fit in memory (see MemoryBudget in GAPP_Scheduler)')
+    return items, n_jobs
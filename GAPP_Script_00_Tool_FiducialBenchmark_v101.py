@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+------------------------------------------------------------------------------
+PYTHON SCRIPT FOR BENCHMARKING THE FIDUCIAL CENTRE ESTIMATION
+------------------------------------------------------------------------------
+
+Version: 1.0.1
+
+This script compares the fiducial coordinates found by SCRIPT 02 (Automatic Fiducials Detection) with coordinates
+picked by hand on a few images of a dataset, for each way of estimating the centre of the fiducial (type_fidu:
+'fixed', 'barycentre', 'subpixel'). The reference csv has the same columns as the output of SCRIPT 02 (see
+fiducial_marks_coordinates_TEMPLATE.csv: name, X1, Y1, ..., X4, Y4 for top_left, top_right, bot_right, bot_left).
+
+For each method, the distance (in pixels) between the detected and the reference coordinates of each corner is
+saved to a csv, and its statistics (mean, median, RMSE, 95th percentile, maximum) and the detection time per image are
+printed.
+
+Notes:
+
+    - Specific Python modules needed for this script:
+        > Numpy
+        > OpenCV
+        > Pandas
+
+    - The detection parameters (S, p, black_stripe_location, templates) must be the ones used for the dataset in
+      SCRIPT 02. No check figure is drawn.
+
+Log:
+        - v1.0.1
+                - first version
+"""
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import cv2
+
+import GAPP_QAFigures_v101
+from GAPP_FiducialStore_v101 import image_stem
+from GAPP_Script_02_AutomaticFiducialDetection_v201 import as_detection_image, load_template_bank, detect_fiducials, \
+    corner_names
+
+# ----------------------------------------------------------------------------
+################################    SETUP     ################################
+# ----------------------------------------------------------------------------
+
+image_folder = r"D:\PROCESSING\SCANS\Test_SCANS_GAPPS\output\01_CanvasSized" # images (canvas-sized, see SCRIPT 01)
+reference_CSV = r"D:\PROCESSING\SCANS\Test_SCANS_GAPPS\fiducial_marks_coordinates_manual.csv" # coordinates picked by hand
+fiducial_template_folder = r"D:\PROCESSING\SCANS\Test_SCANS_GAPPS\Fiducial_templates_01" # folder with the template images
+center_fidu_tempate_CSV = fiducial_template_folder + "/Center_Fiducials.txt" # centre of the fiducial in the templates
+dataset = 'test_01' # image dataset name (e.g., 'Virunga_1958')
+output_CSV = os.path.dirname(reference_CSV) + '/fiducial_benchmark_' + dataset + '.csv' # errors of each corner
+
+methods = ['fixed', 'barycentre', 'subpixel'] # type_fidu compared (see SCRIPT 02)
+
+# detection parameters (see SCRIPT 02)
+S = 2500 # size of the sub-image around the fiducial for template matching
+p = 0.05 # percentage of black stripe width compare to the total width of the picture
+black_stripe_location = ['bottom', 'right']
+Fiducial_type = 'target'
+
+# ----------------------------------------------------------------------------
+################################ END OF SETUP ###############################
+# ----------------------------------------------------------------------------
+
+
+def read_reference(reference_CSV):
+    """
+    Read the coordinates picked by hand (',' or ';' separated)
+
+    :return: dic {image name (see image_stem): {corner: (u, v)}}
+    """
+    table = pd.read_csv(reference_CSV, sep=None, engine='python')
+    reference = {}
+    for _, row in table.iterrows():
+        reference[image_stem(row['name'])] = {corner: (float(row['X' + str(i + 1)]), float(row['Y' + str(i + 1)]))
+                                              for i, corner in enumerate(corner_names)}
+    return reference
+
+
+def error_statistics(errors):
+    """
+    :param errors: distances (pixels) between the detected and the reference coordinates
+    :return: dic of statistics
+    """
+    errors = np.asarray(errors, dtype=np.float64)
+    if len(errors) == 0:
+        return {'corners': 0}
+    return {'corners': len(errors), 'mean': errors.mean(), 'median': np.median(errors),
+            'rmse': np.sqrt((errors ** 2).mean()), 'p95': np.percentile(errors, 95), 'max': errors.max()}
+
+
+def benchmark(image_folder, reference_CSV, fiducial_template_folder, center_fidu_tempate_CSV, methods):
+    """
+    Detect the fiducials of the reference images with each method and compare them with the reference coordinates
+
+    :return: dataframe (one row per image, method and corner)
+    """
+    GAPP_QAFigures_v101.QAFigures = 'off' # no check figure
+    reference = read_reference(reference_CSV)
+    images = {image_stem(image): image for image in sorted(os.listdir(image_folder))}
+    missing = [name for name in reference if name not in images]
+    if missing:
+        print('! ' + str(len(missing)) + ' reference image(s) not found in ' + image_folder + ': ' + str(missing))
+
+    bank = load_template_bank(fiducial_template_folder, center_fidu_tempate_CSV)
+    rows = []
+    for name in [name for name in reference if name in images]:
+        img = as_detection_image(cv2.imread(os.path.join(image_folder, images[name]), cv2.IMREAD_UNCHANGED))
+        for method in methods:
+            start = time.perf_counter()
+            Coord, _ = detect_fiducials(img, images[name], S, p, Fiducial_type, black_stripe_location, method, dataset,
+                                        fiducial_template_folder, '', center_fidu_tempate_CSV, bank=bank)
+            elapsed = time.perf_counter() - start
+            for corner in corner_names:
+                u_ref, v_ref = reference[name][corner]
+                u, v = Coord.get(corner, (np.nan, np.nan))
+                rows.append({'name': name, 'method': method, 'corner': corner, 'u': u, 'v': v,
+                             'u_ref': u_ref, 'v_ref': v_ref, 'error': np.hypot(u - u_ref, v - v_ref),
+                             'time': elapsed})
+    return pd.DataFrame(rows)
+
+
+def report(table, methods):
+    """
+    Print the error statistics and the detection time of each method
+    """
+    print('\n--- distance to the reference coordinates (pixels) ---')
+    print('     %-10s %7s %7s %7s %7s %7s %7s %8s %10s' % ('method', 'corners', 'mean', 'median', 'rmse', 'p95', 'max',
+                                                          'missing', 's/image'))
+    for method in methods:
+        rows = table[table['method'] == method]
+        if len(rows) == 0:
+            continue
+        found = rows['error'].notna()
+        stats = error_statistics(rows.loc[found, 'error'])
+        time_per_image = rows.groupby('name')['time'].first().mean()
+        if stats['corners'] == 0:
+            print('     %-10s %7d %47s %8d %10.3f' % (method, 0, '', (~found).sum(), time_per_image))
+            continue
+        print('     %-10s %7d %7.2f %7.2f %7.2f %7.2f %7.2f %8d %10.3f' % (
+            method, stats['corners'], stats['mean'], stats['median'], stats['rmse'], stats['p95'], stats['max'],
+            (~found).sum(), time_per_image))
+
+
+if __name__ == "__main__":
+    table = benchmark(image_folder, reference_CSV, fiducial_template_folder, center_fidu_tempate_CSV, methods)
+    table.to_csv(output_CSV, index=False)
+    report(table, methods)
+    print('\n > errors of each corner saved to: ' + output_CSV)
@@ -36,6 +36,7 @@ Notes:
     - Specific Python modules needed for this script:
         > Joblib
         > OpenCV
+        > Pandas
         > Pillow
 
     - To use this script, simply adapt the directory paths and required values
@@ -54,11 +55,17 @@ import os
 from PIL import Image
 Image.MAX_IMAGE_PIXELS = 300000000
 import numpy as np
+import pandas as pd
 import cv2
 from joblib import Parallel, delayed
 import multiprocessing
 from time import sleep
 from pathlib import Path
+from GAPP_DatasetCatalog_v101 import load_catalog, list_image_files
+from GAPP_Scheduler_v101 import peak_memory, schedule
+from GAPP_ImageIO_v101 import windowed_format, write_windowed
+from GAPP_RunLedger_v101 import file_fingerprint, params_fingerprint, load_ledger, save_ledger, is_up_to_date, \
+    update_ledger
 
 ################################    SETUP     ################################
 
@@ -72,9 +79,108 @@ output_image_folder = r"E:\Adille-Data\RESIST\GIS\Optical_Imagery\Aerial_Photogr
 # (if you don't know how many cores you have, write: 'multiprocessing.cpu_count()')
 num_cores = multiprocessing.cpu_count() - 1
 
+#### VIRTUAL CANVAS #####
+# If True, no padded copy of the images is written: only a small manifest (_canvas_manifest.csv) with the original
+# size and path of each image and the standard canvas size is saved in the output folder. SCRIPT 02 and SCRIPT 03 then
+# read the original scans directly and take the canvas into account (the padding only adds black pixels at the
+# bottom and at the right of the images, so that the pixel coordinates are not changed)
+VirtualCanvas = False
+
+#### INCREMENTAL RUN #####
+# If True, only the images that are new, modified, or whose canvas size changed since the last run are processed
+# (see GAPP_RunLedger)
+Incremental = True
+
 ################################ END OF SETUP ################################
 
-def main_script_01(input_image_folder, output_image_folder):
+def list_images(input_image_folder):
+    """
+    List the tif images of a folder and its sub directories
+
+    :param input_image_folder: folder with the raw scans
+    :return: images_list (file names), images_list_path (full paths)
+    """
+    images_list_path = list_image_files(input_image_folder, recursive=True, extensions=[".tif", ".tiff"])  # ,".jpg",".JPG"
+    images_list = [os.path.basename(image_path) for image_path in images_list_path]
+    return images_list, images_list_path
+
+def find_max_dimensions(images_list_path, sizes=None):
+    """
+    Detect the max width and height in the dataset
+
+    :param images_list_path: list of image paths
+    :param sizes: (optional) list of (width, height) of the images, if already known
+    :return: width_max, height_max
+    """
+    if sizes is None:
+        sizes = [Image.open(f, 'r').size for f in images_list_path]
+    sizes_array = np.asarray(sizes)
+    widths = sizes_array[:, 0]
+    heights = sizes_array[:, 1]
+    width_max = max(widths)
+    height_max = max(heights)
+    return width_max, height_max
+
+def canvas_sized_name(image_path):
+    """
+    Name of the canvas-sized image (same name as the input image, complemented with "_CanvasSized")
+    """
+    img_name = os.path.splitext(os.path.basename(image_path))[0]  # Find the name of the input image, without its file extension
+    return img_name + '_CanvasSized.tif'
+
+def pad_canvas(img, width_max, height_max):
+    """
+    Add columns and rows (black pixels, bottom and right) to change the canvas size to maximum width and height
+
+    :param img: image array (original pixel depth)
+    :param width_max: width of the standard canvas
+    :param height_max: height of the standard canvas
+    :return: canvas-sized image
+    """
+    rows, cols = img.shape
+    rows_added = height_max - rows
+    cols_added = width_max - cols
+    imready = cv2.copyMakeBorder(img, top=0, bottom=rows_added, left=0, right=cols_added,
+                                 borderType=cv2.BORDER_CONSTANT, value=0)
+    return imready
+
+def canvas_manifest_path(folder):
+    """
+    Path of the virtual canvas manifest of a folder
+    """
+    return os.path.join(folder, '_canvas_manifest.csv')
+
+def write_canvas_manifest(output_image_folder, images_list_path, sizes, width_max, height_max):
+    """
+    Write the virtual canvas manifest: one line per image with its canvas-sized name, the path of the original scan,
+    its original size and the size of the standard canvas
+
+    :return: None
+    """
+    manifest = pd.DataFrame({'name': [canvas_sized_name(image_path) for image_path in images_list_path],
+                             'path': [os.path.abspath(image_path) for image_path in images_list_path],
+                             'width': [size[0] for size in sizes],
+                             'height': [size[1] for size in sizes],
+                             'canvas_width': width_max,
+                             'canvas_height': height_max})
+    Path(output_image_folder).mkdir(parents=True, exist_ok=True)  # create folder if does no exist
+    manifest.to_csv(canvas_manifest_path(output_image_folder), index=False)
+
+def read_canvas_manifest(folder):
+    """
+    Read the virtual canvas manifest of a folder (see VirtualCanvas)
+
+    :return: dic {canvas-sized name: {'path', 'width', 'height', 'canvas_width', 'canvas_height'}}, or None if the
+             folder has no manifest (i.e., it contains real canvas-sized images)
+    """
+    if not os.path.isfile(canvas_manifest_path(folder)):
+        return None
+    manifest = pd.read_csv(canvas_manifest_path(folder))
+    return {row['name']: {'path': row['path'], 'width': int(row['width']), 'height': int(row['height']),
+                          'canvas_width': int(row['canvas_width']), 'canvas_height': int(row['canvas_height'])}
+            for row in manifest.to_dict('records')}
+
+def main_script_01(input_image_folder, output_image_folder, VirtualCanvas=False, Incremental=False):
 
     print(' ')
     print('=====================================================================')
@@ -85,18 +191,10 @@ def main_script_01(input_image_folder, output_image_folder):
 
     os.chdir(input_image_folder)
     ### Define the list of images and count the number of files to process ###
-    # also look into sub directory
-    allfiles=[]
-    allfiles_path=[]
-    for root, dirs, files in os.walk(input_image_folder):
-        for file in files:
-            allfiles.append(file)
-            images_list = [image for image in allfiles if image[-4:] in [".tif", ".TIF"]]  # ,".jpg",".JPG"
-            images_list = images_list + [image for image in allfiles if image[-5:] in [".tiff", ".TIFF"]]
-            allfiles_path.append(os.path.join(root, file))
-            images_list_path = [image for image in allfiles_path if image[-4:] in [".tif", ".TIF"]]  # ,".jpg",".JPG"
-            images_list_path = images_list_path + [image for image in allfiles_path if image[-5:] in [".tiff", ".TIFF"]]
-
+    # also look into sub directory. The sizes are read from the dataset manifest (headers of new files only)
+    catalog = load_catalog(input_image_folder, recursive=True, extensions=[".tif", ".tiff"])
+    images_list_path = list(catalog['path'])
+    images_list = list(catalog['name'])
 
     # ### Define the list of images and count the number of files to process ###
     # Only main dir
@@ -108,36 +206,60 @@ def main_script_01(input_image_folder, output_image_folder):
     print(' ')
 
     ### Detect the max width and height in the dataset ###
-    sizes = [Image.open(f, 'r').size for f in images_list_path]
-    sizes_array = np.asarray(sizes)
-    widths = sizes_array[:, 0]
-    heights = sizes_array[:, 1]
-    width_max = max(widths)
-    height_max = max(heights)
+    sizes = list(zip(catalog['width'], catalog['height']))
+    width_max, height_max = find_max_dimensions(images_list_path, sizes)
 
     print('maximum width found = ' + str(width_max) + ' pixels')
     print('maximum height found = ' + str(height_max) + ' pixels')
     print(' ')
 
+    if VirtualCanvas is True:
+        # only the manifest is written, the original scans are read by the next steps
+        write_canvas_manifest(output_image_folder, images_list_path, sizes, width_max, height_max)
+        print('virtual canvas manifest saved to: ' + canvas_manifest_path(output_image_folder))
+        print(' ')
+        print('======================')
+        print(' PROCESSING COMPLETED ')
+        print('======================')
+        return
+
+    if os.path.isfile(canvas_manifest_path(output_image_folder)): # remove the manifest of a previous virtual run
+        os.remove(canvas_manifest_path(output_image_folder))
+
+    ### Skip the images already canvas-sized with the same input and canvas size ###
+    params_fp = params_fingerprint({'width_max': width_max, 'height_max': height_max,
+                                    'write_format': windowed_format})
+    ledger = load_ledger(output_image_folder, '01') if Incremental is True else {}
+    input_fp = {image_path: file_fingerprint(image_path) for image_path in images_list_path}
+    images_todo = [image_path for image_path in images_list_path if not is_up_to_date(
+        ledger, canvas_sized_name(image_path), input_fp[image_path], params_fp,
+        os.path.isfile(os.path.join(output_image_folder, canvas_sized_name(image_path))))]
+    if Incremental is True:
+        print('Number of images already up to date (skipped): ' + str(len(images_list_path) - len(images_todo)))
+        print(' ')
+
     ### Standardize the the canvas size of each image ###
     def standardize_canvas(image_path):
         # Read the images, keep the original pixel depth (-1) and read its dimensions
         # file = os.path.join(input_image_folder, os.path.splitext(os.path.basename(image))[0] + '.tif')
         img = cv2.imread(image_path, -1)
-        rows, cols = img.shape
         # Add columns and rows to change the canvas size to maximum width and height
-        rows_added = height_max - rows
-        cols_added = width_max - cols
-        imready = cv2.copyMakeBorder(img, top=0, bottom=rows_added, left=0, right=cols_added,
-                                     borderType=cv2.BORDER_CONSTANT, value=0)
+        imready = pad_canvas(img, width_max, height_max)
         # Save the new image with the standardized size of canvas
-        img_name = os.path.splitext(os.path.basename(image_path))[
-            0]  # Find the name of the input image, without its file extension, in order to use it into the output image name
         Path(output_image_folder).mkdir(parents=True, exist_ok=True)  # create folder if does no exist
-        cv2.imwrite(os.path.join(output_image_folder, img_name + '_CanvasSized.tif'), imready)
+        # (Deflate compressed tiled TIFF, so that SCRIPT 02 and SCRIPT 03 can read them by window, see GAPP_ImageIO)
+        write_windowed(os.path.join(output_image_folder, canvas_sized_name(image_path)), imready)
+
+    # Use parallel processing, with as many jobs as fit in memory (largest images first, see GAPP_Scheduler)
+    headers = {record['path']: (record['width'], record['height'], record['dtype'], record['samples'])
+               for record in catalog.to_dict('records')}
+    estimates = {image_path: peak_memory(headers[image_path], (width_max, height_max)) for image_path in images_todo}
+    images_order, n_jobs = schedule(images_todo, estimates, num_cores)
+    Parallel(n_jobs=n_jobs, verbose=30)(delayed(standardize_canvas)(image_path) for image_path in images_order)
 
-    # Use parallel processing
-    Parallel(n_jobs=num_cores, verbose=30)(delayed(standardize_canvas)(image_path) for image_path in images_list_path)
+    for image_path in images_todo:
+        update_ledger(ledger, canvas_sized_name(image_path), input_fp[image_path], params_fp)
+    save_ledger(ledger, output_image_folder, '01')
 
     sleep(3)
 
@@ -149,7 +271,7 @@ def main_script_01(input_image_folder, output_image_folder):
     ##### END PROCESSING #####
 
 if __name__ == "__main__":
-    main_script_01(input_image_folder, output_image_folder)
+    main_script_01(input_image_folder, output_image_folder, VirtualCanvas, Incremental)
 
 
 
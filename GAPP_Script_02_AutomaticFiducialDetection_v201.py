@@ -69,21 +69,24 @@ Log:
 """
 
 
-import os, sys, copy, csv
+import os, sys, csv
 from pathlib import Path
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import matplotlib
-from math import atan,pi, sin, cos
 from time import sleep
 import multiprocessing
 from joblib import Parallel, delayed
 import cv2
-from PIL import Image
 import json
-matplotlib.use('Agg') # so that no figures are showing up (note that it may pose problems when using Spyder (?))
+from GAPP_Script_01_AirPhoto_CanvasSizing_v201 import read_canvas_manifest
+from GAPP_ImageIO_v101 import open_windowed
+from GAPP_FiducialMatching_v101 import TemplateBank, as_matching_images, match_template, match_template_band, \
+    subpixel_match, symmetry_centre, share_bank, shared_bank, pop_pyramid_stats, report_pyramid_stats
+from GAPP_CircleDetection_v101 import find_circle
+from GAPP_FiducialConsistency_v101 import consistency_outliers
+from GAPP_QAFigures_v101 import wanted, make_panel, add_figure, pop_figures, FigureRenderer
+from GAPP_RunLedger_v101 import file_fingerprint, folder_fingerprint, params_fingerprint, load_ledger, save_ledger, \
+    is_up_to_date, update_ledger
 
 
 # ----------------------------------------------------------------------------
@@ -114,7 +117,9 @@ Template_Virunga_1958_top_right_1 220 220
 corner_folder=rf"{image_folder}/_temp_corners_{dataset}" # folder where temporary fiducials of the images (i.e., where
             # the fiducial marks are located) will be saved
 input_image_folder = image_folder # folder where the images are located
-type_fidu = "barycentre" # parameter for ShiTomasi corner detection. 'fixed' or 'barycentre'
+type_fidu = "barycentre" # parameter for ShiTomasi corner detection. 'fixed' or 'barycentre'. 'subpixel': sub-pixel
+                         # peak of the template matching, without corner detection (see GAPP_FiducialMatching)
+SymmetryRefinement = True # with type_fidu 'subpixel', the centre is refined using the point symmetry of the mark
 Out_fiducialmarks_CSV = rf"{image_folder}/fiducial_marks_coordinates_{dataset}.csv" # output with the
 #  location of the fiducial centre
 
@@ -122,6 +127,14 @@ Out_fiducialmarks_CSV = rf"{image_folder}/fiducial_marks_coordinates_{dataset}.c
 RunParallel = True # to run using parallel processing (otherwise will process one image after the other
 DebugMode = False # will provide more info about subprocess to the console for checking
 OneTemplateMax = True  # if True it will only use the first matching template. If False it will take more time...
+Incremental = True # if True, only the images that are new, modified, or whose detection parameters (or templates)
+                   # changed since the last run are processed. The coordinates of the other images are kept in the csv.
+NativeDepth = False # if True, 16-bit scans (and templates) are matched at their original depth (in float32) instead
+                    # of being converted to 8-bit. Slower, but keeps the full dynamic of the scans for the matching.
+PyramidMatching = True # if True, the templates are matched at low resolution first, then refined at full resolution
+                       # around the best peaks only (see GAPP_FiducialMatching). Otherwise, full resolution search.
+WindowedReading = True # if True, only the corners of the scans are read from disk (uncompressed or Deflate TIFF, see
+                       # GAPP_ImageIO). Otherwise (or for other formats) the full image is read.
 
 #### SOME PARAMETERS #####
 p=0.05 # percentage of black stripe width compare to the total width of the picture (e.g., 0.05). To be associated with parameter >> black_stripe_location
@@ -131,12 +144,36 @@ MatchingValueThreshold= 0.85 # value to define a good match. See OpenCV cv2.matc
 DPI=200 # resolution of figures for visual check
 Fiducial_type = 'target' # type : target or rectangle or cross. Should be target for now ;)
 
+#### ADAPTIVE SEARCH WINDOWS #####
+AdaptiveWindows = False # if True, the search window of each corner is reduced to a region around the fiducial positions
+                        # already detected in the dataset. The full window (S) is used again for a corner if the match
+                        # is below MatchingValueThreshold. Faster on homogeneous datasets.
+AdaptiveMinImages = 5 # number of images with detected fiducials needed before reducing the windows
+AdaptiveSigma = 4 # half size of the region around the mean fiducial position, in standard deviations
+AdaptiveMargin = 50 # (pixels) added to the half size of the region
+
+#### GEOMETRIC CONSISTENCY CHECK #####
+ConsistencyCheck = True # if True, the fiducial quadrilaterals of all the images are compared once the detection is
+                        # done, and the corners that do not fit the other ones (or missing) are searched again around
+                        # their predicted position (see GAPP_FiducialConsistency)
+ConsistencySearchRadius = 100 # (pixels) half size of the region searched around the predicted position
+
+#### MATCHING RECORDS #####
+PeakRecords = True # if True, the best correlation peaks of each corner (scores and positions of each template), its
+                   # search window and the results of the fallbacks (larger window, circle) are saved next to the csv
+                   # ('_peaks.json'), so that the threshold can be changed afterwards without matching again (Redecide)
+PeakRecordCount = 5 # number of correlation peaks saved per template
+PeakRecordMapSize = None # (pixels) if given (e.g., 64), the correlation maps are also saved, downsampled to this
+                         # size (float16, one '.npz' file per image in the '_peaks' folder)
+Redecide = False # if True, no matching: MatchingValueThreshold and the fallback rules are applied again to the saved
+                 # records, and the csv (and the to be checked csv) are written again (see redecide)
+
 
 #### PARALLEL PROCESSING #####
     # (Choose the number of CPU cores you want to use)
     # (minimum = 1; suggested value = (number of cores) - 1)
     # (if you don't know how many cores you have, write: 'multiprocessing.cpu_count()')
-num_cores = multiprocessing.cpu_count() - 1
+num_cores = max(1, multiprocessing.cpu_count() - 1)
 
 # ----------------------------------------------------------------------------
 ################################ END OF SETUP ###############################
@@ -172,6 +209,67 @@ def addLine(image_name, Fiducial_Coordinates, Out_fiducialmarks_CSV):
     w.writerow(line)
     f.close()
     
+def createCSV(Out_fiducialmarks_CSV):
+    """
+    Fonction creating the csv file with the fiducial coordinates (header only)
+
+    :return: None
+    """
+    lines =[["name;X1;Y1;X2;Y2;X3;Y3;X4;Y4"]]
+    f = open(Out_fiducialmarks_CSV, "w",newline='')
+    w = csv.writer(f,delimiter=",")
+    w.writerows(lines)
+    f.close()
+
+def readCSV(Out_fiducialmarks_CSV):
+    """
+    Fonction reading the lines of an existing csv file with the fiducial coordinates
+
+    :return: dic {image name (without extension): csv line}
+    """
+    rows = {}
+    if os.path.isfile(Out_fiducialmarks_CSV):
+        with open(Out_fiducialmarks_CSV, newline='') as f:
+            for line in f.read().splitlines()[1:]:
+                if line != '':
+                    rows[line.split(';')[0]] = line
+    return rows
+
+def writeCSVLines(Out_fiducialmarks_CSV, rows, imlist):
+    """
+    Fonction (re)creating the csv file with the fiducial coordinates, with the lines of the given images
+
+    :param rows: dic {image name (without extension): csv line} (see readCSV)
+    :param imlist: list of images, in the order of the lines
+    :return: None
+    """
+    createCSV(Out_fiducialmarks_CSV)
+    f = open(Out_fiducialmarks_CSV, "a",newline='')
+    w = csv.writer(f,delimiter=",")
+    for image_name in imlist:
+        w.writerow([rows[os.path.splitext(image_name)[0]]])
+    f.close()
+
+def keepCSVLines(Out_fiducialmarks_CSV, rows, imlist):
+    """
+    Fonction (re)creating the csv file with the fiducial coordinates and the to be checked csv, keeping only the
+    lines of the given images (i.e., images not processed again, see Incremental)
+
+    :param rows: dic {image name (without extension): csv line} (see readCSV)
+    :param imlist: list of images to keep
+    :return: None
+    """
+    writeCSVLines(Out_fiducialmarks_CSV, rows, imlist)
+
+    ToBeChecked_CSV = Out_fiducialmarks_CSV[:-4] + '_TobeChecked.csv'
+    if os.path.isfile(ToBeChecked_CSV):
+        ToBeChecked = pd.read_csv(ToBeChecked_CSV, index_col=0)
+        ToBeChecked = ToBeChecked[ToBeChecked['image'].isin(imlist)]
+        if ToBeChecked.empty:
+            os.remove(ToBeChecked_CSV)
+        else:
+            ToBeChecked.to_csv(ToBeChecked_CSV, mode='w')
+
 def distance(matrice,xc,yc):
     """
     Calculate distance between 2 points
@@ -191,7 +289,7 @@ def distance(matrice,xc,yc):
     dy = matrice[:,:,1]-yc
     return np.sqrt(dx**2 + dy**2)
     
-def CenterFiducial_LUCASKANADE(img2,Fidu_type,orientation,template,xc,yc,image_name, corner,type_fidu, corner_folder):
+def CenterFiducial_LUCASKANADE(img2,Fidu_type,orientation,template,xc,yc,image_name, corner,type_fidu, corner_folder, match=None):
      """
     allow to detect and give the coordinates of a fiducial mark using the Lucas Kanade filter
     
@@ -207,38 +305,27 @@ def CenterFiducial_LUCASKANADE(img2,Fidu_type,orientation,template,xc,yc,image_n
     :type xc: int
     :param yc: pixel's line of the center in template image
     :type yc: int
+    :param match: (optional) maxVal, maxLoc of the template already matched (see TemplateBank)
+    :type match: (float, (int, int))
     
     :return: u,v Coordinates of the fiducial
     :rtype: int,int
     """
      text=image_name + '_' + corner
      if Fidu_type =='target':
-         res = cv2.matchTemplate(img2,template,cv2.TM_CCOEFF_NORMED)
-         (_, maxVal, _, maxLoc) = cv2.minMaxLoc(res) #maxloc = (u,v)
+         if match is None:
+             match = match_template(*as_matching_images(img2,template), pyramid=PyramidMatching)
+         maxVal, maxLoc = match #maxloc = (u,v)
 
          if DebugMode is True:
             # print(img2.shape)
             print('     template matching statistics for '+ corner +' > Max value: ' + str(maxVal) + ' | ' + str(maxLoc))
 
-            # Create a fancy figure
-            import matplotlib.patches as patches
-            fig, axs = plt.subplots(1, 2, figsize=(6, 4))
-            fig.suptitle(text, fontweight="bold")
-            axs[0].imshow(img2, cmap=plt.cm.gray)
-            axs[0].set_title('corner image')
-            # Add a rectangle with location of template
-            rect = patches.Rectangle((maxLoc[0], maxLoc[1]), template.shape[0], template.shape[1], linewidth=2, edgecolor='r', facecolor='none')
-            # Add the patch to the Axes
-            axs[0].add_patch(rect)
-            axs[1].imshow(template, cmap=plt.cm.gray)
-            axs[1].set_title('template')
-
 
          Sfid=0
          Img=img2[maxLoc[1]-Sfid:maxLoc[1]+template.shape[0]+Sfid,\
                                 maxLoc[0]-Sfid:maxLoc[0]+template.shape[1]+Sfid] # temlate and image should have the same size
-         im_gray = cv2.cvtColor(Img,cv2.COLOR_BGR2GRAY)
-         # template = cv2.cvtColor(template,cv2.COLOR_BGR2GRAY)
+         im_gray = Img # corner and template are already single-band (see as_detection_image)
 
         # find the corners (ie points of reconition) in the image---------------
         #-----------------------------------------------------------------------
@@ -249,7 +336,7 @@ def CenterFiducial_LUCASKANADE(img2,Fidu_type,orientation,template,xc,yc,image_n
                            minDistance = 3,
                            blockSize = 3)
     
-             p0 = cv2.goodFeaturesToTrack(im_gray, **feature_params)
+             p0 = cv2.goodFeaturesToTrack(as_matching_images(im_gray)[0], **feature_params)
              d = distance(p0,xc,yc)
              err=np.argsort(d,axis=0)
              if(d[err[0][0]][0] >= 15 ):
@@ -269,72 +356,27 @@ def CenterFiducial_LUCASKANADE(img2,Fidu_type,orientation,template,xc,yc,image_n
             # Match the fiducial on the picture------------------------------------
             #-----------------------------------------------------------------------
             # Parameters for lucas kanade optical flow
-             final_mask=copy.deepcopy(im_gray)
-             final_mask = cv2.circle(final_mask,(int(round(x)),int(round(y))),1,255,-1)
-             save_folder_path=corner_folder + '/' + corner + "/barycentre/"
-             Path(save_folder_path).mkdir(parents=True, exist_ok=True) #create folder if does no exist
-             plt.imsave(save_folder_path + "/file_%s.png"%(text),final_mask)
+             if wanted(image_name):
+                 add_figure(corner_folder + '/' + corner + "/barycentre/file_%s.png"%(text),
+                            [make_panel(im_gray, points=[(x, y)])], columns=1)
+         if type_fidu == "subpixel": # sub-pixel peak of the correlation (no corner detection)
+             su, sv = subpixel_match(img2, template, maxLoc)
+             x = su - maxLoc[0] + xc
+             y = sv - maxLoc[1] + yc
+             if SymmetryRefinement is True: # centre of symmetry of the mark
+                 x, y = symmetry_centre(im_gray, x, y)
+             if wanted(image_name):
+                 add_figure(corner_folder + '/' + corner + "/subpixel/file_%s.png"%(text),
+                            [make_panel(im_gray, points=[(x, y)])], columns=1)
          if type_fidu == "fixed":
              x = xc
              y = yc
-             final_mask=copy.deepcopy(im_gray)
-             final_mask = cv2.circle(final_mask,(int(round(x)),int(round(y))),1,255,-1)
-             save_folder_path=corner_folder + '/' + corner + "/fixedCopie/"
-             Path(save_folder_path).mkdir(parents=True, exist_ok=True) #create folder if does no exist
-             plt.imsave(save_folder_path + "/file_%s.png"%(text),final_mask)
+             if wanted(image_name):
+                 add_figure(corner_folder + '/' + corner + "/fixedCopie/file_%s.png"%(text),
+                            [make_panel(im_gray, points=[(x, y)])], columns=1)
 
          return x+maxLoc[0],y+maxLoc[1], maxVal
 
-def FindCircles(corner_image,DP=0.05, MinDist=20, MinRadius=170, MaxRadius=250, parameter2=100):
-    """
-    OpenCV HoughCircles is used when template matching isn't working. It only works if the fiducial is a circle...
-
-    :param corner_image_path:
-    :param DP:This parameter is the inverse ratio of the accumulator resolution to the image resolution
-    (see Yuen et al. for more details). Essentially, the larger the dp gets, the smaller the accumulator array gets.
-    :param MinDist: Minimum distance between the center (x, y) coordinates of detected circles. If the minDist is too
-    small, multiple circles in the same neighborhood as the original may be (falsely) detected. If the minDist is too
-    large, then some circles may not be detected at all.
-    :param MinRadius: Minimum size of the radius (in pixels).
-    :param MaxRadius: Maximum size of the radius (in pixels).
-    :param parameter2: Accumulator threshold value for the cv2.HOUGH_GRADIENT method. The smaller the threshold is,
-    the more circles will be detected (including false circles). The larger the threshold is less circles will
-    potentially be returned.
-    :return:
-    """
-
-    # corner_image = cv2.imread(corner_image_path, cv2.CV_8UC1)
-    corner_imageBlr = cv2.GaussianBlur(corner_image, (11, 11), cv2.BORDER_DEFAULT)
-
-    im = corner_imageBlr
-
-    detected_circles = None
-    while detected_circles is None:  # or len(detected_circles[0])<2: # will decrease the parameter2 until it founds a circle
-        detected_circles = cv2.HoughCircles(im,
-                                            cv2.HOUGH_GRADIENT,dp=DP, minDist=MinDist, param1=50,
-                                            param2=parameter2, minRadius=MinRadius, maxRadius=MaxRadius)
-        if DebugMode is True:
-            print('   ' + os.path.basename(corner_image_path) + '> ' + str(MinDist)+ ' ' + str(parameter2)) #for debugging
-
-        parameter2 = parameter2 - 2
-
-        if parameter2 < 14:
-            break
-    if DebugMode is True:
-        fig, axs = plt.subplots(1, 2, figsize=(6, 6))
-        fig.suptitle(os.path.basename(corner_image_path[:-4]), fontweight="bold")
-        axs[0].imshow(corner_image, cmap=plt.cm.gray)
-        axs[0].set_title('corner')
-        axs[1].imshow(im)
-        axs[1].set_title('thresholded')
-        if detected_circles is not None:
-            for i in range(len(detected_circles[0])):
-                circle1 = plt.Circle((detected_circles[0][i][0], detected_circles[0][i][1]), (detected_circles[0][i][2]), fill=False, color='r')
-                axs[1].add_patch(circle1)
-                axs[1].plot(detected_circles[0][i][0], detected_circles[0][i][1], 'r',marker=".", markersize=10)
-
-    return detected_circles
-
 def systeme(a1,b1,c1,a2,b2,c2): 
     """ 
     find the coordinate of the intersection point of 2 lines
@@ -370,7 +412,55 @@ def systeme(a1,b1,c1,a2,b2,c2):
        print('x =',round(x,0),"",'y =',round(y,0))
     return x, y 
 
-def select_fiducial_corners(img,S,p,Fidu_type, black_stripe_location):
+def crop_canvas(img, v0, u0, S, canvas_size=None):
+    """
+    Crop a square of S pixels in an image. With a virtual canvas (see SCRIPT 01, VirtualCanvas), the image is the
+    original scan and the part of the square falling in the (black) padding of the canvas is filled with zeros, as if
+    the image had been canvas-sized.
+
+    :param canvas_size: (width, height) of the canvas, or None if the image is already canvas-sized
+    :return: cropped image
+    """
+    if canvas_size is None:
+        return img[v0:v0+S,u0:u0+S]
+
+    rows = min(v0 + S, canvas_size[1]) - v0
+    cols = min(u0 + S, canvas_size[0]) - u0
+    window = img[v0:v0+rows,u0:u0+cols]
+    if window.shape[0] < rows or window.shape[1] < cols:
+        padded = np.zeros((rows, cols) + img.shape[2:], dtype=img.dtype)
+        padded[:window.shape[0], :window.shape[1]] = window
+        window = padded
+    return window
+
+corner_names = ['top_left', 'top_right', 'bot_right', 'bot_left'] # corners where the fiducials are searched
+
+def fiducial_corner_positions(U, V, S, p, black_stripe_location):
+    """
+    Position (v0, u0) of the top-left pixel of the S x S window of each corner, for an image of U x V pixels
+
+    :return: dic {corner: (v0, u0)}
+    """
+    # by default corner size
+    u_left = 0
+    u_right = U - S
+    v_top = 0
+    v_bot = V - S
+
+    # Update for black strip:
+    if 'top' in black_stripe_location:
+        v_top = v_top + int(p*V)
+    if 'bottom' in black_stripe_location:
+        v_bot = v_bot - int(p*V)
+    if 'left' in black_stripe_location:
+        u_left = u_left + int(p * U)
+    if 'right' in black_stripe_location:
+        u_right = u_right - int(p*U)
+
+    return {'top_left': (v_top, u_left), 'top_right': (v_top, u_right), 'bot_right': (v_bot, u_right),
+            'bot_left': (v_bot, u_left)}
+
+def select_fiducial_corners(img,S,p,Fidu_type, black_stripe_location, canvas_size=None, windows=None, corners=None):
     """ 
     Crop image to select area where are the fiducials
 
@@ -384,6 +474,12 @@ def select_fiducial_corners(img,S,p,Fidu_type, black_stripe_location):
     :type Fidu_type: str
     :param black_stripe_location: (top, left, right, bot)
     :type black_stripe_location: [str]
+    :param canvas_size: (width, height) of the virtual canvas, if the image is not canvas-sized (see crop_canvas)
+    :type canvas_size: (int, int)
+    :param windows: (optional) reduced search window of each corner (see adaptive_windows)
+    :type windows: dic {corner: [v0, u0, size] or None}
+    :param corners: (optional) corners to crop (by default, all)
+    :type corners: [str]
         
     :returns:
         - F :if Fidu-type == target or cross: atrributes top_left, top_right, bot_left, bot_right
@@ -395,84 +491,382 @@ def select_fiducial_corners(img,S,p,Fidu_type, black_stripe_location):
     F={}
     U=img.shape[1] #hori
     V=img.shape[0] #verti
+    if canvas_size is not None:
+        U, V = canvas_size
 
     if Fidu_type == "target" or Fidu_type == "cross":
-        # by default corner size
-        u_left = 0
-        u_right = U - S
-        v_top = 0
-        v_bot = V - S
-
-        # Update for black strip:
-        if 'top' in black_stripe_location:
-            v_top = v_top + int(p*V)
-        if 'bottom' in black_stripe_location:
-            v_bot = v_bot - int(p*V)
-        if 'left' in black_stripe_location:
-            u_left = u_left + int(p * U)
-        if 'right' in black_stripe_location:
-            u_right = u_right - int(p*U)
-
-        F['top_left'] = [img[v_top:v_top+S,u_left:u_left+S],v_top,u_left]
-        F['top_right'] = [img[v_top:v_top+S,u_right:u_right+S],v_top,u_right]
-        F['bot_right'] = [img[v_bot:v_bot+S,u_right:u_right+S],v_bot,u_right]
-        F['bot_left'] = [img[v_bot:v_bot+S,u_left:u_left+S],v_bot,u_left]
+        positions = fiducial_corner_positions(U, V, S, p, black_stripe_location)
+        for corner in (corner_names if corners is None else corners):
+            v0, u0 = positions[corner]
+            size = S
+            if windows is not None and windows.get(corner) is not None:
+                v0, u0, size = windows[corner]
+            F[corner] = [crop_canvas(img, v0, u0, size, canvas_size),v0,u0]
     else :
         print("type of fiducial not defined: please complete the code")
     return F
 
 
+def corner_to_image(corner_crop, u, v, type_fidu):
+    """
+    Coordinates in the image of a point of a corner image: integer pixels, or rounded to 0.01 pixel with the
+    sub-pixel estimation (type_fidu 'subpixel')
+
+    :param corner_crop: [corner image, v0, u0] (see select_fiducial_corners)
+    :return: u1 (colon), v1 (line)
+    """
+    if type_fidu == "subpixel":
+        return round(float(corner_crop[2] + u), 2), round(float(corner_crop[1] + v), 2)
+    return int(corner_crop[2] + u), int(corner_crop[1] + v)
+
+def update_corner_stats(corner_stats, Coord):
+    """
+    Update the running statistics (mean and variance, Welford's algorithm) of the fiducial positions of each corner
+    with the coordinates found for one image
+
+    :param corner_stats: dic {corner: {'n', 'u', 'v', 'm2_u', 'm2_v'}}, updated in place
+    :param Coord: dic {corner: [u, v]}
+    """
+    for corner, (u, v) in Coord.items():
+        stats = corner_stats.setdefault(corner, {'n': 0, 'u': 0.0, 'v': 0.0, 'm2_u': 0.0, 'm2_v': 0.0})
+        stats['n'] = stats['n'] + 1
+        du = float(u) - stats['u']
+        dv = float(v) - stats['v']
+        stats['u'] = stats['u'] + du / stats['n']
+        stats['v'] = stats['v'] + dv / stats['n']
+        stats['m2_u'] = stats['m2_u'] + du * (float(u) - stats['u'])
+        stats['m2_v'] = stats['m2_v'] + dv * (float(v) - stats['v'])
+
+def adaptive_windows(corner_stats, bank, S):
+    """
+    Reduced search window of each corner: square centred on the mean fiducial position, large enough to contain the
+    templates anywhere in a region of AdaptiveSigma standard deviations (+ AdaptiveMargin) around it
+
+    :param corner_stats: see update_corner_stats
+    :param bank: TemplateBank of the run
+    :return: dic {corner: [v0, u0, size]}, None for a corner if not enough images or if not smaller than S
+    """
+    windows = {}
+    for corner in corner_names:
+        windows[corner] = None
+        stats = corner_stats.get(corner)
+        if stats is None or stats['n'] < max(2, AdaptiveMinImages):
+            continue
+        template_size = max([max(template.shape[:2]) for template in bank.template_images(corner).values()] + [0])
+        radius = AdaptiveSigma * np.sqrt(max(stats['m2_u'], stats['m2_v']) / (stats['n'] - 1)) + AdaptiveMargin
+        size = int(2 * (template_size + radius))
+        if size < S:
+            windows[corner] = [max(0, int(stats['v'] - size / 2)), max(0, int(stats['u'] - size / 2)), size]
+    return windows
+
+class FiducialRecord:
+    """
+    Result of the matching of a fiducial template in a corner of an image. Lightweight (slotted) record used during
+    the detection instead of dataframe rows; converted to a table in one go when needed (see records_table)
+    """
+    __slots__ = ['image', 'corner', 'template', 'xc', 'yc', 'u1', 'v1', 'maxVal']
+
+    def __init__(self, image, corner, template, xc, yc, u1, v1, maxVal):
+        self.image = image
+        self.corner = corner
+        self.template = template
+        self.xc = xc
+        self.yc = yc
+        self.u1 = u1
+        self.v1 = v1
+        self.maxVal = maxVal
+
+def records_table(records, columns=None):
+    """
+    Convert a list of FiducialRecord to a dataframe
+
+    :param columns: attributes to keep (by default, all)
+    :return: dataframe
+    """
+    if columns is None:
+        columns = FiducialRecord.__slots__
+    return pd.DataFrame([[getattr(record, column) for column in columns] for record in records], columns=columns)
+
 def FiducialFig(F,fidu_coordinates, corner_folder):
     """
-    Create a figure with the 4 corners per image, with a red rectangle showing the outline of the template position
-    and a point at the fiducial coordinates
+    Prepare a figure with the 4 corners per image, with a red rectangle showing the outline of the template position
+    and a point at the fiducial coordinates. The figure is drawn and saved out of the detection (see GAPP_QAFigures)
 
-    :param F:
-    :param fidu_coordinates:
+    :param F: corner images (see select_fiducial_corners)
+    :param fidu_coordinates: list of FiducialRecord (one per corner)
     :return:
     """
 
-    fidu_coordinates2=fidu_coordinates.set_index('corner')
+    image_name = fidu_coordinates[0].image
+    if not wanted(image_name):
+        return
+
+    panels = []
+    for record in fidu_coordinates:
+        corner = record.corner
+        u = record.u1 - int(F[corner][2]) # fiducial coordinates in the corner image
+        v = record.v1 - int(F[corner][1])
+        panels.append(make_panel(F[corner][0], 3 * DPI, corner,
+                                 rectangles=[(u - record.xc, v - record.yc, record.xc * 2, record.yc * 2)],
+                                 points=[(u, v)]))
+
+    add_figure(corner_folder + '/_all_fiducials/_FiducialsDetection_' + image_name + '_' + corner + '.png',
+               panels, columns=2, title=image_name)
+
+
+
+def as_detection_image(img):
+    """
+    Convert an image read with its original pixel depth (cv2.IMREAD_UNCHANGED) to the single-band image used for the
+    fiducial detection: 8-bit (as cv2.imread(image_path) would convert it), or 16-bit if NativeDepth is True. Used for
+    the scans read from disk, the scans already in memory (see GAPP_FusedPipeline) and the templates, so that all
+    give the same result.
+
+    :param img: image array (original pixel depth)
+    :return: single-band image
+    """
+    if img.dtype == np.uint16 and NativeDepth is False:
+        img = (img >> 8).astype(np.uint8) # keep the most significant byte
+    if img.ndim == 3 and img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+    elif img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img
+
+def read_template_centers(center_fidu_tempate_CSV):
+    """
+    Read the centre of the fiducial in each template (see Center_Fiducials.txt, SCRIPT 00)
+
+    :return: dic {template name (without extension): (xc, yc)}
+    """
+    centers = {}
+    with open(center_fidu_tempate_CSV) as center_fidu_tempate:
+        for line in center_fidu_tempate.readlines():
+            line = line.split()
+            try:
+                centers[line[0]] = (int(line[1]), int(line[2])) # coordinates of the center of the fiducial template (pointed by hand)
+            except (IndexError, ValueError): # header or empty line
+                continue
+    return centers
+
+def load_template_bank(fiducial_template_folder, center_fidu_tempate_CSV):
+    """
+    Load the fiducial templates of each corner (only the first one if OneTemplateMax is True) and their centre, and
+    prepare them for the matching (see GAPP_FiducialMatching, TemplateBank). Done once per run: missing templates or
+    centres are all reported before any image is processed.
+
+    :return: TemplateBank
+    """
+    template_list_all = sorted([template for template in os.listdir(fiducial_template_folder) if template[-4:] in ['.tif']])
+    centers = read_template_centers(center_fidu_tempate_CSV) if os.path.isfile(center_fidu_tempate_CSV) else {}
+    templates = {}
+    problems = []
+    for corner in corner_names:
+        template_list = [template for template in template_list_all if corner in template]
+        if len(template_list) == 0:
+            problems.append("no fiducial template found for the corner '" + corner + "'")
+        if OneTemplateMax is True: # will only use the first matching template
+            template_list = template_list[:1]
+        for template_name in template_list:
+            xc, yc = centers.get(template_name.split('.')[0], (0, 0))
+            if xc == 0 or yc == 0:
+                problems.append("no center coordinates for the template " + template_name)
+        templates[corner] = {template_name: as_detection_image(cv2.imread(
+            fiducial_template_folder + '/' + template_name, cv2.IMREAD_UNCHANGED)) for template_name in template_list}
+
+    if len(problems) > 0:
+        print("! Problem with the fiducial templates | << check the template folder and 'Center_Fiducials.txt' file >>")
+        for problem in problems:
+            print('   - ' + problem)
+        sys.exit()
+
+    return TemplateBank(templates, pyramid=PyramidMatching,
+                        centers={template_name: centers[template_name.split('.')[0]]
+                                 for corner_templates in templates.values() for template_name in corner_templates})
+
+def write_to_be_checked(ToBeChecked, Out_fiducialmarks_CSV):
+    """
+    Append the image corners with uncertain matching to the '_TobeChecked.csv' file
+
+    :param ToBeChecked: list of FiducialRecord with the corners to check
+    :param Out_fiducialmarks_CSV: path of the csv file with the fiducial coordinates
+    :return: None
+    """
+    if len(ToBeChecked) > 0:
+        ToBeChecked = records_table(ToBeChecked, ['image', 'corner', 'u1', 'v1', 'maxVal'])
+        # write to file
+        if not os.path.isfile(Out_fiducialmarks_CSV[:-4] + '_TobeChecked.csv'):
+            ToBeChecked.to_csv(Out_fiducialmarks_CSV[:-4] + '_TobeChecked.csv', mode='w', header=['image', 'corner', 'x', 'y', 'maxVal']) # append to file
+        else:  # else it exists so append without writing the header
+            ToBeChecked.to_csv(Out_fiducialmarks_CSV[:-4] + '_TobeChecked.csv', mode='a', header=False) # append to file
 
-    # Create a figure
-    fig, axs = plt.subplots(2, 2, figsize=(12, 12))
-    fig.suptitle(fidu_coordinates['image'][0] +"\n", fontweight="bold")
-    x = 0
-    y = 0
-    for corner in fidu_coordinates['corner']:
-        axs[y, x].imshow(F[corner][0], cmap=plt.cm.gray)
-        axs[y, x].set_title(corner)
+def drop_to_be_checked(corners, Out_fiducialmarks_CSV):
+    """
+    Remove image corners from the '_TobeChecked.csv' file (e.g., corners corrected by check_consistency)
 
-        # Add a rectangle with location of template
-        template_rectangle = patches.Rectangle(
-            (fidu_coordinates2.loc[corner]['u1'] - int(F[corner][2]+ fidu_coordinates2.loc[corner]['xc'] ), fidu_coordinates2.loc[corner]['v1'] - int(F[corner][1]) - fidu_coordinates2.loc[corner]['yc']),
-            fidu_coordinates2.loc[corner]['xc']*2, fidu_coordinates2.loc[corner]['yc']*2,
-            linewidth=2, edgecolor='r', facecolor='none')
-        axs[y, x].add_patch(template_rectangle) # Add the patch to the Axes
+    :param corners: list of (image, corner)
+    :param Out_fiducialmarks_CSV: path of the csv file with the fiducial coordinates
+    :return: None
+    """
+    ToBeChecked_CSV = Out_fiducialmarks_CSV[:-4] + '_TobeChecked.csv'
+    if len(corners) == 0 or not os.path.isfile(ToBeChecked_CSV):
+        return
+    ToBeChecked = pd.read_csv(ToBeChecked_CSV, index_col=0)
+    stale = pd.Series(list(zip(ToBeChecked['image'], ToBeChecked['corner']))).isin(set(corners)).to_numpy()
+    ToBeChecked = ToBeChecked[~stale]
+    if ToBeChecked.empty:
+        os.remove(ToBeChecked_CSV)
+    else:
+        ToBeChecked.to_csv(ToBeChecked_CSV, mode='w')
 
-        # Add a circle at the found fiducial coordinates
-        axs[y, x].plot(
-            fidu_coordinates2.loc[corner]['u1'] - int(F[corner][2]), fidu_coordinates2.loc[corner]['v1'] - int(F[corner][1]),
-            5, color='r', marker=".", markersize=2)
+def open_detection_image(image_folder, image_name, canvas=None):
+    """
+    Open an image for the detection: the original scan with a virtual canvas, read by window if WindowedReading
 
+    :param canvas: entry of the canvas manifest of the image, if any (see SCRIPT 01, VirtualCanvas)
+    :return: image (array or WindowedTiff, see GAPP_ImageIO), canvas_size
+    """
+    if canvas is not None: # virtual canvas: read the original scan (see SCRIPT 01, VirtualCanvas)
+        image_path = canvas['path']
+        canvas_size = (canvas['canvas_width'], canvas['canvas_height'])
+    else:
+        image_path = image_folder + '/' + image_name
+        canvas_size = None
+    if WindowedReading is True: # the corner windows are read (and converted) when they are cropped
+        img = open_windowed(image_path, as_detection_image)
+    else:
+        img=as_detection_image(cv2.imread(image_path, cv2.IMREAD_UNCHANGED))
+    return img, canvas_size
 
+peak_records = {} # matching records of the images processed by this process (see pop_peak_records)
 
-        x = x + 1
-        if x == 2:
-            x = 0;
-            y = 1
+def pop_peak_records():
+    """
+    Return and reset the matching records of the images processed by this process (see PeakRecords), so that the
+    workers can send them back with their results
 
-    fig.tight_layout()
-    # save figure
-    save_folder_path = corner_folder + '/_all_fiducials'
-    Path(save_folder_path).mkdir(parents=True,
-                                 exist_ok=True)  # create folder if does no exist
-    plt.savefig(save_folder_path + '/_FiducialsDetection_' + fidu_coordinates['image'][0] + '_' + corner + '.png',
-                dpi=DPI)
+    :return: dic {image name: {corner: record}} (see rank_corner)
+    """
+    records = dict(peak_records)
+    peak_records.clear()
+    return records
 
+def rank_corner(bank, corner_crop, corner):
+    """
+    Score the templates of a corner (see TemplateBank.rank), and prepare the matching record of the corner if
+    PeakRecords is True: search window [v0, u0, height, width], best peaks of each template ([maxVal, u, v] of the
+    top-left corner of the template, in the image) and, if PeakRecordMapSize, the downsampled correlation maps. The
+    results of the centre estimation ('first'), of the larger window ('retry') and of the circle detection ('circle')
+    are added by detect_fiducials.
+
+    :param corner_crop: [corner image, v0, u0] (see select_fiducial_corners)
+    :return: ranking (see TemplateBank.rank), record (dic, or None if PeakRecords is False)
+    """
+    if PeakRecords is False:
+        return bank.rank(corner_crop[0], corner), None
+    ranking, peaks, maps = bank.rank_peaks(corner_crop[0], corner, PeakRecordCount, PeakRecordMapSize)
+    v0, u0 = int(corner_crop[1]), int(corner_crop[2])
+    record = {'window': [v0, u0, int(corner_crop[0].shape[0]), int(corner_crop[0].shape[1])],
+              'peaks': {template_name: [[round(float(maxVal), 4), int(maxLoc[0]) + u0, int(maxLoc[1]) + v0]
+                                        for maxVal, maxLoc in template_peaks]
+                        for template_name, template_peaks in peaks.items()},
+              'first': None, 'retry': None, 'circle': None}
+    if PeakRecordMapSize is not None:
+        record['maps'] = {template_name: res for template_name, res in maps.items() if res is not None}
+    return ranking, record
+
+def match_result(record):
+    """
+    :param record: FiducialRecord
+    :return: dic saved in the matching records (see rank_corner)
+    """
+    return {'template': record.template, 'xc': record.xc, 'yc': record.yc, 'u1': record.u1, 'v1': record.v1,
+            'maxVal': round(float(record.maxVal), 4)}
+
+def peak_records_path(Out_fiducialmarks_CSV):
+    return Out_fiducialmarks_CSV[:-4] + '_peaks.json'
 
+def load_peak_records(Out_fiducialmarks_CSV):
+    """
+    :return: dic {image name: {corner: record}} saved next to the csv (empty if none, see save_peak_records)
+    """
+    if not os.path.isfile(peak_records_path(Out_fiducialmarks_CSV)):
+        return {}
+    with open(peak_records_path(Out_fiducialmarks_CSV)) as f:
+        return json.load(f)
 
-def Main(image_folder, image_name, S, p, Fiducial_type, black_stripe_location,type_fidu,dataset, fiducial_template_folder, corner_folder, Out_fiducialmarks_CSV,center_fidu_tempate_CSV):
+def save_peak_records(records, Out_fiducialmarks_CSV, keep=None):
+    """
+    Save the matching records next to the csv ('_peaks.json'), and the correlation maps, if any, in the '_peaks'
+    folder (one '.npz' file per image, arrays named corner__template)
+
+    :param records: dic {image name: {corner: record}} of the images processed (see pop_peak_records)
+    :param keep: (optional) list of images whose saved records are kept (i.e., images not processed again, see
+                 Incremental)
+    :return: None
+    """
+    saved = load_peak_records(Out_fiducialmarks_CSV) if keep else {}
+    saved = {image: saved[image] for image in (keep or []) if image in saved}
+    maps_folder = Out_fiducialmarks_CSV[:-4] + '_peaks'
+    for image, image_records in records.items():
+        maps = {corner + '__' + template_name: res for corner, record in image_records.items()
+                for template_name, res in record.pop('maps', {}).items()}
+        if len(maps) > 0:
+            Path(maps_folder).mkdir(parents=True, exist_ok=True)
+            np.savez_compressed(maps_folder + '/' + os.path.splitext(image)[0] + '.npz', **maps)
+        saved[image] = image_records
+    with open(peak_records_path(Out_fiducialmarks_CSV), 'w') as f:
+        json.dump(saved, f)
+
+def Main(image_folder, image_name, S, p, Fiducial_type, black_stripe_location,type_fidu,dataset, fiducial_template_folder, corner_folder, Out_fiducialmarks_CSV,center_fidu_tempate_CSV, canvas=None, bank=None, windows=None):
+
+    img, canvas_size = open_detection_image(image_folder, image_name, canvas)
+
+    Coord, ToBeChecked = detect_fiducials(img, image_name, S, p, Fiducial_type, black_stripe_location, type_fidu, dataset,
+                                          fiducial_template_folder, corner_folder, center_fidu_tempate_CSV, canvas_size,
+                                          bank, windows)
+
+    # the results are returned to the main process, which writes them (see collect_detection), with the matching
+    # statistics (see GAPP_FiducialMatching), the figures (see GAPP_QAFigures) and the matching records of the image
+    return image_name, Coord, ToBeChecked, pop_pyramid_stats(), pop_figures(), pop_peak_records()
+
+def collect_detection(result, Out_fiducialmarks_CSV, corner_stats, renderer, detected=None, records=None):
+    """
+    Write the result of one image (see Main) to the csv file with the fiducial coordinates and to the to be checked
+    csv, update the statistics of the fiducial positions (see AdaptiveWindows) and send its figures to the renderer
+    (see GAPP_QAFigures). Only called by the main process (single writer), in the order of the image list, so that
+    parallel workers never write to the same file.
+
+    :param result: image name, Coord, ToBeChecked, matching statistics, figures, matching records (see Main)
+    :param detected: (optional) dic {image name: Coord}, updated with the result (see check_consistency)
+    :param records: (optional) dic {image name: {corner: record}}, updated with the result (see PeakRecords)
+    :return: matching statistics of the image
+    """
+    image_name, Coord, ToBeChecked, stats, figure_list, image_records = result
+    if detected is not None:
+        detected[image_name] = Coord
+    if records is not None:
+        records.update(image_records)
+    renderer.submit(figure_list)
+    if len(Coord) == 4:
+        addLine(image_name, Coord, Out_fiducialmarks_CSV) # Add to CSV file
+    write_to_be_checked(ToBeChecked, Out_fiducialmarks_CSV)
+
+    checked = {record.corner for record in ToBeChecked} # only the corners found with a good match
+    update_corner_stats(corner_stats, {corner: Coord[corner] for corner in Coord if corner not in checked})
+    return stats
+
+def detect_fiducials(img, image_name, S, p, Fiducial_type, black_stripe_location, type_fidu, dataset, fiducial_template_folder, corner_folder, center_fidu_tempate_CSV, canvas_size=None, bank=None, windows=None):
+    """
+    Detect the four fiducial marks of an image already loaded in memory (see as_detection_image), or opened for
+    windowed reading (see GAPP_ImageIO). canvas_size is the (width, height) of the virtual canvas when img is an
+    original scan (see select_fiducial_corners). bank is the TemplateBank of the run (see load_template_bank), or the
+    path of the bank shared with the workers (see GAPP_FiducialMatching, share_bank); loaded here if not given.
+    windows are the reduced search windows of the corners, if any (see adaptive_windows)
+
+    :return: Coord (dic with the [u, v] coordinates of each corner), ToBeChecked (list of FiducialRecord of the
+             uncertain corners)
+    """
 
     if Fiducial_type!='rectangle' and Fiducial_type!='target' and Fiducial_type!='cross' : 
         print('Code not yet built for this fiducial type' )
@@ -482,169 +876,54 @@ def Main(image_folder, image_name, S, p, Fiducial_type, black_stripe_location,ty
     # 1.0. #select the area of the image where the fiducials are located (i.e., the corners)
     # -------------------------------------------------------------------------------------
 
-    image_path = image_folder + '/' + image_name
-    img=cv2.imread(image_path)
-    F=select_fiducial_corners(img, S, p, Fiducial_type, black_stripe_location) # cropping image corner
+    if bank is None:
+        bank = load_template_bank(fiducial_template_folder, center_fidu_tempate_CSV)
+    bank = shared_bank(bank)
+
+    F=select_fiducial_corners(img, S, p, Fiducial_type, black_stripe_location, canvas_size, windows) # cropping image corner
     F_area=F.keys() 
     Coord={}
-    ToBeChecked = pd.DataFrame(columns=['image', 'corner', 'x', 'y', 'maxVal'])
-
-    fidu_coordinates = pd.DataFrame(columns=['image','corner', 'template', 'xc', 'yc', 'u1', 'v1', 'maxVal'])
+    ToBeChecked = [] # FiducialRecord of the uncertain corners
+    fidu_coordinates = [] # FiducialRecord of the fiducial found in each corner
+    records = {} # matching record of each corner (see PeakRecords)
     for corner in F_area:
         #-------------------------------------------------------------------------------------
-        # 1.1 Load fiducial template
+        # 1.1 Match all the fiducial templates of the corner at once (templates prepared once per run)
         #-------------------------------------------------------------------------------------
 
-        # create dic with fiducial template that match
-        template_list_all=[template for template in os.listdir(fiducial_template_folder) if template[-4:] in ['.tif'] ]
-        # template_list=[template for template in template_list if template[:len('Template_%s_%s' % (dataset, corner))] in 'Template_%s_%s' % (dataset, corner) ]
-        template_list=[template for template in template_list_all if corner in template ]
-
-        if len(template_list) == 0:
+        ranking, record = rank_corner(bank, F[corner], corner) # best template first
+        if len(ranking) == 0:
             print("Can't find any corresponding fiducial template")
-            # sys.exit()
-        else:
-            template_dic={}
-            for template_name in template_list:
-                template_img = cv2.imread(fiducial_template_folder + '/'+ template_name)
-                template_dic[template_name] = template_img
+            continue
+        if windows is not None and windows.get(corner) is not None and ranking[0][1] < MatchingValueThreshold:
+            # reduced window (see AdaptiveWindows) without a good match: back to the full window
+            F[corner] = select_fiducial_corners(img, S, p, Fiducial_type, black_stripe_location, canvas_size,
+                                                corners=[corner])[corner]
+            ranking, record = rank_corner(bank, F[corner], corner)
+        if record is not None:
+            records[corner] = record
+        template_dic = bank.template_images(corner)
+        template_list = [template_name for template_name, _, _ in ranking]
+        matches = {template_name: (maxVal, maxLoc) for template_name, maxVal, maxLoc in ranking}
 
         #-------------------------------------------------------------------------------------
         # 1.2. select a smaller area where the fiducial should be and match it with the found fiducial templates
         #-------------------------------------------------------------------------------------
-        center_fidu_tempate = open(center_fidu_tempate_CSV)
-        Lcenter= center_fidu_tempate.readlines()
-        best_template = pd.DataFrame(columns=['template', 'u1', 'v1', 'maxVal'])
+        best_template = [] # FiducialRecord of each template
 
-        if OneTemplateMax is True: # will only use the first matching template
-            template_list=[template_list[0]]
-
-        xc,yc=0,0
         for template_name in template_list:
-            for line in Lcenter:
-                 line=line.split(' ')
-                 if template_name.split('.')[0] == line[0]:
-                     xc, yc= (int(line[1]),int(line[2])) # coordinates of the center of the fiducial template (pointed by hand)
-                     # print(str(xc) + ' '+ str(yc))
-                     break
-
+            xc, yc = bank.centers.get(template_name, (0, 0)) # coordinates of the center of the fiducial template (pointed by hand)
 
             if xc !=0 and yc != 0: # i.e., it found a template
                 try :
                     if Fiducial_type=='target' :
                         orient='False'
-                        u,v, maxVal = CenterFiducial_LUCASKANADE(F[corner][0],Fiducial_type,orient,template_dic[template_name],xc,yc,image_name,corner,type_fidu, corner_folder)
+                        u,v, maxVal = CenterFiducial_LUCASKANADE(F[corner][0],Fiducial_type,orient,template_dic[template_name],xc,yc,image_name,corner,type_fidu, corner_folder, matches[template_name])
 
-                        u1=int(F[corner][2]+u)#colon
-                        v1=int(F[corner][1]+v)#line
+                        u1, v1 = corner_to_image(F[corner], u, v, type_fidu) #colon, line
                         # Coord[corner]=[u1,v1] #line,colon
 
-                        best_template = pd.concat([best_template, pd.DataFrame(
-                            [{'template': template_name, 'u1': u1, 'v1': v1, 'maxVal': maxVal}])], ignore_index=True)
-
-                        if template_name == template_list[-1]:
-                            best=best_template.iloc[best_template['maxVal'].idxmax()]
-
-
-                            if best['maxVal'] >= 0.85:
-                                Coord[corner] = [best['u1'], best['v1']]  # line,colon
-                                fidu_coordinates = pd.concat([fidu_coordinates, pd.DataFrame(
-                                    [{'image': image_name, 'corner': corner, 'template': template_name, 'xc': xc,
-                                      'yc': yc, 'u1': best['u1'], 'v1': best['v1'], 'maxVal': best['maxVal']}]
-                                )], ignore_index=True)
-
-
-                            elif best['maxVal'] < MatchingValueThreshold: # Value could be increased to be more constraining on the quality of the match
-                                # Another try with larger corner area?
-                                S2=S+400
-                                if p-0.02>=0:
-                                    p2=p-0.02
-                                else:
-                                    p2=0
-                                F2 = select_fiducial_corners(img, S2, p2, Fiducial_type,
-                                                    black_stripe_location)  # cropping image corner
-                                u, v, maxVal = CenterFiducial_LUCASKANADE(F2[corner][0], Fiducial_type, orient,
-                                                                          template_dic[template_name], xc, yc,
-                                                                          image_name, corner, type_fidu, corner_folder)
-
-                                u1 = int(F[corner][2] + u)  # colon
-                                v1 = int(F[corner][1] + v)  # line
-                                best_template = pd.concat([best_template, pd.DataFrame(
-                                    [{'template': template_name, 'u1': u1, 'v1': v1, 'maxVal': maxVal}]
-                                )], ignore_index=True)
-                                best = best_template.iloc[best_template['maxVal'].idxmax()]
-
-
-                                if best['maxVal'] >= MatchingValueThreshold:  # Value could be increased to be more constraining on the quality of the match
-                                    Coord[corner] = [best['u1'], best['v1']]
-                                    fidu_coordinates = pd.concat([fidu_coordinates, pd.DataFrame(
-                                        [{'image': image_name, 'corner': corner, 'template': template_name, 'xc': xc,
-                                          'yc': yc, 'u1': best['u1'], 'v1': best['v1'], 'maxVal': best['maxVal']}]
-                                    )], ignore_index=True)
-
-                                else:
-                                    ToBeChecked = pd.concat([ToBeChecked, pd.DataFrame(
-                                        {'image': [image_name], 'corner': [corner], 'x': [best['u1']],
-                                         'y': [best['v1']], 'maxVal': [best['maxVal']]}
-                                    )], ignore_index=True)
-
-                                    # Try with circle
-                                    corner_monoband=[item[0] for item in F[corner][0][0]]
-                                    detected_fiducial_circles = FindCircles(np.asarray(corner_monoband), DP=1, MinDist=500,
-                                                                            MinRadius=xc - 50,
-                                                                            MaxRadius=xc + 50,
-                                                                            parameter2=120)
-
-                                    # Create a fancy figure for the corner with problem
-                                    fig, axs = plt.subplots(1, 2, figsize=(6, 4))
-                                    fig.suptitle('to check: ' + image_name +'_'+corner, fontweight="bold")
-                                    axs[0].imshow(F[corner][0], cmap=plt.cm.gray)
-                                    axs[0].set_title('corner image')
-                                    # Add a rectangle with location of template
-                                    rect = patches.Rectangle((best['u1']-int(F[corner][2]-xc), best['v1']-int(F[corner][1])-yc), template_dic[template_name].shape[0], template_dic[template_name].shape[1],
-                                                             linewidth=2, edgecolor='r', facecolor='none')
-                                    # Add the patch to the Axes
-                                    axs[0].add_patch(rect)
-                                    axs[1].imshow(template_dic[template_name], cmap=plt.cm.gray)
-                                    axs[1].set_title('template')
-
-                                    if detected_fiducial_circles is not None:
-                                        Coord[corner] = [detected_fiducial_circles[0][0][0],detected_fiducial_circles[0][0][1]]
-                                        fidu_coordinates = pd.concat([fidu_coordinates, pd.DataFrame(
-                                            [{'image': image_name, 'corner': corner, 'template': template_name,
-                                              'xc': xc,
-                                              'yc': yc, 'u1': detected_fiducial_circles[0][0][0],
-                                              'v1': detected_fiducial_circles[0][0][1],
-                                              'maxVal': 0}]
-                                        )], ignore_index=True)
-                                        # add circle
-                                        circle = plt.Circle((detected_fiducial_circles[0][0][0], detected_circles[0][0][1]),
-                                                             (detected_circles[0][0][2]), fill=False, color='r')
-                                        axs[0].add_patch(circle)
-                                        axs[0].plot(detected_circles[0][0][0], detected_circles[0][0][1], 'r', marker=".",
-                                                    markersize=10)
-                                        axs[0].add_patch(circle)
-
-                                    else:
-                                        Coord[corner] = [best['u1'], best['v1']]
-                                        fidu_coordinates = pd.concat([fidu_coordinates, pd.DataFrame(
-                                            [{'image': image_name, 'corner': corner, 'template': template_name, 'xc': xc,
-                                             'yc': yc, 'u1': best['u1'], 'v1': best['v1'],
-                                             'maxVal': best['maxVal']}]
-                                        )], ignore_index=True)
-
-
-
-                                    # save figure
-                                    save_folder_path = corner_folder + '/_To_Be_Checked'
-                                    Path(save_folder_path).mkdir(parents=True, exist_ok=True)  # create folder if does no exist
-                                    plt.savefig(save_folder_path + '/_ToCheck_' + image_name +'_'+corner + '.png', dpi=DPI)
-
-                        if len(Coord) == 4 and template_name==template_list[-1] and corner == list(F.keys())[-1]:
-                            print("  >> " + image_name + ' > found for fiducial coordinates: ' + str(Coord) )
-                            addLine(image_name, Coord, Out_fiducialmarks_CSV) # Add to CSV file
-
-                            FiducialFig(F, fidu_coordinates, corner_folder) # save a figure
+                        best_template.append(FiducialRecord(image_name, corner, template_name, xc, yc, u1, v1, maxVal))
 
                 except (ValueError,IndexError) as e:
                     print(e)
@@ -653,33 +932,325 @@ def Main(image_folder, image_name, S, p, Fiducial_type, black_stripe_location,ty
 
             else:
                 print("! Could not find center coordinates for template | << check 'Center_Fiducial.csv' file >>")
-                print('Template_%s_%s_%s'%(Fiducial_type,dataset,temp) + " != " + line[0])
+                print(template_name)
 
-                ToBeChecked = pd.concat([ToBeChecked, pd.DataFrame(
-                    [{'image': image_name, 'corner': corner, 'x': 0, 'y': 0, 'maxVal': 0}]
-                )], ignore_index=True)
-
-                fidu_coordinates = pd.concat([fidu_coordinates, pd.DataFrame(
-                    [{'template': template_name, 'xc': 0, 'yc': 0, 'u': 0, 'v': 0}]
-                )], ignore_index=True)
+                ToBeChecked.append(FiducialRecord(image_name, corner, template_name, 0, 0, 0, 0, 0))
                 sys.exit(0)
 
+        if len(best_template) == 0:
+            continue
 
-    if not ToBeChecked.empty:
-        # write to file
-        if not os.path.isfile(Out_fiducialmarks_CSV[:-4] + '_TobeChecked.csv'):
-            ToBeChecked.to_csv(Out_fiducialmarks_CSV[:-4] + '_TobeChecked.csv', mode='w', header=['image', 'corner', 'x', 'y', 'maxVal']) # append to file
-        else:  # else it exists so append without writing the header
-            ToBeChecked.to_csv(Out_fiducialmarks_CSV[:-4] + '_TobeChecked.csv', mode='a', header=False) # append to file
+        #-------------------------------------------------------------------------------------
+        # 1.3. decision, once all the templates are matched: the fallbacks (larger window, circle) use the template
+        # of the best match and its centre
+        #-------------------------------------------------------------------------------------
+        best = max(best_template, key=lambda match: match.maxVal)
+        template_name, xc, yc = best.template, best.xc, best.yc
+        template = template_dic[template_name]
+        if record is not None:
+            record['first'] = match_result(best)
+
+        try :
+            if best.maxVal >= MatchingValueThreshold:
+                Coord[corner] = [best.u1, best.v1]  # line,colon
+                fidu_coordinates.append(best)
+
+            else: # Value could be increased to be more constraining on the quality of the match
+                # Another try with larger corner area?
+                S2=S+400
+                if p-0.02>=0:
+                    p2=p-0.02
+                else:
+                    p2=0
+                F2 = select_fiducial_corners(img, S2, p2, Fiducial_type,
+                                    black_stripe_location, canvas_size, corners=[corner])  # cropping image corner
+                # the template positions of the first crop are already matched: only the border band
+                # of the larger crop is matched (see match_template_band)
+                dv, du = F[corner][1] - F2[corner][1], F[corner][2] - F2[corner][2]
+                inner = (dv, du, dv + F[corner][0].shape[0] - template.shape[0] + 1,
+                         du + F[corner][0].shape[1] - template.shape[1] + 1)
+                band_match = match_template_band(*as_matching_images(F2[corner][0], template), inner,
+                                                 pyramid=PyramidMatching)
+
+                if band_match[0] > matches[template_name][0]: # otherwise, same as the first match
+                    u, v, maxVal = CenterFiducial_LUCASKANADE(F2[corner][0], Fiducial_type, 'False',
+                                                              template, xc, yc, image_name, corner,
+                                                              type_fidu, corner_folder, band_match)
+
+                    u1, v1 = corner_to_image(F2[corner], u, v, type_fidu)  # colon, line
+                    best_template.append(FiducialRecord(image_name, corner, template_name, xc, yc, u1, v1, maxVal))
+                    best = max(best_template, key=lambda match: match.maxVal)
+                if record is not None:
+                    record['retry'] = match_result(best)
+
+
+                if best.maxVal >= MatchingValueThreshold:  # Value could be increased to be more constraining on the quality of the match
+                    Coord[corner] = [best.u1, best.v1]
+                    fidu_coordinates.append(best)
+
+                else:
+                    ToBeChecked.append(best)
+
+                    # Try with circle
+                    # (one accumulator on the downsampled corner, bounded time, see GAPP_CircleDetection)
+                    detected_fiducial_circle = find_circle(F[corner][0], MinRadius=xc - 50,
+                                                           MaxRadius=xc + 50)
+                    if record is not None:
+                        record['circle'] = [] # not found
+
+                    # Prepare a figure for the corner with problem (see GAPP_QAFigures)
+                    # with a rectangle at the location of the template
+                    rectangles = [(best.u1 - int(F[corner][2]) - xc, best.v1 - int(F[corner][1]) - yc,
+                                   template.shape[1], template.shape[0])]
+                    points, circles = [], []
+
+                    if detected_fiducial_circle is not None:
+                        circle_u, circle_v, circle_r = detected_fiducial_circle # in the corner image
+                        u1 = int(F[corner][2] + circle_u)  # colon
+                        v1 = int(F[corner][1] + circle_v)  # line
+                        Coord[corner] = [u1, v1]
+                        fidu_coordinates.append(FiducialRecord(image_name, corner, template_name, xc, yc,
+                                                               u1, v1, 0))
+                        if record is not None:
+                            record['circle'] = [u1, v1]
+                        # add circle
+                        circles.append((circle_u, circle_v, circle_r))
+                        points.append((circle_u, circle_v))
+
+                    else:
+                        Coord[corner] = [best.u1, best.v1]
+                        fidu_coordinates.append(best)
+
+
+
+                    if wanted(image_name, 'check'):
+                        add_figure(corner_folder + '/_To_Be_Checked/_ToCheck_' + image_name + '_' + corner + '.png',
+                                   [make_panel(F[corner][0], 3 * DPI, 'corner image', rectangles, points, circles),
+                                    make_panel(template, 3 * DPI, 'template')],
+                                   columns=2, title='to check: ' + image_name + '_' + corner)
+
+        except (ValueError,IndexError) as e:
+            print(e)
+            print ('cannot find fidu ' , image_name,'   ',corner)
+
+    if len(Coord) == 4:
+        print("  >> " + image_name + ' > found for fiducial coordinates: ' + str(Coord) )
+
+        FiducialFig(F, fidu_coordinates, corner_folder) # save a figure
+
+    if PeakRecords is True:
+        peak_records[image_name] = records
+
+    return Coord, ToBeChecked
+
+def research_corner(image_folder, image_name, corner, u, v, S, p, Fiducial_type, black_stripe_location, type_fidu,
+                    corner_folder, canvas=None, bank=None):
+    """
+    Search the fiducial of a corner again, in a window of ConsistencySearchRadius around its predicted position (see
+    check_consistency)
+
+    :param u, v: predicted position of the fiducial in the image
+    :return: FiducialRecord of the best template, or None if not found
+    """
+    img, canvas_size = open_detection_image(image_folder, image_name, canvas)
+    bank = shared_bank(bank)
+    templates = bank.template_images(corner)
+    template_size = max([max(template.shape[:2]) for template in templates.values()] + [0])
+    size = int(2 * (template_size + ConsistencySearchRadius))
+    window = [max(0, int(v - size / 2)), max(0, int(u - size / 2)), size]
+    F = select_fiducial_corners(img, S, p, Fiducial_type, black_stripe_location, canvas_size, {corner: window}, [corner])
+    ranking = bank.rank(F[corner][0], corner)
+    if len(ranking) == 0:
+        return None
+    template_name, maxVal, maxLoc = ranking[0]
+    xc, yc = bank.centers.get(template_name, (0, 0))
+    u, v, maxVal = CenterFiducial_LUCASKANADE(F[corner][0], Fiducial_type, 'False', templates[template_name], xc, yc,
+                                              image_name, corner, type_fidu, corner_folder, (maxVal, maxLoc))
+    u1, v1 = corner_to_image(F[corner], u, v, type_fidu)
+    return FiducialRecord(image_name, corner, template_name, xc, yc, u1, v1, maxVal)
+
+def check_consistency(detected, rows, image_folder, S, p, Fiducial_type, black_stripe_location, type_fidu,
+                      corner_folder, Out_fiducialmarks_CSV, canvas_manifest, bank, records=None):
+    """
+    Compare the fiducial quadrilaterals of all the images of the dataset (see GAPP_FiducialConsistency) and search the
+    outlier (or missing) corners of the images just processed again, around their predicted position. The corners
+    found again close to their predicted position replace the detected ones (and their earlier rows of the to be
+    checked csv are removed), the others are added to the to be checked csv.
+
+    :param detected: dic {image name: Coord} of the images just processed, updated in place
+    :param rows: dic {image name (without extension): csv line} of the other images of the dataset (see readCSV)
+    :param records: (optional) matching records of the images just processed (see PeakRecords): the result of the
+                    check is added to the records of the corners concerned ('consistency')
+    :return: list of the images whose coordinates changed
+    """
+    def annotate(image, corner, u1, v1, maxVal, replaced):
+        if records is not None and image in records:
+            records[image].setdefault(corner, {})['consistency'] = {'u1': u1, 'v1': v1,
+                                                                    'maxVal': round(float(maxVal), 4),
+                                                                    'replaced': replaced}
+
+    images = sorted(detected)
+    names = {os.path.splitext(image)[0] for image in images}
+    others = [line.split(';') for name, line in rows.items() if name not in names]
+    quads = [[detected[image].get(corner, [np.nan, np.nan]) for corner in corner_names] for image in images] + \
+            [[[float(line[1 + 2 * i]), float(line[2 + 2 * i])] for i in range(4)] for line in others]
+    if len(quads) == 0:
+        return []
+    corners, predicted, inconsistent, tolerance = consistency_outliers(np.array(quads, dtype=np.float64))
+    if tolerance is None: # no reference quadrilateral (see GAPP_FiducialConsistency)
+        print("\n-------------------------------------------------------------------------\n"
+              "geometric consistency check skipped: no image with four fiducials")
+        return []
+    print("\n-------------------------------------------------------------------------\n"
+          "geometric consistency check of " + str(len(quads)) + " images (tolerance: " + str(round(tolerance, 1)) +
+          " pixels)")
+
+    changed = []
+    corrected = [] # (image, corner) replaced
+    ToBeChecked = []
+    for i, image in enumerate(images):
+        Coord = detected[image]
+        if inconsistent[i]:
+            print('  ! ' + image + ': less than three fiducials agree with the dataset (to check)')
+            ToBeChecked += [FiducialRecord(image, corner, '', 0, 0, Coord[corner][0], Coord[corner][1], 0)
+                            for corner in corner_names]
+            for corner in corner_names:
+                annotate(image, corner, Coord[corner][0], Coord[corner][1], 0, False)
+        if corners[i] < 0:
+            continue
+        corner = corner_names[corners[i]]
+        u, v = predicted[i, corners[i]]
+        record = None
+        try:
+            record = research_corner(image_folder, image, corner, u, v, S, p, Fiducial_type, black_stripe_location,
+                                     type_fidu, corner_folder, canvas_manifest.get(image), bank)
+        except (ValueError, IndexError) as e:
+            print(e)
+        if record is not None and np.hypot(record.u1 - u, record.v1 - v) <= tolerance:
+            print('  > ' + image + ' ' + corner + ': ' + str(Coord.get(corner, 'not found')) + ' -> ' +
+                  str([record.u1, record.v1]) + ' (maxVal: ' + str(round(record.maxVal, 3)) + ')')
+            Coord[corner] = [record.u1, record.v1]
+            changed.append(image)
+            corrected.append((image, corner))
+            annotate(image, corner, record.u1, record.v1, record.maxVal, True)
+        else:
+            print('  ! ' + image + ' ' + corner + ': does not fit the other fiducials and not found around its '
+                  'predicted position (to check)')
+            u1, v1 = Coord.get(corner, [int(u), int(v)])
+            ToBeChecked.append(FiducialRecord(image, corner, '', 0, 0, u1, v1, 0 if record is None else record.maxVal))
+            annotate(image, corner, u1, v1, ToBeChecked[-1].maxVal, False)
+    drop_to_be_checked(corrected, Out_fiducialmarks_CSV)
+    write_to_be_checked(ToBeChecked, Out_fiducialmarks_CSV)
+    print('  > ' + str(len(changed)) + ' corner(s) corrected, ' + str(len(ToBeChecked)) + ' corner(s) to check')
+    return changed
+
+def decide_corner(image_name, corner, record, threshold):
+    """
+    Apply the rules of detect_fiducials to the matching record of a corner (see PeakRecords), with another threshold:
+    the centre found in the first window is kept if its maxVal is above the threshold, otherwise the best of the first
+    and of the larger window ('retry'), and if still below, the circle (or the best match) is kept and the corner is
+    to be checked. The result of the geometric consistency check, if any, is applied last. The fallbacks are only
+    recorded if they were run during the detection (i.e., below the threshold of the detection).
+
+    :param record: matching record of the corner (see rank_corner)
+    :return: [u, v] coordinates (None if not found), list of FiducialRecord to check, False if a fallback needed
+             with this threshold was not run during the detection
+    """
+    coordinates = None
+    ToBeChecked = []
+    complete = True
+    best = record.get('first')
+    if best is not None and best['maxVal'] < threshold:
+        retry = record.get('retry')
+        if retry is not None and retry['maxVal'] > best['maxVal']:
+            best = retry
+        complete = retry is not None and (best['maxVal'] >= threshold or record.get('circle') is not None)
+    if best is not None:
+        coordinates = [best['u1'], best['v1']]
+        if best['maxVal'] < threshold:
+            ToBeChecked.append(FiducialRecord(image_name, corner, best['template'], best['xc'], best['yc'],
+                                              best['u1'], best['v1'], best['maxVal']))
+            if record.get('circle'):
+                coordinates = record['circle']
+
+    consistency = record.get('consistency')
+    if consistency is not None:
+        if consistency['replaced'] is True: # corrected: no longer to check
+            coordinates = [consistency['u1'], consistency['v1']]
+            ToBeChecked = []
+        else:
+            ToBeChecked.append(FiducialRecord(image_name, corner, '', 0, 0, consistency['u1'], consistency['v1'],
+                                              consistency['maxVal']))
+    return coordinates, ToBeChecked, complete
+
+def redecide(Out_fiducialmarks_CSV, threshold):
+    """
+    Write the csv with the fiducial coordinates (and the to be checked csv) again from the matching records saved
+    by a previous run (see PeakRecords), with another threshold, without matching the templates again (see
+    decide_corner). The lines of the images without records are kept.
+
+    :param threshold: value to define a good match (see MatchingValueThreshold)
+    :return: None
+    """
+    records = load_peak_records(Out_fiducialmarks_CSV)
+    if len(records) == 0:
+        print('! no matching records found (' + peak_records_path(Out_fiducialmarks_CSV) + '): run the detection '
+              'with PeakRecords = True first')
+        return
+    print("\n-------------------------------------------------------------------------\n"
+          "decision applied again to the matching records of " + str(len(records)) + " images (threshold: " +
+          str(threshold) + ")")
+
+    rows = readCSV(Out_fiducialmarks_CSV)
+    names = {os.path.splitext(image)[0]: image for image in records}
+    ToBeChecked = []
+    incomplete = []
+    for image in sorted(records):
+        Coord = {}
+        for corner in corner_names:
+            if corner not in records[image]:
+                continue
+            coordinates, corner_checks, complete = decide_corner(image, corner, records[image][corner], threshold)
+            if coordinates is not None:
+                Coord[corner] = coordinates
+            ToBeChecked += corner_checks
+            if complete is False:
+                incomplete.append(image + ' ' + corner)
+        rows.pop(os.path.splitext(image)[0], None)
+        if len(Coord) == 4:
+            rows[os.path.splitext(image)[0]] = toCSV(image, Coord)
+
+    createCSV(Out_fiducialmarks_CSV)
+    f = open(Out_fiducialmarks_CSV, "a",newline='')
+    w = csv.writer(f,delimiter=",")
+    for name in sorted(rows):
+        w.writerow([rows[name]])
+    f.close()
+
+    # to be checked csv: the corners of the images without records are kept
+    ToBeChecked_CSV = Out_fiducialmarks_CSV[:-4] + '_TobeChecked.csv'
+    if os.path.isfile(ToBeChecked_CSV):
+        kept = pd.read_csv(ToBeChecked_CSV, index_col=0)
+        kept = kept[~kept['image'].isin(list(records) + list(names))]
+        os.remove(ToBeChecked_CSV)
+        if not kept.empty:
+            kept.to_csv(ToBeChecked_CSV, mode='w')
+    write_to_be_checked(ToBeChecked, Out_fiducialmarks_CSV)
+
+    print('  > ' + str(len(rows)) + ' images with four fiducials, ' + str(len(ToBeChecked)) + ' corner(s) to check')
+    if len(incomplete) > 0:
+        print('  ! ' + str(len(incomplete)) + ' corner(s) below the threshold were not searched with the fallbacks '
+              '(larger window, circle) during the detection (best match kept, to check). Run the detection again '
+              'for: ' + str(incomplete))
 
 def parameters_02(input_image_folder, fiducial_template_folder, dataset): #defaulting parameters for running in tkinter
 
     center_fidu_tempate_CSV = fiducial_template_folder + "/Center_Fiducials.txt"  # text file where the centre of the template is indicated
     corner_folder = os.path.dirname(input_image_folder) + '/' + '_temp_fiducials'  # folder where temporary fiducials of the images will be saved
-    type_fidu = "barycentre"  # parameter for ShiTomasi corner detection. 'fixed' or 'barycentre'
+    type_fidu = "barycentre"  # parameter for ShiTomasi corner detection. 'fixed', 'barycentre' or 'subpixel'
     Out_fiducialmarks_CSV = input_image_folder + '/' + '_fiducial_marks_coordinates_' + dataset + '.csv'
 
-    RunParallel = False  # to run using parallel processing (otherwise will process one image after the other
+    RunParallel = True  # to run using parallel processing (otherwise will process one image after the other
     DebugMode = False  # will provide more info about subprocess to the console for checking
     OneTemplateMax = True  # if True it will only use the first matching template. If False it will take more time...
     S = 2500  # size of the sub-image around the fiducial for template matching (square of S pixels in size)
@@ -691,12 +1262,12 @@ def parameters_02(input_image_folder, fiducial_template_folder, dataset): #defau
     # (Choose the number of CPU cores you want to use)
     # (minimum = 1; suggested value = (number of cores) - 1)
     # (if you don't know how many cores you have, write: 'multiprocessing.cpu_count()')
-    num_cores = multiprocessing.cpu_count() - 1
+    num_cores = max(1, multiprocessing.cpu_count() - 1) # at least one job (single core computers)
 
     return center_fidu_tempate_CSV, corner_folder, type_fidu, Out_fiducialmarks_CSV, RunParallel, DebugMode, OneTemplateMax, S, \
            MatchingValueThreshold, DPI, Fiducial_type, num_cores
 
-def main_script_02(image_folder, fiducial_template_folder, dataset, p, black_stripe_location):
+def main_script_02(image_folder, fiducial_template_folder, dataset, p, black_stripe_location, Incremental=False):
 
     print(' ')
     print('=====================================================================')
@@ -716,41 +1287,111 @@ def main_script_02(image_folder, fiducial_template_folder, dataset, p, black_str
               "\nOut_fiducialmarks_CSV: "+ Out_fiducialmarks_CSV +
               "\ncenter_fidu_tempate_CSV: " + center_fidu_tempate_CSV  )
 
-    ##### PARALLEL PROCESSING #####
+    if Redecide is True: # no matching: the threshold is applied again to the saved records (see PeakRecords)
+        redecide(Out_fiducialmarks_CSV, MatchingValueThreshold)
+        return
 
-    lines =[["name;X1;Y1;X2;Y2;X3;Y3;X4;Y4"]]
-    f = open(Out_fiducialmarks_CSV, "w",newline='')
-    w = csv.writer(f,delimiter=",")
-    w.writerows(lines)
-    f.close()
+    ##### PARALLEL PROCESSING #####
 
     # List image files
-    allfiles=os.listdir(image_folder)
-    imlist=[filename for filename in allfiles if filename[-4:] in [".tif",".TIF",".jpg",".JPG"]]
-    imlist = imlist + [filename for filename in allfiles if filename[-5:] in [".tiff",".TIFF"]]
+    canvas_manifest = read_canvas_manifest(image_folder)
+    if canvas_manifest is not None: # virtual canvas: the original scans are listed in the manifest
+        imlist = list(canvas_manifest.keys())
+    else:
+        canvas_manifest = {}
+        allfiles=os.listdir(image_folder)
+        imlist=[filename for filename in allfiles if filename[-4:] in [".tif",".TIF",".jpg",".JPG"]]
+        imlist = imlist + [filename for filename in allfiles if filename[-5:] in [".tiff",".TIFF"]]
+    imlist = sorted(imlist) # the results are written in this order
+
+    # Skip the images already processed with the same input, parameters and templates (their csv lines are kept)
+    params_fp = params_fingerprint({'p': p, 'black_stripe_location': black_stripe_location, 'S': S,
+                                    'type_fidu': type_fidu, 'Fiducial_type': Fiducial_type,
+                                    'OneTemplateMax': OneTemplateMax, 'MatchingValueThreshold': MatchingValueThreshold,
+                                    'NativeDepth': NativeDepth, 'PyramidMatching': PyramidMatching,
+                                    'AdaptiveWindows': AdaptiveWindows, 'ConsistencyCheck': ConsistencyCheck,
+                                    'PeakRecords': PeakRecords,
+                                    'templates': folder_fingerprint(fiducial_template_folder, ['.tif', '.txt'])})
+    ledger = load_ledger(image_folder, '02') if Incremental is True else {}
+    rows = readCSV(Out_fiducialmarks_CSV) if Incremental is True else {}
+    input_fp = {image: file_fingerprint(canvas_manifest[image]['path'] if image in canvas_manifest
+                                        else image_folder + '/' + image) for image in imlist}
+    imlist_done = [image for image in imlist if is_up_to_date(ledger, image, input_fp[image], params_fp,
+                                                              os.path.splitext(image)[0] in rows)]
+    keepCSVLines(Out_fiducialmarks_CSV, rows, imlist_done)
+    imlist = [image for image in imlist if image not in imlist_done]
 
     print('\n-------------------------------'
           '\n-------------------------------\n'
           ' > found ' + str(len(imlist)) + ' images to process'
+          + (' (' + str(len(imlist_done)) + ' already up to date)' if Incremental is True else '') +
           '\n-------------------------------'
           '\n-------------------------------\n')
 
-    # Main
+    # templates and centres loaded (and checked) once for all the images
+    bank = load_template_bank(fiducial_template_folder, center_fidu_tempate_CSV)
+
+    # statistics of the fiducial positions, for the adaptive search windows (starting with the images kept in the csv)
+    corner_stats = {}
+    for image in imlist_done:
+        line = rows[os.path.splitext(image)[0]].split(';')
+        update_corner_stats(corner_stats, {corner: [float(line[1 + 2 * i]), float(line[2 + 2 * i])]
+                                           for i, corner in enumerate(corner_names)})
+
+    # Main (the workers return their results, written here as they come, in the order of imlist)
+    matching_stats = []
+    detected = {} # fiducial coordinates of the images processed (see check_consistency)
+    records = {} # matching records of the images processed (see PeakRecords)
+    renderer = FigureRenderer() # QA figures drawn out of the detection (see GAPP_QAFigures)
     if RunParallel is True:
-        Parallel(n_jobs=num_cores, verbose=30)(delayed(Main)(image_folder, image,S,p,Fiducial_type,black_stripe_location,
-                                                             type_fidu,dataset,fiducial_template_folder, corner_folder,
-                                                             Out_fiducialmarks_CSV, center_fidu_tempate_CSV) for image in imlist)
+        bank_file = share_bank(bank) # loaded only once by each worker
+        # with adaptive windows, the images are processed by chunks and the windows updated between them
+        chunk_size = num_cores * 4 if AdaptiveWindows is True else max(1, len(imlist))
+        with Parallel(n_jobs=num_cores, verbose=30, return_as="generator") as parallel:
+            for start in range(0, len(imlist), chunk_size):
+                windows = adaptive_windows(corner_stats, bank, S) if AdaptiveWindows is True else None
+                for result in parallel(delayed(Main)(image_folder, image,S,p,Fiducial_type,black_stripe_location,
+                                                     type_fidu,dataset,fiducial_template_folder, corner_folder,
+                                                     Out_fiducialmarks_CSV, center_fidu_tempate_CSV,
+                                                     canvas_manifest.get(image), bank_file, windows)
+                                       for image in imlist[start:start + chunk_size]):
+                    matching_stats.append(collect_detection(result, Out_fiducialmarks_CSV, corner_stats, renderer,
+                                                            detected, records))
+        os.remove(bank_file)
         sleep(3)
 
     else:
         count=1
         for image in imlist:
             print('\n >>> Image [' + str(count) + '/' + str(len(imlist)) + ']: ' + image)
-            Main(image_folder, image,S,p,Fiducial_type,black_stripe_location,type_fidu,dataset,fiducial_template_folder,
-                 corner_folder,Out_fiducialmarks_CSV, center_fidu_tempate_CSV)
+            windows = adaptive_windows(corner_stats, bank, S) if AdaptiveWindows is True else None
+            result = Main(image_folder, image,S,p,Fiducial_type,black_stripe_location,type_fidu,dataset,fiducial_template_folder,
+                 corner_folder,Out_fiducialmarks_CSV, center_fidu_tempate_CSV, canvas_manifest.get(image), bank, windows)
+            matching_stats.append(collect_detection(result, Out_fiducialmarks_CSV, corner_stats, renderer, detected,
+                                                    records))
             count=count +1
 
-
+    # dataset-wide check of the fiducial quadrilaterals: the outlier corners are searched again
+    if ConsistencyCheck is True and len(detected) > 0:
+        rows = readCSV(Out_fiducialmarks_CSV)
+        changed = check_consistency(detected, rows, image_folder, S, p, Fiducial_type, black_stripe_location, type_fidu,
+                                    corner_folder, Out_fiducialmarks_CSV, canvas_manifest, bank, records)
+        renderer.submit(pop_figures())
+        if len(changed) > 0: # csv written again, with the corrected coordinates
+            for image in changed:
+                if len(detected[image]) == 4:
+                    rows[os.path.splitext(image)[0]] = toCSV(image, detected[image])
+            writeCSVLines(Out_fiducialmarks_CSV, rows, [image for image in sorted(imlist_done + imlist)
+                                                        if os.path.splitext(image)[0] in rows])
+    renderer.close()
+    if PeakRecords is True:
+        save_peak_records(records, Out_fiducialmarks_CSV, imlist_done)
+
+    for image in imlist:
+        update_ledger(ledger, image, input_fp[image], params_fp)
+    save_ledger(ledger, image_folder, '02')
+
+    report_pyramid_stats(matching_stats)
 
     # print list of image corners to check (uncertainties in the template matching)
     if os.path.isfile(Out_fiducialmarks_CSV[:-4] + '_TobeChecked.csv'):
@@ -766,6 +1407,6 @@ def main_script_02(image_folder, fiducial_template_folder, dataset, p, black_str
 
 
 if __name__ == "__main__":
-    main_script_02(image_folder, fiducial_template_folder, dataset, p, black_stripe_location)
+    main_script_02(image_folder, fiducial_template_folder, dataset, p, black_stripe_location, Incremental)
 
 ##### END PROCESSING #####
@@ -67,12 +67,20 @@ Log:
 """
 
 import numpy as np
-import os, pandas as pd
+import os, sys
 import cv2
 from joblib import Parallel, delayed
 import multiprocessing
 from time import sleep
 from pathlib import Path
+from GAPP_Script_01_AirPhoto_CanvasSizing_v201 import read_canvas_manifest
+from GAPP_Scheduler_v101 import image_headers, peak_memory, schedule
+from GAPP_ImageIO_v101 import open_windowed, TiledTiffWriter
+from GAPP_TiledWarp_v101 import warp_perspective_tiled
+from GAPP_Script_04_AirPhotos_Resize_v201 import enhance_image, downscaled_name
+from GAPP_FiducialStore_v101 import FiducialStore
+from GAPP_RunLedger_v101 import file_fingerprint, params_fingerprint, load_ledger, save_ledger, is_up_to_date, \
+    update_ledger
 
 # ----------------------------------------------------------------------------
 ################################    SETUP     ################################
@@ -111,10 +119,122 @@ dimY = 13395
 
 num_cores = multiprocessing.cpu_count() - 1
 
+#### INCREMENTAL RUN #####
+# If True, only the images that are new, modified, or whose fiducial coordinates or camera changed since the last run
+# are processed (see GAPP_RunLedger)
+Incremental = True
+
+#### TILED REPROJECTION #####
+# If True, the reprojected images are computed by tiles on several threads (see GAPP_TiledWarp) and written tile by
+# tile (uncompressed tiled TIFF), the scans being read by windows when possible (see GAPP_ImageIO): the memory needed
+# no longer depends on the image size, and the cores not used by parallel jobs (see GAPP_Scheduler) reproject the
+# tiles of the same image. The output is an uncompressed tiled TIFF (instead of the compressed TIFF of cv2.imwrite),
+# and its pixels are not bit-identical to the ones of cv2.warpPerspective (interpolation rounding, see GAPP_TiledWarp),
+# nor to the ones of the fused chain (see GAPP_FusedPipeline)
+TiledReprojection = False
+
 # ----------------------------------------------------------------------------
 ################################ END OF SETUP ###############################
 # ----------------------------------------------------------------------------
-def main_script_03(input_image_folder, output_image_folder, fiducialmarks_file, camera):
+def camera_fiducial_points(camera):
+        """
+        New coordinates of the fiducial marks in the standardized image, for a given camera system
+
+        :param camera: camera system (e.g., 'Wild RC5a')
+        :return: pts2 (4x2 float32 array)
+        """
+        if camera == 'Wild RC5a':
+                ##### NEW COORDINATES OF FIDUCIAL MARKS #####
+                # (1 = upper left; 2 = upper right; 3 = lower right; 4 = lower left)
+                # (If the fiducial marks are at the medians: 1 = up; 2 = right; 3 = down ; 4 = left)
+                pts2 = np.float32([[673, 673], [12723, 673], [12723, 12723], [673, 12723]])
+
+        # Could here add calculations for other camera systems
+        # elif camera == 'Fairchild K17B':
+                ##### NEW COORDINATES OF FIDUCIAL MARKS #####
+                # (1 = upper left; 2 = upper right; 3 = lower right; 4 = lower left)
+                # (If the fiducial marks are at the medians: 1 = up; 2 = right; 3 = down ; 4 = left)
+                # pts2 = np.float32([[673, 673], [12723, 673], [12723, 12723], [673, 12723]]) !!!! to be calculated!!!
+        else:
+                print('Camera system not yet implemented: ' + camera)
+                sys.exit()
+
+        return pts2
+
+def resampling_homography(M, dimX, dimY, scale_percent=100):
+        """
+        Homography of the reprojection, with the downscaling to scale_percent (see SCRIPT 04) folded in, so that the
+        image is resampled only once
+
+        :param M: homography of the reprojection (fiducial coordinates -> standard coordinates, see GAPP_FiducialStore)
+        :return: M (3x3), output size (width, height), sigma of the Gaussian prefilter (in source pixels, 0 if the
+                 image is not downscaled), interpolation
+        """
+        if scale_percent == 100:
+                return M, (dimX, dimY), 0, cv2.INTER_LINEAR
+        scale = scale_percent / 100
+        # same output size and pixel grid as cv2.resize in SCRIPT 04
+        scaling = np.float64([[scale, 0, 0.5 * scale - 0.5], [0, scale, 0.5 * scale - 0.5], [0, 0, 1]])
+        size = (int(dimX * scale), int(dimY * scale))
+        # anti-aliasing before the decimation (same sigma as skimage.transform.resize)
+        sigma = max(0.0, (1 / scale - 1) / 2)
+        return scaling @ M, size, sigma, cv2.INTER_CUBIC
+
+def reproject_image(img, pts1, pts2, dimX, dimY, scale_percent=100):
+        """
+        Reproject the image by applying the new coordinates of the fiducial marks and crop it at the provided dimensions
+        (and downscale it to scale_percent, see resampling_homography)
+        """
+        M = cv2.getPerspectiveTransform(pts1,pts2)
+        return warp_image(img, M, dimX, dimY, scale_percent)
+
+def warp_image(img, M, dimX, dimY, scale_percent=100):
+        """
+        Same as reproject_image, with the homography of the image already computed (see GAPP_FiducialStore)
+        """
+        M, size, sigma, interpolation = resampling_homography(M, dimX, dimY, scale_percent)
+        if sigma > 0:
+                img = cv2.GaussianBlur(img, (0, 0), sigma)
+        imready = cv2.warpPerspective(img,M,size,flags=interpolation)
+        return imready
+
+def reproject_image_tiled(image_path, M, dimX, dimY, output_path=None, threads=1, scale_percent=100):
+        """
+        Same as warp_image (up to the interpolation rounding, see GAPP_TiledWarp), but computed by tiles on several
+        threads and written tile by tile to output_path (uncompressed tiled TIFF, see GAPP_TiledWarp), the image being
+        read by windows when possible (see GAPP_ImageIO)
+
+        :return: reprojected image, if output_path is None (otherwise None)
+        """
+        img = open_windowed(image_path)
+        M, size, sigma, interpolation = resampling_homography(M, dimX, dimY, scale_percent)
+        if output_path is None:
+                return warp_perspective_tiled(img, M, size, threads=threads, flags=interpolation, sigma=sigma)
+        samples = img.shape[2] if len(img.shape) == 3 else 1
+        with TiledTiffWriter(output_path, size[0], size[1], img.dtype, samples) as writer:
+                warp_perspective_tiled(img, M, size, writer=writer, threads=threads, flags=interpolation, sigma=sigma)
+
+def standardized_name(image):
+        """
+        Name of the reprojected image (complemented with "_standardized")
+        """
+        return str(image.split('.')[0]) + '_standardized.tif'
+
+def output_name(image, scale_percent=100):
+        """
+        Name of the output image: reprojected, or reprojected and downscaled (same name as after SCRIPT 04)
+        """
+        if scale_percent == 100:
+                return standardized_name(image)
+        return downscaled_name(standardized_name(image))
+
+def main_script_03(input_image_folder, output_image_folder, fiducialmarks_file, camera, Incremental=False,
+                   scale_percent=100, HistoCal=False, SharpeningIntensity=0):
+        """
+        With scale_percent != 100, the images are reprojected and downscaled in one step (the scale is folded into the
+        homography, see resampling_homography), then sharpened and equalized as in SCRIPT 04: output_image_folder then
+        receives the images of SCRIPT 04, and the full resolution reprojected images are not written.
+        """
 
         print(' ')
         print('=====================================================================')
@@ -125,11 +245,16 @@ def main_script_03(input_image_folder, output_image_folder, fiducialmarks_file,
 
         ##### DEFINE ADDITIONAL USEFUL VARIABLES #####
 
-        allfiles=os.listdir(input_image_folder)
-        images_list=[filename for filename in allfiles if filename[-4:] in [".tif",".TIF"]] #,".jpg",".JPG"
-        images_list = images_list + [filename for filename in allfiles if filename[-5:] in [".tiff",".TIFF"]]
+        canvas_manifest = read_canvas_manifest(input_image_folder)
+        if canvas_manifest is not None: # virtual canvas: the original scans are listed in the manifest (see SCRIPT 01)
+                images_list = list(canvas_manifest.keys())
+        else:
+                canvas_manifest = {}
+                allfiles=os.listdir(input_image_folder)
+                images_list=[filename for filename in allfiles if filename[-4:] in [".tif",".TIF"]] #,".jpg",".JPG"
+                images_list = images_list + [filename for filename in allfiles if filename[-5:] in [".tiff",".TIFF"]]
 
-        FM = pd.read_csv(fiducialmarks_file,sep=CSV_Separator, header=[0])
+        FM = FiducialStore(fiducialmarks_file, CSV_Separator) # indexed by image name (see GAPP_FiducialStore)
         number_images = str(len(FM))
 
         ##### DISPLAY THE NUMBER OF IMAGES TO PROCESS #####
@@ -137,54 +262,95 @@ def main_script_03(input_image_folder, output_image_folder, fiducialmarks_file,
         print('Number of tasks (images to process): ' + number_images)
         print(' ')
 
-        if camera == 'Wild RC5a':
-                ##### NEW COORDINATES OF FIDUCIAL MARKS #####
-                # (1 = upper left; 2 = upper right; 3 = lower right; 4 = lower left)
-                # (If the fiducial marks are at the medians: 1 = up; 2 = right; 3 = down ; 4 = left)
-                pts2 = np.float32([[673, 673], [12723, 673], [12723, 12723], [673, 12723]])
-
-        # Could here add calculations for other camera systems
-        # elif camera == 'Fairchild K17B':
-                ##### NEW COORDINATES OF FIDUCIAL MARKS #####
-                # (1 = upper left; 2 = upper right; 3 = lower right; 4 = lower left)
-                # (If the fiducial marks are at the medians: 1 = up; 2 = right; 3 = down ; 4 = left)
-                # pts2 = np.float32([[673, 673], [12723, 673], [12723, 12723], [673, 12723]]) !!!! to be calculated!!!
-
+        pts2 = camera_fiducial_points(camera)
+
+        def input_path(image):
+                # With a virtual canvas, the original scan is read: the padding only adds black pixels at the bottom
+                # and right of the image, which is what warpPerspective assumes outside of the image (BORDER_CONSTANT)
+                if image in canvas_manifest:
+                        return canvas_manifest[image]['path']
+                return os.path.join(input_image_folder, image ) #os.path.splitext(os.path.basename(image))[0] + '.tif')
+
+        ##### SKIP THE IMAGES ALREADY REPROJECTED WITH THE SAME INPUT AND PARAMETERS #####
+
+        ledger = load_ledger(output_image_folder, '03') if Incremental is True else {}
+        fingerprints = {}
+        for image in images_list:
+                pts1 = FM.points(image).tolist() if image in FM else None
+                params = {'camera': camera, 'dimX': dimX, 'dimY': dimY, 'pts1': pts1}
+                if scale_percent != 100:
+                        params.update({'scale_percent': scale_percent, 'HistoCal': HistoCal,
+                                       'SharpeningIntensity': SharpeningIntensity})
+                fingerprints[image] = (file_fingerprint(input_path(image)), params_fingerprint(params))
+        images_todo = [image for image in images_list if not is_up_to_date(
+                ledger, output_name(image, scale_percent), fingerprints[image][0], fingerprints[image][1],
+                os.path.isfile(os.path.join(output_image_folder, output_name(image, scale_percent))))]
+        if Incremental is True:
+                print('Number of images already up to date (skipped): ' + str(len(images_list) - len(images_todo)))
+                print(' ')
+
+        # homographies of all the images, computed before the jobs start: each job only receives the matrix of its image
+        homographies = {}
+        for image in images_todo:
+                try:
+                        homographies[image] = FM.homography(image, pts2)
+                except (KeyError, ValueError):
+                        print('! no valid fiducial coordinates for ' + image + ' in ' + fiducialmarks_file +
+                              ' (skipped)')
+        images_todo = [image for image in images_todo if image in homographies]
 
         ##### PROCESSING WORKFLOW #####
 
-        def reproject_and_crop(image):
-                # Read the images, keep the original pixel depth (-1) and read its dimensions
-                dst_filename = os.path.join(input_image_folder, image ) #os.path.splitext(os.path.basename(image))[0] + '.tif')
-                img = cv2.imread(dst_filename, -1)
-                rows, cols = img.shape
+        def reproject_and_crop(image, M, threads=1):
                 print('working on image: ' + image)
+                Path(output_image_folder).mkdir(parents=True, exist_ok=True) # Check if output folder exists
 
-                # Extract the image name and find the corresponding row with fiducial marks coordinates, in the CSV file
-                try:
-                        name_col=FM['name']
-                        df=FM[name_col.str.contains(image)]
-                        x = FM.loc[name_col == image].index[0]
-
-                except: # try with an extension to the name items"
-                        name_col = FM['name'] + '.tif'
-                        df = FM[name_col.str.contains(image)]
-                        x = FM.loc[name_col == image].index[0]
-
+                if scale_percent != 100: # reprojected and downscaled in one step, then sharpened and equalized
+                        if TiledReprojection is True:
+                                imready = reproject_image_tiled(input_path(image), M, dimX, dimY, None, threads,
+                                                                scale_percent)
+                        else:
+                                imready = warp_image(cv2.imread(input_path(image), -1), M, dimX, dimY, scale_percent)
+                        imready = enhance_image(imready, HistoCal, SharpeningIntensity, threads=threads)
+                        cv2.imwrite(os.path.join(output_image_folder, output_name(image, scale_percent)), imready)
+                        return
+
+                if TiledReprojection is True: # by tiles, written as soon as they are done
+                        reproject_image_tiled(input_path(image), M, dimX, dimY,
+                                              os.path.join(output_image_folder, standardized_name(image)), threads)
+                        return
 
-                pts1 = np.float32([[df['X1'][x],df['Y1'][x]],[df['X2'][x],df['Y2'][x]],[df['X3'][x],df['Y3'][x]],[df['X4'][x],df['Y4'][x]]])
+                # Read the images, keep the original pixel depth (-1) and read its dimensions
+                img = cv2.imread(input_path(image), -1)
 
                 # Reproject the image by applying the new coordinates of the fiducial marks and crop it at the provided dimensions
-                M = cv2.getPerspectiveTransform(pts1,pts2)
-                imready = cv2.warpPerspective(img,M,(dimX,dimY))
+                imready = warp_image(img, M, dimX, dimY)
 
                 # Export the reprojected and cropped images
-                Path(output_image_folder).mkdir(parents=True, exist_ok=True) # Check if output folder exists
-                cv2.imwrite(os.path.join(output_image_folder, str(image.split('.')[0]) + '_standardized.tif'), imready)
+                cv2.imwrite(os.path.join(output_image_folder, standardized_name(image)), imready)
 
         ##### PARALLEL PROCESSING #####
-
-        Parallel(n_jobs=num_cores, verbose=30)(delayed(reproject_and_crop)(image) for image in images_list)
+        # as many jobs as fit in memory, largest images first (see GAPP_Scheduler). With the tiled reprojection, the
+        # output is not held in memory, and the remaining cores are shared between the jobs to compute the tiles
+
+        headers = image_headers([input_path(image) for image in images_todo])
+        output_size = (0, 0) if TiledReprojection is True else (dimX, dimY)
+        if scale_percent != 100: # output image held in memory for the sharpening and equalization
+                output_size = (int(dimX * scale_percent / 100), int(dimY * scale_percent / 100))
+        estimates = {image: peak_memory(headers[input_path(image)], output_size) for image in images_todo}
+        # the Gaussian prefilter of warp_image (not tiled) also holds a blurred copy of the full resolution scan
+        if scale_percent != 100 and TiledReprojection is False:
+                estimates = {image: estimates[image] + peak_memory(headers[input_path(image)], (0, 0))
+                             for image in images_todo}
+        images_order, n_jobs = schedule(images_todo, estimates, num_cores)
+        n_jobs = max(1, min(n_jobs, len(images_order)))
+        threads = max(1, num_cores // n_jobs)
+        Parallel(n_jobs=n_jobs, verbose=30)(delayed(reproject_and_crop)(image, homographies[image], threads)
+                                            for image in images_order)
+
+        for image in images_todo:
+                update_ledger(ledger, output_name(image, scale_percent), fingerprints[image][0], fingerprints[image][1])
+        save_ledger(ledger, output_image_folder, '03')
 
         ##### END PROCESSING #####
 
@@ -197,4 +363,4 @@ def main_script_03(input_image_folder, output_image_folder, fiducialmarks_file,
 
 
 if __name__ == "__main__":
-    main_script_03(input_image_folder, output_image_folder, fiducialmarks_file, camera)
\ No newline at end of file
+    main_script_03(input_image_folder, output_image_folder, fiducialmarks_file, camera, Incremental)
\ No newline at end of file
@@ -51,7 +51,8 @@ Log:
         - v2.0.1 (AD)
                 - adapted for GAPP (graphic interface)
 Todo:
-    - could be parallelized, but not sure it would be really faster (main limitation being probably the disk writing capacity)
+    - the images are now processed by a pool of threads, with the reading and writing overlapping the processing (see
+      downscale_pipeline). The time spent in each phase is printed at the end, to see if the disk or the CPU limits
 
 Different options
     - OpenCV
@@ -67,11 +68,19 @@ see for unsharp mask in python
 
 import os
 import time
+import queue
+import threading
+import multiprocessing
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 
 import cv2
 import numpy as np
 
+from GAPP_ImageIO_v101 import read_overview, decode_reduced
+from GAPP_RunLedger_v101 import file_fingerprint, params_fingerprint, load_ledger, save_ledger, is_up_to_date, \
+    update_ledger
+
 # ----------------------------------------------------------------------------
 ################################    SETUP     ################################
 # ----------------------------------------------------------------------------
@@ -85,11 +94,388 @@ HistoCal = True # apply Contrast Limited adaptive histogram equalization to imag
 scale_percent = 60  # percent of original size. e.g., with 60% -->  1500dpi*0.6=900 dpi
 SharpeningIntensity = 2 # [0, 1 or 2]; 0 for no sharpening, 1 for low intensity, 2 for medium intensity sharpening.
                         # can be further tuned in the function unsharp_mask_OpenCV
+ReducedDecode = False # if True, the JPEG images and the TIFF images with overviews are read at the smallest resolution
+                      # that is still larger than the output image (see read_image_reduced), instead of full resolution.
+                      # Faster, but the output pixels of these images change (resized from the reduced image)
+Incremental = True # if True, only the images that are new, modified, or whose downscaling parameters changed since the
+                   # last run are processed (see GAPP_RunLedger)
+
+#### PARALLEL PROCESSING #####
+# (the images are read, processed and written at the same time, see downscale_pipeline)
+num_workers = multiprocessing.cpu_count() - 1 # threads resizing the images (OpenCV releases the GIL)
+ReadAhead = 2 # number of images read in advance (bounded, to limit the memory)
+WriteBehind = 2 # number of processed images waiting to be written (bounded, to limit the memory)
+WriteThreads = 1 # threads encoding and writing the images
+StripeHeight = 512 # lines per stripe of the unsharp mask, shared between the workers at the end of a run (see
+                   # downscale_pipeline and sharpen_stripes)
 
 # ----------------------------------------------------------------------------
 ################################ END OF SETUP ###############################
 # ----------------------------------------------------------------------------
-def main_script_04(image_folder, output_folder, scale_percent, HistoCal, SharpeningIntensity ):
+class PhaseTimings:
+    """
+    Time spent in each phase of the processing (summed over the threads), to see what limits the speed
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self.lock:
+            self.totals[phase] = self.totals.get(phase, 0) + seconds
+
+    def report(self, number_images, wall_time):
+        if number_images == 0:
+            return
+        print('\n--- time per phase (summed over the threads) ---')
+        for phase in ['read', 'decode', 'resize', 'sharpen', 'clahe', 'encode', 'write']:
+            if phase in self.totals:
+                print('     %-8s: %8.2f s (%.2f s per image)' % (phase, self.totals[phase],
+                                                               self.totals[phase] / number_images))
+        starved = self.totals.get('waiting for input', 0)
+        blocked = self.totals.get('waiting for writer', 0)
+        print('     workers waiting for images to process: %.2f s, for the writer: %.2f s (wall time: %.2f s)'
+              % (starved, blocked, wall_time))
+        if starved > blocked and starved > 0.25 * wall_time:
+            print('     -> reading (' + ('disk' if self.totals.get('read', 0) > self.totals.get('decode', 0)
+                                         else 'decoding') + ') is the bottleneck')
+        elif blocked > 0.25 * wall_time:
+            print('     -> writing (' + ('disk' if self.totals.get('write', 0) > self.totals.get('encode', 0)
+                                         else 'encoding') + ') is the bottleneck')
+        else:
+            print('     -> the processing (CPU) is the bottleneck')
+
+def record(timings, phase, start):
+    """
+    Add the time since start (time.perf_counter) to a phase (see PhaseTimings)
+    """
+    if timings is not None:
+        timings.add(phase, time.perf_counter() - start)
+
+def unsharp_mask_OpenCV(image, SharpeningIntensity, kernel_size=(3, 3), sigma=1.0):
+    im_blurred = cv2.GaussianBlur(image, kernel_size, sigma) # First we blur the image. By smoothing an image we suppress
+    # most of the high-frequency components.
+
+    # Second we subtract this smoothed image from the original image(the resulting difference is known as a mask).
+    # Thus, the output image will have most of the high-frequency components that are blocked by the smoothing filter.
+    # Adding this mask back to the original will enhance the high-frequency components.
+    alpha, beta = sharpening_weights(SharpeningIntensity)
+    sharpened = cv2.addWeighted(image, alpha, im_blurred, beta, 0)
+
+    return sharpened
+
+def sharpening_weights(SharpeningIntensity):
+    """
+    Weights of the image and of the blurred image in the unsharp mask (see unsharp_mask_OpenCV)
+    """
+    if SharpeningIntensity == 1: # low intensity
+        return 2.0, -1.0
+    elif SharpeningIntensity == 2: # medium intensity
+        return 1.0 + 3.0, -3.0
+    raise ValueError('unknown SharpeningIntensity: ' + str(SharpeningIntensity) + ' (1 or 2)')
+
+def sharpen_stripes(image, SharpeningIntensity, kernel_size=(3, 3), sigma=1.0, threads=None, stripe_height=None,
+                    pool=None):
+    """
+    Same result as unsharp_mask_OpenCV (bit-identical), computed by horizontal stripes on a pool of threads. Each
+    stripe is blurred with a halo of kernel_size[1] // 2 lines from its neighbours (the borders of the image are
+    the ones of the full image, so the reflected border of the blur is unchanged), and the blur and the weighted sum
+    are done in one pass per stripe: no full-size blurred image is kept in memory.
+
+    :param threads: number of threads (None: 1, i.e. unsharp_mask_OpenCV)
+    :param stripe_height: lines per stripe (None: StripeHeight)
+    :param pool: (optional) StripePool whose idle workers share the stripes (see downscale_pipeline), instead of
+                 threads
+    """
+    threads = 1 if threads is None else threads
+    stripe_height = StripeHeight if stripe_height is None else stripe_height
+    height = image.shape[0]
+    if (pool is None and threads <= 1) or height <= stripe_height:
+        return unsharp_mask_OpenCV(image, SharpeningIntensity, kernel_size, sigma)
+
+    alpha, beta = sharpening_weights(SharpeningIntensity)
+    halo = kernel_size[1] // 2
+    image = np.ascontiguousarray(image)
+    sharpened = np.empty_like(image)
+
+    def sharpen(y0):
+        y1 = min(height, y0 + stripe_height)
+        h0, h1 = max(0, y0 - halo), min(height, y1 + halo)
+        region = image[h0:h1]
+        im_blurred = cv2.GaussianBlur(region, kernel_size, sigma)
+        sharpened[y0:y1] = cv2.addWeighted(region[y0 - h0:y1 - h0], alpha, im_blurred[y0 - h0:y1 - h0], beta, 0)
+
+    if pool is not None:
+        pool.map(sharpen, range(0, height, stripe_height))
+        return sharpened
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in executor.map(sharpen, range(0, height, stripe_height)): # raises the errors of the threads, if any
+            pass
+    return sharpened
+
+def downscale_image(img, scale_percent, HistoCal, SharpeningIntensity, timings=None, full_size=None, pool=None):
+    """
+    Resize an image to scale_percent of its size, then apply the unsharp mask and the CLAHE (if asked)
+
+    :param img: image array (original pixel depth)
+    :param timings: (optional) PhaseTimings
+    :param full_size: (width, height) of the full resolution image, if img was read at a reduced resolution (see
+                      read_image_reduced). None: size of img
+    :param pool: (optional) StripePool sharing the stripes of the unsharp mask (see enhance_image)
+    :return: resized image
+    """
+    if full_size is None:
+        full_size = (img.shape[1], img.shape[0])
+    width = int(full_size[0] * scale_percent / 100)
+    height = int(full_size[1] * scale_percent / 100)
+    dim = (width, height)
+    # resize image
+    start = time.perf_counter()
+    resized = cv2.resize(img, dim, interpolation=cv2.INTER_CUBIC ) #INTER_CUBIC is a bicubic interpolation
+    record(timings, 'resize', start)
+
+    """[optional] flag that takes one of the following methods. INTER_NEAREST – a nearest-neighbor interpolation INTER_LINEAR
+    – a bilinear interpolation (used by default) INTER_AREA – resampling using pixel area relation. It may be a
+    preferred method for image decimation, as it gives moire’-free results. But when the image is zoomed, it is
+    similar to the INTER_NEAREST method. INTER_CUBIC – a bicubic interpolation over 4×4 pixel neighborhood INTER_LANCZOS4 – a
+    Lanczosinterpolation over 8×8 pixel neighborhood
+    """
+
+    # B-C. sharpen and equalize the resized image
+    return enhance_image(resized, HistoCal, SharpeningIntensity, timings, pool=pool)
+
+def enhance_image(resized, HistoCal, SharpeningIntensity, timings=None, threads=None, pool=None):
+    """
+    Apply the unsharp mask and the CLAHE (if asked) to a resized image (see downscale_image, and SCRIPT 03 when the
+    reprojection and the downscaling are done in one step)
+
+    :param resized: resized image
+    :param timings: (optional) PhaseTimings
+    :param threads: threads of the unsharp mask (None: 1, see sharpen_stripes), to be given only if the cores are
+                    not used by other images (e.g., SCRIPT 03 gives the cores left per job)
+    :param pool: (optional) StripePool of the workers without image left (end of a run, see downscale_pipeline)
+    :return: sharpened and equalized image
+    """
+    # B. apply unsharp mask to resized image
+    if SharpeningIntensity >0:
+        start = time.perf_counter()
+        resized=sharpen_stripes(resized, SharpeningIntensity, kernel_size=(3, 3), sigma=1.0, threads=threads,
+                                pool=pool)
+        record(timings, 'sharpen', start)
+
+    # C. apply Contrast Limited adaptive histogram equalization to image (CLAHE)
+    # applied on the full image: the LUT of each tile needs the whole grid, and the interpolation between the tiles
+    # depends on the position of the lines in the image, so that stripes would not give the same result (stripes
+    # aligned on the tiles, with halo lines: about 0.04% of the pixels differ by one grey level, many more when the
+    # image size is not a multiple of the grid). OpenCV already computes the LUTs and the interpolation on its own
+    # pool of threads (parallel_for_), i.e. with all the cores.
+    if HistoCal is True:
+        start = time.perf_counter()
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(40,40))
+        resized = clahe.apply(resized)
+        record(timings, 'clahe', start)
+
+    return resized
+
+def read_image(image_path, timings=None):
+    """
+    Read an image (original pixel depth), the disk reading and the decoding being timed separately
+    """
+    start = time.perf_counter()
+    with open(image_path, 'rb') as f:
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+    record(timings, 'read', start)
+    start = time.perf_counter()
+    img = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+    record(timings, 'decode', start)
+    if img is None:
+        raise ValueError('could not decode ' + image_path)
+    return img
+
+def read_image_reduced(image_path, scale_percent, timings=None):
+    """
+    Read an image at the smallest resolution that is still larger than the image downscaled to scale_percent: TIFF
+    overview or JPEG decoded at 1/2, 1/4 or 1/8 (see GAPP_ImageIO), full resolution otherwise
+
+    :return: image array, (width, height) of the full resolution image
+    """
+    if scale_percent < 100:
+        start = time.perf_counter()
+        reduced = read_overview(image_path, scale_percent) # only the strips of the overview are read
+        if reduced is not None:
+            record(timings, 'decode', start)
+            return reduced
+    start = time.perf_counter()
+    with open(image_path, 'rb') as f:
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+    record(timings, 'read', start)
+    start = time.perf_counter()
+    reduced = decode_reduced(data, scale_percent) if scale_percent < 100 else None
+    if reduced is None:
+        img = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError('could not decode ' + image_path)
+        reduced = img, (img.shape[1], img.shape[0])
+    record(timings, 'decode', start)
+    return reduced
+
+def write_image(image_path, img, timings=None):
+    """
+    Write an image, the encoding and the disk writing being timed separately
+    """
+    start = time.perf_counter()
+    ok, data = cv2.imencode(os.path.splitext(image_path)[1], img)
+    record(timings, 'encode', start)
+    if not ok:
+        raise ValueError('could not encode ' + image_path)
+    start = time.perf_counter()
+    with open(image_path, 'wb') as f:
+        f.write(data.tobytes())
+    record(timings, 'write', start)
+
+class StripePool:
+    """
+    Stripes of the last images of a run (see sharpen_stripes), computed by the thread processing the image and by the
+    workers of downscale_pipeline that have no image left
+    """
+
+    def __init__(self):
+        self.tasks = queue.Queue()
+
+    def run(self, task):
+        future, function, item = task
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(function(item))
+            except Exception as e:
+                future.set_exception(e)
+
+    def map(self, function, items):
+        """
+        Compute function(item) for all the items; the calling thread computes the stripes not taken by the helpers
+
+        :return: list of the results (raises the errors, if any)
+        """
+        futures = []
+        for item in items:
+            futures.append(Future())
+            self.tasks.put((futures[-1], function, item))
+        while not all(future.done() for future in futures):
+            try:
+                self.run(self.tasks.get_nowait())
+            except queue.Empty: # the remaining stripes are being computed by the helpers
+                wait(futures)
+        return [future.result() for future in futures]
+
+    def help(self, stop):
+        """
+        Compute the stripes of the other threads until stop() is True
+        """
+        while True:
+            try:
+                self.run(self.tasks.get(timeout=0.01))
+            except queue.Empty:
+                if stop():
+                    return
+
+def downscale_pipeline(imlist, read, process, write, num_workers=1, read_ahead=2, write_behind=2, write_threads=1,
+                       timings=None):
+    """
+    Read, process and write images at the same time: one thread reads the images in advance (bounded queue), a pool
+    of threads processes them and other threads write the results (bounded queue), so that the disk reading, the
+    processing and the disk writing overlap while only a few images are held in memory. Each worker processes its
+    image on its own thread; once all the images are read, the last ones are given the StripePool of the
+    run, and the workers without image left compute their stripes (see sharpen_stripes), so that the end of a run
+    still uses all the workers, without starting more threads.
+
+    :param read: function(image) -> image array
+    :param process: function(image array, pool) -> processed image array (pool: StripePool, or None)
+    :param write: function(image, processed image array)
+    :param timings: (optional) PhaseTimings, where the time the workers wait for the reader and the writer is added
+    :return: list of the images written (in the order they were written)
+    """
+    num_workers = max(1, num_workers)
+    write_threads = max(1, write_threads)
+    to_process = queue.Queue(maxsize=max(1, read_ahead))
+    to_write = queue.Queue(maxsize=max(1, write_behind))
+    done = object() # end of the queue
+    errors = []
+    written = []
+    read_all = threading.Event()
+    pool = StripePool()
+    finished = [0] # workers without image left
+    lock = threading.Lock()
+
+    def reader():
+        try:
+            for image in imlist:
+                if errors:
+                    break
+                to_process.put((image, read(image)))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            read_all.set()
+            for _ in range(num_workers):
+                to_process.put(done)
+
+    def worker():
+        while True:
+            start = time.perf_counter()
+            item = to_process.get()
+            record(timings, 'waiting for input', start)
+            if item is done:
+                break
+            if errors: # keep emptying the queue so that the reader can stop
+                continue
+            last = read_all.is_set() # only the images already read (see read_ahead) are left for the other workers
+            try:
+                result = (item[0], process(item[1], pool if last else None))
+            except Exception as e:
+                errors.append(e)
+                continue
+            start = time.perf_counter()
+            to_write.put(result)
+            record(timings, 'waiting for writer', start)
+        with lock:
+            finished[0] = finished[0] + 1
+        pool.help(lambda: finished[0] == num_workers) # stripes of the last images, until all the workers are done
+
+    def writer():
+        while True:
+            item = to_write.get()
+            if item is done:
+                break
+            if errors:
+                continue
+            try:
+                write(*item)
+                written.append(item[0])
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=reader)] + [threading.Thread(target=worker) for _ in range(num_workers)]
+    writers = [threading.Thread(target=writer) for _ in range(write_threads)]
+    for thread in threads + writers:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for _ in writers:
+        to_write.put(done)
+    for thread in writers:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return written
+
+def downscaled_name(image):
+    """
+    Name of the downscaled image (complemented with "_DownSharp")
+    """
+    return image[:-4] + "_DownSharp" + extension
+
+def main_script_04(image_folder, output_folder, scale_percent, HistoCal, SharpeningIntensity, Incremental=False):
 
     print(' ')
     print('=====================================================================')
@@ -113,24 +499,22 @@ def main_script_04(image_folder, output_folder, scale_percent, HistoCal, Sharpen
           '\n-------------------------------'
           '\n-------------------------------\n')
 
+    # skip the images already downscaled from the same input and with the same parameters
+    params_fp = params_fingerprint({'scale_percent': scale_percent, 'HistoCal': HistoCal,
+                                    'SharpeningIntensity': SharpeningIntensity, 'tool': tool, 'extension': extension,
+                                    'ReducedDecode': ReducedDecode})
+    ledger = load_ledger(output_folder, '04') if Incremental is True else {}
+    input_fp = {image: file_fingerprint(os.path.join(image_folder, image)) for image in imlist}
+    imlist_todo = [image for image in imlist if not is_up_to_date(
+        ledger, downscaled_name(image), input_fp[image], params_fp,
+        os.path.isfile(output_folder + '/' + downscaled_name(image)))]
+    if Incremental is True:
+        print(' > ' + str(len(imlist) - len(imlist_todo)) + ' image(s) already up to date (skipped)\n')
+
     # --------------------------------------------------
     # Functions
     # --------------------------------------------------
 
-    def unsharp_mask_OpenCV(image, kernel_size=(3, 3), sigma=1.0):
-        im_blurred = cv2.GaussianBlur(image, kernel_size, sigma) # First we blur the image. By smoothing an image we suppress
-        # most of the high-frequency components.
-
-        # Second we subtract this smoothed image from the original image(the resulting difference is known as a mask).
-        # Thus, the output image will have most of the high-frequency components that are blocked by the smoothing filter.
-        # Adding this mask back to the original will enhance the high-frequency components.
-        if SharpeningIntensity == 1: # low intensity
-            sharpened = cv2.addWeighted(image, 2, im_blurred, -1.0, 0)
-        elif SharpeningIntensity == 2: # medium intensity
-            sharpened = cv2.addWeighted(image, 1.0 + 3.0, im_blurred, -3.0, 0)
-
-        return sharpened
-
     # functions
     def unsharp_mask_Pillow(image, Inradius=3):
         from PIL import ImageFilter
@@ -139,49 +523,38 @@ def main_script_04(image_folder, output_folder, scale_percent, HistoCal, Sharpen
 
 
     def OpenCVDownscaler(imlist, scale_percent):
-        # A. Downscaling with OpenCV
-        count=1
-        for image in imlist:
-            print('\n >>> Image [' + str(count) + '/' + str(len(imlist)) + ']: ' + image)
-            img = cv2.imread(image_folder + '\\' + image, cv2.IMREAD_UNCHANGED)
-            print('     Original Dimensions : ', img.shape)
+        # A. Downscaling with OpenCV, the images being read, processed and written at the same time
+        timings = PhaseTimings()
+        Path(output_folder).mkdir(parents=True, exist_ok=True)
 
+        def read(image):
+            if ReducedDecode is True:
+                return read_image_reduced(os.path.join(image_folder, image), scale_percent, timings)
+            return read_image(os.path.join(image_folder, image), timings), None
 
-            width = int(img.shape[1] * scale_percent / 100)
-            height = int(img.shape[0] * scale_percent / 100)
-            dim = (width, height)
-            # resize image
-            resized = cv2.resize(img, dim, interpolation=cv2.INTER_CUBIC ) #INTER_CUBIC is a bicubic interpolation
-
-            """[optional] flag that takes one of the following methods. INTER_NEAREST – a nearest-neighbor interpolation INTER_LINEAR
-            – a bilinear interpolation (used by default) INTER_AREA – resampling using pixel area relation. It may be a
-            preferred method for image decimation, as it gives moire’-free results. But when the image is zoomed, it is
-            similar to the INTER_NEAREST method. INTER_CUBIC – a bicubic interpolation over 4×4 pixel neighborhood INTER_LANCZOS4 – a
-            Lanczosinterpolation over 8×8 pixel neighborhood
-            """
-
-            print('     Resized Dimensions : ', resized.shape)
-
-            # B. apply unsharp mask to resized image
-            if SharpeningIntensity >0:
-                resized=unsharp_mask_OpenCV(resized, kernel_size=(3, 3), sigma=1.0)
-
-            # C. apply Contrast Limited adaptive histogram equalization to image (CLAHE)
-            if HistoCal is True:
-                clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(40,40))
-                resized = clahe.apply(resized)
-
+        def process(item, pool):
+            # A-C. resize, sharpen and equalize the image
+            img, full_size = item
+            return downscale_image(img, scale_percent, HistoCal, SharpeningIntensity, timings, full_size, pool)
 
+        def write(image, resized):
             # D. Save the image
-            Path(output_folder).mkdir(parents=True, exist_ok=True)
-            resized_name= image[:-4] + "_DownSharp" + extension
+            resized_name= downscaled_name(image)
             downSname = output_folder + '/' + resized_name   # output filename
-
-            # Saving the image using cv2.imwrite() method
-            cv2.imwrite(downSname, resized)
-            print( '    -> saved to: ' + downSname)
+            write_image(downSname, resized, timings)
+            print(' >>> [' + str(len(resizedimlist) + 1) + '/' + str(len(imlist)) + '] ' + image + ' ' +
+                  str(resized.shape) + ' -> saved to: ' + downSname)
             resizedimlist.append(resized_name)
-            count = count + 1
+
+        start = time.perf_counter()
+        try:
+            downscale_pipeline(imlist, read, process, write, num_workers, ReadAhead, WriteBehind, WriteThreads, timings)
+        finally: # the images written are kept in the ledger, even if one failed
+            for image in imlist:
+                if downscaled_name(image) in resizedimlist:
+                    update_ledger(ledger, downscaled_name(image), input_fp[image], params_fp)
+            save_ledger(ledger, output_folder, '04')
+        timings.report(len(imlist), time.perf_counter() - start)
 
 
     if tool == 'opencv':
@@ -190,14 +563,14 @@ def main_script_04(image_folder, output_folder, scale_percent, HistoCal, Sharpen
               '-----------------------------------------\n')
         start_time = time.time()
 
-        OpenCVDownscaler(imlist, scale_percent) # main
+        OpenCVDownscaler(imlist_todo, scale_percent) # main (the ledger is saved even if an image failed)
 
         print("\n--- data processing time was %.2f s seconds ---\n" % (time.time() - start_time))
 
         #check number of file processed compared to input files
         outfiles = os.listdir(output_folder)
         outimlist = [filename for filename in outfiles if filename[-4:] in [".tif", ".TIF", ".png", ".jpg", ".JPG"]]
-        outimlist = outfiles + [filename for filename in outimlist if filename[-5:] in [".tiff", ".TIFF"]]
+        outimlist = outimlist + [filename for filename in outfiles if filename[-5:] in [".tiff", ".TIFF"]]
         if len(imlist) != len(outimlist):
             print('*** WARNING ***')
             print('! it seems that some image(s) have not been processed!')
@@ -206,4 +579,4 @@ def main_script_04(image_folder, output_folder, scale_percent, HistoCal, Sharpen
 
 
 if __name__ == "__main__":
-    main_script_04(image_folder, output_folder, scale_percent, HistoCal, SharpeningIntensity)
\ No newline at end of file
+    main_script_04(image_folder, output_folder, scale_percent, HistoCal, SharpeningIntensity, Incremental)
\ No newline at end of file
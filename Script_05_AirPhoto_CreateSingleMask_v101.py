@@ -33,8 +33,9 @@ Notes:
       or Miniconda.
       
     - Specific Python modules needed for this script:
-        > Glob
+        > Joblib
         > Numpy
+        > Pandas
         > Pillow
     
     - To use this script, simply adapt the directory paths and required values
@@ -42,11 +43,11 @@ Notes:
 
 """
 
-import glob
 from PIL import Image
 from PIL import ImageDraw
 import numpy as np
 from time import sleep
+from GAPP_DatasetCatalog_v101 import load_catalog, max_dimensions, min_dimensions
 
 ################################    SETUP     ################################
 
@@ -78,20 +79,14 @@ print('=====================================================================')
 print(' ')
 
 ### Define the list of images and count the number of files to process ###
-images_list = glob.glob(input_image_folder + image_format)
-print('Number of images in dataset: ' + str(len(images_list)))
+# (image sizes are read from the dataset manifest, see GAPP_DatasetCatalog)
+catalog = load_catalog(input_image_folder, recursive=False, extensions=[image_format[1:]])
+print('Number of images in dataset: ' + str(len(catalog)))
 print(' ')
 
 ### Detect the max width and height in the dataset ###
-Image.MAX_IMAGE_PIXELS = None
-sizes = [Image.open(f, 'r').size for f in images_list]
-sizes_array = np.asarray(sizes)
-widths = sizes_array[:, 0]
-heights = sizes_array[:, 1]
-width_max = max(widths)
-height_max = max(heights)
-width_min = min(widths)
-height_min = min(heights)
+width_max, height_max = max_dimensions(catalog)
+width_min, height_min = min_dimensions(catalog)
 
 print('Width found = ' + str(width_max) + ' pixels')
 print('Height found = ' + str(height_max) + ' pixels')
@@ -0,0 +1,213 @@
+"""
+Synthetic scans for the tests of the GAPP chain: small 16-bit scans with four target fiducials (circle + cross) near
+their corners, slightly shifted and rotated from one scan to the other, the templates of the four corners and their
+centres (Center_Fiducials.txt), as made with SCRIPT 00.
+
+The scripts are run in-process (one job, no pause at the end, no QA figures) on scans of 2000 x 2000 pixels: the
+window size of the detection (S, 2500 in parameters_02) and the output size of the reprojection are reduced to fit
+these scans (see chain).
+"""
+
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+dataset = 'Synthetic'
+corner_names = ['top_left', 'top_right', 'bot_right', 'bot_left']
+reference_quad = np.float64([[250, 250], [1750, 260], [1740, 1760], [245, 1750]]) # fiducial centres (u, v)
+scan_sizes = [(2000, 1960), (1980, 1970), (1990, 1950), (2000, 1965)] # (width, height): padded by SCRIPT 01
+S = 800 # size of the corner windows of the detection
+template_size = 160
+radius = 40
+pts2 = np.float32([[100, 100], [1100, 100], [1100, 1100], [100, 1100]]) # standard positions (see chain)
+dim = 1200 # size of the reprojected images (see chain)
+p = 0.04
+stripes = 'right, bottom'
+camera = 'Wild RC5a'
+scale_percent = 50
+
+
+def draw_fiducial(img, u, v, value):
+    """
+    Draw a target fiducial (circle and cross) centred on (u, v) (to the nearest pixel: OpenCV rounds the thick shapes)
+    """
+    shift = 4
+    centre = (int(round(u * 2 ** shift)), int(round(v * 2 ** shift)))
+    cv2.circle(img, centre, radius * 2 ** shift, value, 6, cv2.LINE_AA, shift)
+    for du, dv in [(1, 0), (0, 1)]:
+        cv2.line(img, (centre[0] - du * 60 * 2 ** shift, centre[1] - dv * 60 * 2 ** shift),
+                 (centre[0] + du * 60 * 2 ** shift, centre[1] + dv * 60 * 2 ** shift), value, 4, cv2.LINE_AA, shift)
+
+
+def background(rng, width, height):
+    """
+    Smooth random texture (uint16) with some noise
+    """
+    coarse = rng.random((height // 100 + 2, width // 100 + 2)) * 12000 + 8000
+    img = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = img + rng.normal(0, 600, img.shape)
+    return np.clip(img, 0, 65535)
+
+
+def fiducial_positions(rng):
+    """
+    Reference quadrilateral, rotated (+/- 0.3 degree) and shifted (+/- 12 pixels)
+    """
+    angle = np.deg2rad(rng.uniform(-0.3, 0.3))
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    centre = reference_quad.mean(axis=0)
+    return (reference_quad - centre) @ rotation.T + centre + rng.uniform(-12, 12, 2)
+
+
+def make_scan(rng, width, height, quad, decoy=None, hidden=None):
+    """
+    :param decoy: (optional) (corner index, (du, dv)): a second, cleaner mark drawn at this offset from the fiducial,
+                  the fiducial itself being blurred and noisy (wrong match with a good matching value)
+    :param hidden: (optional) corner index whose fiducial is not drawn
+    :return: uint16 scan
+    """
+    img = background(rng, width, height)
+    for i, (u, v) in enumerate(quad):
+        if i == hidden:
+            continue
+        draw_fiducial(img, u, v, 60000)
+        if decoy is not None and decoy[0] == i:
+            half = template_size // 2
+            region = img[int(v) - half:int(v) + half, int(u) - half:int(u) + half]
+            region[:] = cv2.GaussianBlur(region, (0, 0), 2.5) + rng.normal(0, 9000, region.shape)
+            draw_fiducial(img, u + decoy[1][0], v + decoy[1][1], 60000)
+    return np.clip(img, 0, 65535).astype(np.uint16)
+
+
+def make_templates(folder):
+    """
+    Templates of the four corners (clean mark on a flat background) and Center_Fiducials.txt
+    """
+    os.makedirs(folder, exist_ok=True)
+    half = template_size // 2
+    lines = ['Template Xc Yc']
+    for corner in corner_names:
+        template = np.full((template_size, template_size), 14000.0)
+        draw_fiducial(template, half, half, 60000)
+        name = 'Template_' + dataset + '_' + corner + '_1'
+        cv2.imwrite(os.path.join(folder, name + '.tif'), template.astype(np.uint16))
+        lines.append(name + ' ' + str(half) + ' ' + str(half))
+    with open(os.path.join(folder, 'Center_Fiducials.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def make_dataset(root, decoy=None, hidden=None, seed=0):
+    """
+    Write the raw scans (one per scan_sizes) and the templates
+
+    :param decoy: (optional) (image index, corner index, (du, dv)), see make_scan
+    :param hidden: (optional) (image index, corner index), see make_scan
+    :return: dic with the folders and the true fiducial centres {scan name: (4, 2) array}
+    """
+    rng = np.random.default_rng(seed)
+    raw = os.path.join(root, 'raw')
+    os.makedirs(raw, exist_ok=True)
+    truth = {}
+    for i, (width, height) in enumerate(scan_sizes):
+        name = 'scan_%02d.tif' % i
+        quad = fiducial_positions(rng)
+        scan = make_scan(rng, width, height, quad,
+                         decoy=decoy[1:] if decoy is not None and decoy[0] == i else None,
+                         hidden=hidden[1] if hidden is not None and hidden[0] == i else None)
+        cv2.imwrite(os.path.join(raw, name), scan)
+        truth[name] = quad
+    make_templates(os.path.join(root, 'templates'))
+    return {'root': root, 'raw': raw, 'templates': os.path.join(root, 'templates'), 'truth': truth}
+
+
+def read_fiducial_csv(path):
+    """
+    :return: dic {image name: [X1, Y1, ..., Y4]} of the csv written by SCRIPT 02 (or the fused chain)
+    """
+    rows = {}
+    with open(path) as f:
+        for line in f.read().splitlines()[1:]:
+            if line != '':
+                values = line.split(';')
+                rows[values[0]] = [float(value) for value in values[1:]]
+    return rows
+
+
+def run_step_by_step(chain, data, output, Incremental=False, VirtualCanvas=False, HistoCal=True,
+                     SharpeningIntensity=2):
+    """
+    Run the scripts 01 to 04 one after the other (output folders as in the fused chain)
+
+    :return: path of the fiducial csv
+    """
+    canvas_sized = os.path.join(output, '01_CanvasSized')
+    chain['s01'].main_script_01(data['raw'], canvas_sized, VirtualCanvas, Incremental)
+    chain['s02'].main_script_02(canvas_sized, data['templates'], dataset, p, stripes, Incremental)
+    fiducialmarks_file = canvas_sized + '/' + '_fiducial_marks_coordinates_' + dataset + '.csv'
+    chain['s03'].main_script_03(canvas_sized, os.path.join(output, '02_Reprojected'), fiducialmarks_file, camera,
+                                Incremental)
+    chain['s04'].main_script_04(os.path.join(output, '02_Reprojected'), os.path.join(output, '03_Resized'),
+                                scale_percent, HistoCal, SharpeningIntensity, Incremental)
+    return fiducialmarks_file
+
+
+def run_fused(chain, data, output, Incremental=False, SaveIntermediates=False, ComposedResampling=False,
+              Steps=None):
+    """
+    Run the fused chain (all the steps by default)
+
+    :return: path of the fiducial csv
+    """
+    if Steps is None:
+        Steps = {'Script_01': 1, 'Script_02': 1, 'Script_03': 1, 'Script_04': 1}
+    chain['fused'].main_script_fused(data['raw'], output, data['templates'], dataset, p, stripes, camera,
+                                     scale_percent, True, 2, Steps, SaveIntermediates, Incremental,
+                                     ComposedResampling)
+    return os.path.join(output, '01_CanvasSized', '_fiducial_marks_coordinates_' + dataset + '.csv')
+
+
+def read_images(folder):
+    """
+    :return: dic {file name: image} of the tif files of a folder
+    """
+    return {name: cv2.imread(os.path.join(folder, name), cv2.IMREAD_UNCHANGED) for name in sorted(os.listdir(folder))
+            if name.endswith('.tif')}
+
+
+@pytest.fixture
+def chain(monkeypatch, tmp_path):
+    """
+    Run the scripts in-process and quickly: one job, no pause, no QA figures, corner windows of S pixels, small
+    reprojected images (dim x dim pixels, standard fiducial positions pts2)
+    """
+    import GAPP_QAFigures_v101 as qa
+    import GAPP_Script_01_AirPhoto_CanvasSizing_v201 as s01
+    import GAPP_Script_02_AutomaticFiducialDetection_v201 as s02
+    import GAPP_Script_03_AirPhoto_Reprojection_v201 as s03
+    import GAPP_Script_04_AirPhotos_Resize_v201 as s04
+    import GAPP_FusedPipeline_v101 as fused
+
+    monkeypatch.chdir(tmp_path) # SCRIPT 01 changes the working directory
+    monkeypatch.setattr(qa, 'QAFigures', 'off')
+    for module in [s01, s02, s03, fused]:
+        monkeypatch.setattr(module, 'num_cores', 1)
+        monkeypatch.setattr(module, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(s04, 'num_workers', 1)
+    for module in [s03, fused]:
+        monkeypatch.setattr(module, 'dimX', dim)
+        monkeypatch.setattr(module, 'dimY', dim)
+        monkeypatch.setattr(module, 'camera_fiducial_points', lambda camera: pts2)
+
+    parameters_02 = s02.parameters_02
+    def small_parameters_02(*args):
+        parameters = parameters_02(*args)
+        return parameters[:7] + (S,) + parameters[8:-1] + (1,) # S, num_cores
+
+    monkeypatch.setattr(s02, 'parameters_02', small_parameters_02)
+    monkeypatch.setattr(fused, 'parameters_02', s02.parameters_02)
+    return {'s01': s01, 's02': s02, 's03': s03, 's04': s04, 'fused': fused}
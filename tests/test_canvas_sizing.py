@@ -0,0 +1,40 @@
+"""
+Virtual canvas of SCRIPT 01 (VirtualCanvas): the next steps read the original scans through the canvas manifest and
+must give the same fiducial csv and the same images as with the padded canvas-sized images
+"""
+
+import os
+
+import numpy as np
+
+from conftest import make_dataset, read_fiducial_csv, read_images, run_step_by_step, run_fused
+
+
+def check_same_products(data, expected_output, output, expected_csv, csv):
+    assert read_fiducial_csv(csv) == read_fiducial_csv(expected_csv)
+    expected = read_images(os.path.join(expected_output, '03_Resized'))
+    result = read_images(os.path.join(output, '03_Resized'))
+    assert sorted(result) == sorted(expected) and len(expected) == len(data['truth'])
+    for name in expected:
+        assert np.array_equal(result[name], expected[name]), name
+
+
+def test_virtual_canvas_same_as_padded(chain, tmp_path):
+    data = make_dataset(str(tmp_path))
+    csv_padded = run_step_by_step(chain, data, str(tmp_path / 'padded'))
+    csv_virtual = run_step_by_step(chain, data, str(tmp_path / 'virtual'), VirtualCanvas=True)
+
+    canvas_sized = str(tmp_path / 'virtual' / '01_CanvasSized')
+    assert chain['s01'].read_canvas_manifest(canvas_sized) is not None
+    assert [name for name in os.listdir(canvas_sized) if name.endswith('.tif')] == [] # no padded image written
+    check_same_products(data, str(tmp_path / 'padded'), str(tmp_path / 'virtual'), csv_padded, csv_virtual)
+
+
+def test_fused_after_virtual_canvas(chain, tmp_path):
+    # steps 02 to 04 fused, reading the scans listed in the manifest of SCRIPT 01
+    data = make_dataset(str(tmp_path))
+    csv_steps = run_step_by_step(chain, data, str(tmp_path / 'steps'))
+    chain['s01'].main_script_01(data['raw'], str(tmp_path / 'fused' / '01_CanvasSized'), True, False)
+    csv_fused = run_fused(chain, data, str(tmp_path / 'fused'),
+                          Steps={'Script_01': 0, 'Script_02': 1, 'Script_03': 1, 'Script_04': 1})
+    check_same_products(data, str(tmp_path / 'steps'), str(tmp_path / 'fused'), csv_steps, csv_fused)
@@ -0,0 +1,35 @@
+"""
+Circle fallback of the fiducial detection (GAPP_CircleDetection): centre found at sub-pixel accuracy, within the
+time budget of a corner
+"""
+
+import time
+
+import numpy as np
+
+import GAPP_CircleDetection_v101 as cd
+from conftest import background, draw_fiducial, radius
+
+
+def test_synthetic_disks():
+    errors = cd.check_synthetic(radii=(40, 100, 200, 400), size=1000)
+    assert all(error < 0.2 for _, error in errors), errors
+
+
+def test_fiducial_ring():
+    rng = np.random.default_rng(0)
+    img = background(rng, 800, 800)
+    draw_fiducial(img, 371, 402, 60000)
+    circle = cd.find_circle(np.clip(img, 0, 65535).astype(np.uint16), radius - 15, radius + 15)
+    assert circle is not None
+    u, v, found_radius = circle
+    assert np.hypot(u - 371, v - 402) < 1 and abs(found_radius - radius) < 4
+
+
+def test_time_budget():
+    rng = np.random.default_rng(2)
+    img = background(rng, 2500, 2500)
+    draw_fiducial(img, 1200, 1300, 60000)
+    start = time.perf_counter()
+    cd.find_circle(np.clip(img, 0, 65535).astype(np.uint16), 30, 300, time_budget=0)
+    assert time.perf_counter() - start < 1
@@ -0,0 +1,143 @@
+"""
+Options of the fiducial detection (SCRIPT 02) on the synthetic scans: adaptive search windows, several templates per
+corner, geometric consistency check of the dataset and decision applied again to the saved matching records
+(Redecide)
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+from conftest import dataset, make_dataset, read_fiducial_csv, template_size, draw_fiducial, p, stripes
+
+parameter_indices = {'RunParallel': 4, 'MatchingValueThreshold': 8} # see parameters_02
+
+
+def set_parameters(monkeypatch, s02, **values):
+    """
+    Change parameters returned by parameters_02 (e.g., RunParallel=False)
+    """
+    parameters_02 = s02.parameters_02
+
+    def changed_parameters_02(*args):
+        parameters = list(parameters_02(*args))
+        for key, value in values.items():
+            parameters[parameter_indices[key]] = value
+        return tuple(parameters)
+
+    monkeypatch.setattr(s02, 'parameters_02', changed_parameters_02)
+
+
+def run_detection(chain, data, output):
+    """
+    Canvas sizing (SCRIPT 01, once) and fiducial detection (SCRIPT 02)
+
+    :return: path of the fiducial csv
+    """
+    image_folder = os.path.join(output, '01_CanvasSized')
+    if not os.path.isdir(image_folder):
+        chain['s01'].main_script_01(data['raw'], image_folder, False, False)
+    chain['s02'].main_script_02(image_folder, data['templates'], dataset, p, stripes, False)
+    return os.path.join(image_folder, '_fiducial_marks_coordinates_' + dataset + '.csv')
+
+
+def to_be_checked(fiducialmarks_file):
+    path = fiducialmarks_file[:-4] + '_TobeChecked.csv'
+    if not os.path.isfile(path):
+        return []
+    with open(path) as f:
+        return [line.split(',')[1:3] for line in f.read().splitlines()[1:]]
+
+
+def test_adaptive_windows(chain, tmp_path, monkeypatch):
+    data = make_dataset(str(tmp_path))
+    set_parameters(monkeypatch, chain['s02'], RunParallel=False) # windows updated after each image
+    expected = read_fiducial_csv(run_detection(chain, data, str(tmp_path / 'full')))
+
+    monkeypatch.setattr(chain['s02'], 'AdaptiveWindows', True)
+    monkeypatch.setattr(chain['s02'], 'AdaptiveMinImages', 2)
+    adaptive_windows = chain['s02'].adaptive_windows
+    reduced = []
+
+    def spy(corner_stats, bank, S):
+        windows = adaptive_windows(corner_stats, bank, S)
+        reduced.extend(window for window in windows.values() if window is not None)
+        return windows
+
+    monkeypatch.setattr(chain['s02'], 'adaptive_windows', spy)
+    assert read_fiducial_csv(run_detection(chain, data, str(tmp_path / 'adaptive'))) == expected
+    assert len(reduced) == 2 * 4 and all(window[2] < chain['s02'].S for window in reduced) # last two images
+
+
+def test_several_templates(chain, tmp_path, monkeypatch):
+    data = make_dataset(str(tmp_path))
+    expected = read_fiducial_csv(run_detection(chain, data, str(tmp_path / 'one')))
+
+    # second template of each corner: smaller mark (worse match), listed first
+    half = template_size // 2
+    lines = []
+    for corner in ['top_left', 'top_right', 'bot_right', 'bot_left']:
+        template = np.full((template_size, template_size), 14000.0)
+        draw_fiducial(template, half, half, 60000)
+        template = cv2.resize(template, None, fx=0.8, fy=0.8)
+        template = cv2.copyMakeBorder(template, 16, 16, 16, 16, cv2.BORDER_REPLICATE)
+        name = 'Template_' + dataset + '_' + corner + '_0'
+        cv2.imwrite(os.path.join(data['templates'], name + '.tif'), template.astype(np.uint16))
+        lines.append(name + ' ' + str(half) + ' ' + str(half))
+    with open(os.path.join(data['templates'], 'Center_Fiducials.txt'), 'a') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    monkeypatch.setattr(chain['s02'], 'OneTemplateMax', False)
+    bank = chain['s02'].load_template_bank(data['templates'], os.path.join(data['templates'], 'Center_Fiducials.txt'))
+    assert all(len(bank.template_images(corner)) == 2 for corner in bank.templates)
+    assert read_fiducial_csv(run_detection(chain, data, str(tmp_path / 'several'))) == expected
+
+
+def test_consistency_check(chain, tmp_path):
+    # a cleaner mark 600 pixels away from the (noisy) top-right fiducial of one scan is matched first
+    data = make_dataset(str(tmp_path), decoy=(1, 1, (-500, 350)))
+    fiducialmarks_file = run_detection(chain, data, str(tmp_path))
+    rows = read_fiducial_csv(fiducialmarks_file)
+    for name, quad in data['truth'].items():
+        found = np.reshape(rows[os.path.splitext(name)[0] + '_CanvasSized'], (4, 2))
+        assert np.abs(found - quad).max() < (8 if name == 'scan_01.tif' else 3), name
+    assert ['scan_01_CanvasSized.tif', 'top_right'] not in to_be_checked(fiducialmarks_file)
+
+
+def test_consistency_check_without_four_fiducials(chain, capsys):
+    detected = {'scan_00_CanvasSized.tif': {'top_left': [250, 250], 'top_right': [1750, 260]}}
+    assert chain['s02'].check_consistency(detected, {}, None, 800, p, 'target', stripes, 'barycentre', None, None,
+                                          {}, None) == []
+    assert 'skipped: no image with four fiducials' in capsys.readouterr().out
+
+
+def test_redecide(chain, tmp_path, monkeypatch):
+    data = make_dataset(str(tmp_path), decoy=(1, 1, (-500, 350)), hidden=(2, 3))
+    fiducialmarks_file = run_detection(chain, data, str(tmp_path))
+    with open(fiducialmarks_file) as f:
+        expected = f.read()
+    expected_rows = read_fiducial_csv(fiducialmarks_file)
+    expected_checks = to_be_checked(fiducialmarks_file)
+    assert ['scan_02_CanvasSized.tif', 'bot_left'] in expected_checks
+
+    # same threshold: same csv, without matching
+    monkeypatch.setattr(chain['s02'], 'Redecide', True)
+    monkeypatch.setattr(chain['s02'], 'Main', None)
+    run_detection(chain, data, str(tmp_path))
+    with open(fiducialmarks_file) as f:
+        assert f.read() == expected
+    assert sorted(to_be_checked(fiducialmarks_file)) == sorted(expected_checks)
+
+    # higher threshold: all the corners to check (coordinates kept); then back to the threshold of the detection
+    parameters_02 = chain['s02'].parameters_02
+    set_parameters(monkeypatch, chain['s02'], MatchingValueThreshold=0.999)
+    run_detection(chain, data, str(tmp_path))
+    assert read_fiducial_csv(fiducialmarks_file) == expected_rows
+    assert len(to_be_checked(fiducialmarks_file)) >= 4 * len(data['truth']) - 1
+    monkeypatch.setattr(chain['s02'], 'parameters_02', parameters_02)
+    run_detection(chain, data, str(tmp_path))
+    with open(fiducialmarks_file) as f:
+        assert f.read() == expected
+    assert sorted(to_be_checked(fiducialmarks_file)) == sorted(expected_checks)
+
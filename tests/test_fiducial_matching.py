@@ -0,0 +1,120 @@
+"""
+The faster matchings of GAPP_FiducialMatching must find the same peaks as a full resolution cv2.matchTemplate: the
+coarse-to-fine search, the template bank (all the templates of a corner at once) and the band of the larger window
+of the second try. The sub-pixel centre of a mark is checked on synthetic marks drawn at known positions.
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+import GAPP_FiducialMatching_v101 as fm
+from conftest import draw_fiducial, background, template_size
+
+
+def to_8bit(img):
+    return (img / 256).astype(np.uint8)
+
+
+def corner_image(u, v, size=800, seed=0, value=60000):
+    rng = np.random.default_rng(seed)
+    img = background(rng, size, size)
+    draw_fiducial(img, u, v, value)
+    return to_8bit(np.clip(img, 0, 65535))
+
+
+def template(radius_scale=1.0, angle=0.0):
+    img = np.full((template_size, template_size), 14000.0)
+    draw_fiducial(img, template_size / 2, template_size / 2, 60000)
+    if radius_scale != 1.0 or angle != 0.0:
+        M = cv2.getRotationMatrix2D((template_size / 2, template_size / 2), angle, radius_scale)
+        img = cv2.warpAffine(img, M, (template_size, template_size), borderMode=cv2.BORDER_REPLICATE)
+    return to_8bit(img)
+
+
+@pytest.mark.parametrize('u, v', [(300.0, 420.0), (91.3, 705.6), (610.7, 123.2)])
+def test_pyramid_same_as_full_search(u, v):
+    image, tmpl = corner_image(u, v), template()
+    full = fm.full_search(image, tmpl)
+    coarse = fm.pyramid_search(image, tmpl)
+    assert abs(coarse[0] - full[0]) <= fm.ValueTolerance
+    assert max(abs(coarse[1][0] - full[1][0]), abs(coarse[1][1] - full[1][1])) <= fm.LocationTolerance
+    assert abs(full[1][0] + template_size / 2 - u) <= 1 and abs(full[1][1] + template_size / 2 - v) <= 1
+
+
+def test_pyramid_matches_checked(monkeypatch):
+    monkeypatch.setattr(fm, 'PyramidVerifyEvery', 2)
+    fm.pop_pyramid_stats()
+    image, tmpl = corner_image(300.0, 420.0), template()
+    for i in range(4):
+        maxVal, maxLoc = fm.match_template(image, tmpl)
+        full = fm.full_search(image, tmpl)
+        assert maxLoc == full[1] and abs(maxVal - full[0]) <= fm.ValueTolerance
+    assert fm.pop_pyramid_stats() == {'matches': 4, 'verified': 2, 'missed': 0}
+
+
+@pytest.mark.parametrize('pyramid', [False, True])
+def test_bank_same_as_separate_matches(pyramid):
+    image = corner_image(407.4, 388.8)
+    templates = {'small': template(0.8), 'exact': template(), 'rotated': template(1.0, 20.0),
+                 'large': template(1.25)}
+    bank = fm.TemplateBank({'top_left': templates}, pyramid=pyramid)
+    ranking = bank.rank(image, 'top_left')
+    assert [name for name, _, _ in ranking][0] == 'exact'
+    for name, maxVal, maxLoc in ranking:
+        full = fm.full_search(image, templates[name])
+        assert abs(maxVal - full[0]) <= (1e-4 if not pyramid else fm.ValueTolerance), name
+        if name == 'exact' or not pyramid:
+            assert maxLoc == full[1], name
+    assert [maxVal for _, maxVal, _ in ranking] == sorted([maxVal for _, maxVal, _ in ranking], reverse=True)
+
+
+@pytest.mark.parametrize('u, v', [(450.0, 500.0), (1000.0, 1020.0), (120.0, 950.0)])
+def test_band_retry_same_as_full_search(u, v):
+    # second try: larger window (1100 pixels) containing the first one (800 pixels, at offset 150, 200)
+    large = corner_image(u, v, size=1100, seed=1)
+    tmpl = template()
+    dv, du, size = 150, 200, 800
+    first = fm.full_search(large[dv:dv + size, du:du + size], tmpl)
+    inner = (dv, du, dv + size - template_size + 1, du + size - template_size + 1)
+    band = fm.match_template_band(large, tmpl, inner, pyramid=False)
+    best = max([(first[0], (first[1][0] + du, first[1][1] + dv)), band], key=lambda match: match[0])
+    assert best == fm.full_search(large, tmpl)
+
+
+def test_band_without_common_positions():
+    assert fm.band_rectangles((10, 12), None) == [(0, 0, 10, 12)]
+    assert fm.band_rectangles((10, 12), (20, 20, 30, 30)) == [(0, 0, 10, 12)]
+    rectangles = fm.band_rectangles((10, 12), (2, 3, 6, 8))
+    assert sum((v1 - v0) * (u1 - u0) for v0, u0, v1, u1 in rectangles) == 10 * 12 - 4 * 5
+
+
+def test_subpixel_peak_of_parabola():
+    u, v = np.meshgrid(np.arange(9), np.arange(7))
+    res = 1 - 0.01 * ((u - 4.3) ** 2 + (v - 2.8) ** 2)
+    assert np.allclose(fm.subpixel_peak(res, (4, 3)), (4.3, 2.8))
+
+
+def target_mark(u, v, size=200, supersampling=8):
+    """
+    Target mark (ring and cross) centred on (u, v) exactly: drawn analytically on a supersampled grid (OpenCV draws
+    the thick shapes at integer positions)
+    """
+    steps = (np.arange(size * supersampling) + 0.5) / supersampling - 0.5
+    y, x = np.meshgrid(steps - v, steps - u, indexing='ij')
+    cross = ((np.abs(x) < 2) | (np.abs(y) < 2)) & (np.maximum(np.abs(x), np.abs(y)) < 60)
+    mark = (np.abs(np.hypot(x, y) - 40) < 3) | cross
+    return mark.reshape(size, supersampling, size, supersampling).mean(axis=(1, 3))
+
+
+@pytest.mark.parametrize('u, v', [(100.3, 99.6), (100.0, 100.0), (99.55, 100.45)])
+def test_symmetry_centre(u, v):
+    rng = np.random.default_rng(2)
+    img = 50 + 180 * target_mark(u, v) + rng.normal(0, 3, (200, 200))
+    x, y = fm.symmetry_centre(np.clip(img, 0, 255).astype(np.uint8), round(u), round(v))
+    assert np.hypot(x - u, y - v) < 0.1
+
+
+def test_symmetry_rejects_flat_patch():
+    img = np.random.default_rng(3).integers(0, 20, (200, 200)).astype(np.uint8) # no mark: no clear symmetry
+    assert fm.symmetry_centre(img, 100.4, 99.7) == (100.4, 99.7)
@@ -0,0 +1,94 @@
+"""
+The fused execution of the chain (GAPP_FusedPipeline) must give the same fiducial csv and the same images as the
+scripts 01 to 04 run one after the other; with ComposedResampling, the same images as SCRIPT 03 in composed mode
+"""
+
+import os
+
+import numpy as np
+
+from conftest import make_dataset, read_fiducial_csv, read_images, run_step_by_step, run_fused, camera, scale_percent
+
+
+def test_fused_same_as_step_by_step(chain, tmp_path):
+    data = make_dataset(str(tmp_path))
+    csv_steps = run_step_by_step(chain, data, str(tmp_path / 'steps'))
+    csv_fused = run_fused(chain, data, str(tmp_path / 'fused'))
+
+    rows = read_fiducial_csv(csv_steps)
+    assert sorted(rows) == ['scan_%02d_CanvasSized' % i for i in range(len(data['truth']))]
+    for name, quad in data['truth'].items(): # the synthetic fiducials are found
+        found = np.reshape(rows[os.path.splitext(name)[0] + '_CanvasSized'], (4, 2))
+        assert np.abs(found - quad).max() < 3
+    assert read_fiducial_csv(csv_fused) == rows
+
+    expected = read_images(str(tmp_path / 'steps' / '03_Resized'))
+    result = read_images(str(tmp_path / 'fused' / '03_Resized'))
+    assert sorted(result) == sorted(expected) and len(expected) == len(data['truth'])
+    for name in expected:
+        assert np.array_equal(result[name], expected[name]), name
+
+
+def test_fused_rerun_skips_images(chain, tmp_path, capsys):
+    data = make_dataset(str(tmp_path))
+    csv_fused = run_fused(chain, data, str(tmp_path / 'fused'), Incremental=True)
+    rows = read_fiducial_csv(csv_fused)
+    capsys.readouterr()
+
+    run_fused(chain, data, str(tmp_path / 'fused'), Incremental=True)
+    assert 'skipped): ' + str(len(data['truth'])) in capsys.readouterr().out
+    assert read_fiducial_csv(csv_fused) == rows
+
+
+def test_fused_consistency_check(chain, tmp_path):
+    # a cleaner mark 600 pixels away from the (noisy) top-right fiducial of one scan is matched first: the
+    # consistency check finds the fiducial again, in the csv and in the reprojected image, as step by step
+    data = make_dataset(str(tmp_path), decoy=(1, 1, (-500, 350)))
+    csv_steps = run_step_by_step(chain, data, str(tmp_path / 'steps'))
+    csv_fused = run_fused(chain, data, str(tmp_path / 'fused'))
+
+    rows = read_fiducial_csv(csv_fused)
+    assert rows == read_fiducial_csv(csv_steps)
+    found = np.reshape(rows['scan_01_CanvasSized'], (4, 2))
+    assert np.abs(found - data['truth']['scan_01.tif']).max() < 8 # blurred and noisy fiducial, not the decoy
+    expected = read_images(str(tmp_path / 'steps' / '03_Resized'))
+    result = read_images(str(tmp_path / 'fused' / '03_Resized'))
+    for name in expected:
+        assert np.array_equal(result[name], expected[name]), name
+
+
+def run_composed(chain, csv_steps, output, HistoCal=True, SharpeningIntensity=2):
+    """
+    SCRIPT 03 in composed mode (reprojected and downscaled at once) on the canvas-sized images of run_step_by_step
+    """
+    canvas_sized = os.path.dirname(csv_steps)
+    chain['s03'].main_script_03(canvas_sized, output, csv_steps, camera, False, scale_percent, HistoCal,
+                                SharpeningIntensity)
+    return read_images(output)
+
+
+def test_fused_composed_same_as_script_03(chain, tmp_path):
+    data = make_dataset(str(tmp_path))
+    csv_steps = run_step_by_step(chain, data, str(tmp_path / 'steps'))
+    expected = run_composed(chain, csv_steps, str(tmp_path / 'composed'))
+    run_fused(chain, data, str(tmp_path / 'fused'), ComposedResampling=True)
+
+    result = read_images(str(tmp_path / 'fused' / '03_Resized'))
+    assert sorted(result) == sorted(expected) and len(expected) == len(data['truth'])
+    for name in expected:
+        assert np.array_equal(result[name], expected[name]), name
+
+
+def test_composed_close_to_two_steps(chain, tmp_path):
+    # one resampling instead of two: not the same pixels, but the same image (without the CLAHE, which stretches the
+    # noise of the synthetic scans)
+    data = make_dataset(str(tmp_path))
+    csv_steps = run_step_by_step(chain, data, str(tmp_path / 'steps'), HistoCal=False, SharpeningIntensity=0)
+    result = run_composed(chain, csv_steps, str(tmp_path / 'composed'), HistoCal=False, SharpeningIntensity=0)
+
+    expected = read_images(str(tmp_path / 'steps' / '03_Resized'))
+    assert sorted(result) == sorted(expected) and len(expected) == len(data['truth'])
+    for name in expected:
+        assert result[name].shape == expected[name].shape, name
+        difference = np.abs(result[name].astype(float) - expected[name].astype(float))
+        assert difference.mean() < 0.01 * 65535, name
@@ -0,0 +1,78 @@
+"""
+The windows read from the TIFF files (GAPP_ImageIO, WindowedTiff) must be the same as the windows of the image read
+with cv2.imread, for the files written by the chain and by OpenCV
+"""
+
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from GAPP_ImageIO_v101 import WindowedTiff, TiledTiffWriter, open_windowed, write_windowed, windowed_write_params
+
+windows = [(0, 1, 0, 1), (0, 300, 0, 250), (90, 420, 200, 530), (263, 517, 400, 700), (500, 517, 0, 700),
+           (0, 517, 0, 700)] # (v0, v1, u0, u1), with shared strips/tiles and partial tiles at the borders
+
+
+def random_image(shape, dtype, seed=0):
+    rng = np.random.default_rng(seed)
+    smooth = cv2.resize(rng.random((shape[0] // 50 + 2, shape[1] // 50 + 2)), (shape[1], shape[0]))
+    img = smooth * np.iinfo(dtype).max * 0.8 + rng.integers(0, np.iinfo(dtype).max // 10, shape[:2])
+    if len(shape) == 3:
+        img = np.dstack([np.roll(img, 7 * band, axis=1) for band in range(shape[2])])
+    return img.astype(dtype)
+
+
+def check_windows(path, img):
+    windowed = open_windowed(path)
+    assert isinstance(windowed, WindowedTiff)
+    assert windowed.shape == img.shape and windowed.dtype == img.dtype
+    for v0, v1, u0, u1 in windows + windows[::-1]: # read again from the cache of the previous window
+        assert np.array_equal(windowed[v0:v1, u0:u1], img[v0:v1, u0:u1]), (v0, v1, u0, u1)
+
+
+@pytest.mark.parametrize('shape, dtype', [((517, 700), np.uint16), ((517, 700), np.uint8),
+                                          ((517, 700, 3), np.uint8), ((517, 700, 4), np.uint16)])
+def test_write_windowed(tmp_path, shape, dtype):
+    img = random_image(shape, dtype)
+    path = str(tmp_path / 'canvas.tif')
+    write_windowed(path, img)
+    assert np.array_equal(cv2.imread(path, cv2.IMREAD_UNCHANGED), img) # tiled, readable by the other scripts
+    check_windows(path, img)
+
+
+@pytest.mark.parametrize('params', [windowed_write_params, [cv2.IMWRITE_TIFF_COMPRESSION, 1],
+                                    windowed_write_params + [cv2.IMWRITE_TIFF_ROWSPERSTRIP, 64]])
+def test_opencv_strips(tmp_path, params):
+    img = random_image((517, 700), np.uint16)
+    path = str(tmp_path / 'scan.tif')
+    cv2.imwrite(path, img, params)
+    check_windows(path, img)
+
+
+def test_other_files_read_entirely(tmp_path):
+    img = random_image((517, 700), np.uint16)
+    path = str(tmp_path / 'scan.tif')
+    cv2.imwrite(path, img) # LZW
+    assert np.array_equal(open_windowed(path), img)
+
+    img = img.astype(np.float32) # not tiled by write_windowed
+    path = str(tmp_path / 'canvas.tif')
+    write_windowed(path, img)
+    assert np.array_equal(open_windowed(path), img)
+
+
+def test_tiled_writer_any_order(tmp_path):
+    img = random_image((517, 700, 3), np.uint16)
+    path = str(tmp_path / 'tiled.tif')
+    size = 128
+    with TiledTiffWriter(path, img.shape[1], img.shape[0], img.dtype, 3, size) as writer:
+        tiles = [(row, col) for row in range(writer.tiles_down) for col in range(writer.tiles_across)]
+        for row, col in tiles[::-1][:-1]: # the first tile is not written: black
+            writer.write_tile(row, col, img[row * size:(row + 1) * size, col * size:(col + 1) * size])
+    expected = img.copy()
+    expected[:size, :size] = 0
+    assert np.array_equal(cv2.imread(path, cv2.IMREAD_UNCHANGED), expected)
+    assert os.path.getsize(path) > img.nbytes # uncompressed
+    check_windows(path, expected)